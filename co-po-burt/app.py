@@ -1,14 +1,44 @@
+import io
+
+import math
+
+import os
+
+from pathlib import Path
+
+
+
 import streamlit as st
 
 import pandas as pd
 
-from src.io_utils import load_thresholds, load_targets
+import pyarrow as pa
+
+from src.io_utils import load_thresholds, load_targets, validate_inputs, harmonize_keys
+
+from src.io_utils import prepare_co_attainment, prepare_mapping, prepare_student_co_scores
 
-from src.nba_math import compute_po_attainment_nba
+from src.nba_math import compute_po_aggregates, finalize_po_attainment, sweep_targets
 
 from src.burt import compute_burt_adjustments_from_students
 
-from src.nlp_mapping import generate_co_po_mapping
+from src.store import open_store, po_trend
+
+from src import telemetry
+
+from src.nlp_mapping import (
+
+    generate_co_po_mapping,
+
+    explain_co_po_mapping,
+
+    read_statement_csv,
+
+    CO_ID_KEYWORDS,
+
+    PO_ID_KEYWORDS,
+
+)
 
 
 
@@ -16,10 +46,256 @@ st.set_page_config(page_title="CO–PO Attainment System", layout="wide")
 
 
 
+# COPO_METRICS=1 turns telemetry on; COPO_METRICS_FILE / COPO_OTLP_ENDPOINT are written at the
+
+# start of every rerun (st.stop() skips the end of the script), so they lag by one interaction.
+
+# Spans go out from a background thread so reruns never wait on the collector.
+
+telemetry.flush(wait=False)
+
+telemetry.inc("copo_dashboard_events_total", event="rerun")
+
+
+
 st.title("CO–PO / PSO Attainment Dashboard")
 
 
 
+
+
+@st.cache_data(show_spinner=False)
+
+def read_statements(data: bytes, keywords: tuple, id_col=None, text_col=None):
+
+    # cached on file bytes + pinned columns, so reruns don't re-parse the upload
+
+    return read_statement_csv(io.BytesIO(data), keywords, id_col=id_col, text_col=text_col)
+
+
+
+
+
+@st.cache_data(show_spinner=False)
+
+def cached_po_aggregates(co_df, map_df, att_type, assoc):
+
+    # target-independent merge/groupby; what-if sliders only re-run finalize_po_attainment
+
+    telemetry.inc("copo_dashboard_events_total", event="recompute", fn="po_aggregates")
+
+    return compute_po_aggregates(co_df, map_df, attainment_type=att_type, assoc=assoc)
+
+
+
+
+
+@st.cache_data(show_spinner="Computing mapping...")
+
+def cached_mapping(co_text_df, po_text_df, method, near_dup_threshold, checkpoint_dir=None):
+
+    # pagination/filter widgets rerun the script; don't re-encode every time
+
+    telemetry.inc("copo_dashboard_events_total", event="recompute", fn="mapping")
+
+    return generate_co_po_mapping(
+
+        co_text_df,
+
+        po_text_df,
+
+        method=method,
+
+        near_dup_threshold=near_dup_threshold,
+
+        co_cols=tuple(co_text_df.columns),
+
+        po_cols=tuple(po_text_df.columns),
+
+        checkpoint_dir=checkpoint_dir,
+
+    )
+
+
+
+
+
+@st.cache_data(show_spinner="Computing mapping and explanations...")
+
+def cached_explained_mapping(co_text_df, po_text_df, near_dup_threshold):
+
+    # one BERT pass for both tables; reruns reuse them like cached_mapping
+
+    telemetry.inc("copo_dashboard_events_total", event="recompute", fn="explained_mapping")
+
+    return explain_co_po_mapping(
+
+        co_text_df,
+
+        po_text_df,
+
+        near_dup_threshold=near_dup_threshold,
+
+        co_cols=tuple(co_text_df.columns),
+
+        po_cols=tuple(po_text_df.columns),
+
+    )
+
+
+
+
+
+@st.cache_data(show_spinner=False)
+
+def to_csv_bytes(df: pd.DataFrame) -> bytes:
+
+    return df.to_csv(index=False).encode("utf-8")
+
+
+
+
+
+@st.cache_data(show_spinner=False)
+
+def to_parquet_bytes(df: pd.DataFrame) -> bytes:
+
+    buf = io.BytesIO()
+
+    df.to_parquet(buf, index=False)
+
+    return buf.getvalue()
+
+
+
+
+
+def filter_rows(df: pd.DataFrame, query: str) -> pd.DataFrame:
+
+    """
+
+    Case-insensitive substring filter over the text/categorical columns.
+
+    Categorical columns are matched on their categories, not row by row.
+
+    """
+
+    if not query:
+
+        return df
+
+    mask = pd.Series(False, index=df.index)
+
+    for col in df.columns:
+
+        s = df[col]
+
+        if isinstance(s.dtype, pd.CategoricalDtype):
+
+            hits = s.cat.categories.astype(str).str.contains(query, case=False, regex=False)
+
+            mask |= s.isin(s.cat.categories[hits])
+
+        elif s.dtype == object or pd.api.types.is_string_dtype(s):
+
+            mask |= s.astype(str).str.contains(query, case=False, regex=False)
+
+    return df[mask]
+
+
+
+
+
+def show_table(df: pd.DataFrame, key: str, page_size: int = 50, index: bool = False) -> None:
+
+    """
+
+    Renders one page of df (filtered server side) as an Arrow table;
+
+    the full frame is only serialized when a download is requested.
+
+    """
+
+    if index:
+
+        df = df.reset_index()
+
+    if len(df) > page_size:
+
+        c1, c2 = st.columns([3, 1])
+
+        df = filter_rows(df, c1.text_input("Filter", key=f"{key}_filter", placeholder="contains..."))
+
+        n_pages = max(1, math.ceil(len(df) / page_size))
+
+        page = int(c2.number_input("Page", min_value=1, max_value=n_pages, value=1, key=f"{key}_page"))
+
+        start = (page - 1) * page_size
+
+        st.caption(f"Rows {min(start + 1, len(df))}–{min(start + page_size, len(df))} of {len(df)}")
+
+        page_df = df.iloc[start : start + page_size]
+
+    else:
+
+        page_df = df
+
+    st.dataframe(pa.Table.from_pandas(page_df, preserve_index=False), use_container_width=True)
+
+
+
+    if st.checkbox("Prepare full download", key=f"{key}_dl"):
+
+        d1, d2 = st.columns(2)
+
+        d1.download_button("CSV", to_csv_bytes(df), file_name=f"{key}.csv", mime="text/csv", key=f"{key}_csv")
+
+        d2.download_button(
+
+            "Parquet", to_parquet_bytes(df), file_name=f"{key}.parquet",
+
+            mime="application/octet-stream", key=f"{key}_parquet",
+
+        )
+
+
+
+
+
+def pin_columns(label: str, uploaded) -> tuple:
+
+    cols = list(pd.read_csv(io.BytesIO(uploaded.getvalue()), encoding="latin1", nrows=0).columns)
+
+    with st.sidebar.expander(f"{label} columns"):
+
+        id_col = st.selectbox(f"{label} ID column", ["(auto)"] + cols, key=f"{label}_id")
+
+        text_col = st.selectbox(f"{label} statement column", ["(auto)"] + cols, key=f"{label}_text")
+
+    return (None if id_col == "(auto)" else id_col, None if text_col == "(auto)" else text_col)
+
+
+
+
+
+def path_under(env_var: str, name: str, label: str) -> str:
+
+    # server paths typed into the dashboard must stay inside a directory configured by env_var
+
+    base = Path(os.environ[env_var]).resolve()
+
+    target = (base / name).resolve()
+
+    if Path(name).is_absolute() or target == base or not target.is_relative_to(base):
+
+        st.sidebar.error(f"{label} must be a name inside {base}")
+
+        st.stop()
+
+    return str(target)
+
+
+
 st.sidebar.header("Mode")
 
 
@@ -52,6 +328,40 @@ if mode == "NLP CO–PO Mapping":
 
 
 
+    sim_mode = st.sidebar.radio(
+
+        "Similarity Engine",
+
+        ["Final (BERT)", "Preview (TF-IDF)"]
+
+    )
+
+    merge_near_dups = st.sidebar.checkbox("Encode near-duplicate statements once", value=False)
+
+    explain = sim_mode.startswith("Final") and st.sidebar.checkbox(
+
+        "Explain non-zero weights (top token pairs)", value=False
+
+    )
+
+    # checkpoints only go under COPO_CHECKPOINT_BASE; users pick a subdirectory of it
+
+    checkpoint_dir = None
+
+    if sim_mode.startswith("Final") and os.environ.get("COPO_CHECKPOINT_BASE"):
+
+        checkpoint_name = st.sidebar.text_input(
+
+            "Checkpoint name (resume BERT encoding after a restart)", value=""
+
+        ).strip()
+
+        if checkpoint_name:
+
+            checkpoint_dir = path_under("COPO_CHECKPOINT_BASE", checkpoint_name, "Checkpoint name")
+
+
+
     if not co_text_file or not po_text_file:
 
         st.info("⬅️ Upload CO and PO statement CSVs to generate mapping")
@@ -88,27 +398,57 @@ elif mode == "PO/PSO Attainment Calculation":
 
 if mode == "NLP CO–PO Mapping":
 
-    co_text_df = pd.read_csv(co_text_file, encoding="latin1")
+    co_text_df = read_statements(co_text_file.getvalue(), CO_ID_KEYWORDS, *pin_columns("CO", co_text_file))
+
+    po_text_df = read_statements(po_text_file.getvalue(), PO_ID_KEYWORDS, *pin_columns("PO", po_text_file))
+
+
+
+    # dashboard cache hit rate = 1 - recompute / lookup
+
+    if explain:
+
+        # explanations come from the mapping's own token states (no checkpointing in this mode)
+
+        telemetry.inc("copo_dashboard_events_total", event="lookup", fn="explained_mapping")
+
+        mapping_df, explain_df = cached_explained_mapping(co_text_df, po_text_df, 0.8 if merge_near_dups else None)
+
+    else:
+
+        telemetry.inc("copo_dashboard_events_total", event="lookup", fn="mapping")
+
+        mapping_df = cached_mapping(
+
+            co_text_df,
 
-    po_text_df = pd.read_csv(po_text_file, encoding="latin1")
+            po_text_df,
 
+            "tfidf" if sim_mode.startswith("Preview") else "bert",
 
+            0.8 if merge_near_dups else None,
 
-    # Debug: show column names
+            checkpoint_dir,
 
-    st.write("CO cols:", list(co_text_df.columns))
+        )
 
-    st.write("PO cols:", list(po_text_df.columns))
+    stats = mapping_df.attrs.get("prefilter", {})
 
+    if stats:
 
+        st.caption(
 
-    mapping_df = generate_co_po_mapping(co_text_df, po_text_df)
+            f"Encoded {stats['co_encoded']}/{stats['co_statements']} CO and "
+
+            f"{stats['po_encoded']}/{stats['po_statements']} PO statements ({stats['method']})"
+
+        )
 
 
 
     st.subheader("Generated CO–PO / PSO Mapping (NLP)")
 
-    st.dataframe(mapping_df, use_container_width=True)
+    show_table(mapping_df, "co_po_mapping")
 
 
 
@@ -120,7 +460,7 @@ if mode == "NLP CO–PO Mapping":
 
         st.warning("Duplicate (co, outcome) pairs found. Showing examples below.")
 
-        st.dataframe(mapping_df.loc[dups].sort_values(["co", "outcome"]).head(50))
+        show_table(mapping_df.loc[dups].sort_values(["co", "outcome"]), "duplicate_pairs")
 
 
 
@@ -142,7 +482,15 @@ if mode == "NLP CO–PO Mapping":
 
     st.subheader("CO × PO Matrix (0–3)")
 
-    st.dataframe(pivot, use_container_width=True)
+    show_table(pivot, "co_po_matrix", index=True)
+
+
+
+    if explain:
+
+        st.subheader("Why these weights? (top CO/PO token pairs)")
+
+        show_table(explain_df, "mapping_explanations")
 
 
 
@@ -160,9 +508,19 @@ elif mode == "PO/PSO Attainment Calculation":
 
     # --------------------
 
-    co_df = pd.read_csv(co_file)
+    # same key normalization as the run.py loaders (trimmed, upper-cased CO ids)
+
+    try:
+
+        co_df = prepare_co_attainment(pd.read_csv(co_file))
 
-    map_df = pd.read_csv(map_file)
+        map_df = prepare_mapping(pd.read_csv(map_file))
+
+    except ValueError as e:
+
+        st.error(f"Could not read inputs: {e}")
+
+        st.stop()
 
     thresholds = load_thresholds(threshold_file)
 
@@ -212,7 +570,7 @@ elif mode == "PO/PSO Attainment Calculation":
 
     use_burt = st.sidebar.checkbox("Use Burt Adjustment", value=False)
 
-    student_file = None
+    stu_df = None
 
     if use_burt:
 
@@ -224,7 +582,15 @@ elif mode == "PO/PSO Attainment Calculation":
 
             st.stop()
 
-        stu_df = pd.read_csv(student_file)
+        try:
+
+            stu_df = prepare_student_co_scores(pd.read_csv(student_file))
+
+        except ValueError as e:
+
+            st.error(f"Could not read student CO scores: {e}")
+
+            st.stop()
 
         stu_df = stu_df[
 
@@ -234,11 +600,43 @@ elif mode == "PO/PSO Attainment Calculation":
 
         ]
 
-        assoc = compute_burt_adjustments_from_students(stu_df, thresholds)
+        co_df, map_df, stu_df = harmonize_keys(co_df, map_df, stu_df)
 
     else:
 
-        assoc = None
+        co_df, map_df = harmonize_keys(co_df, map_df)
+
+
+
+    # Validate the selection before any compute (other courses/years in the uploads don't count)
+
+    report = validate_inputs(co_df, map_df, thresholds, targets, student_co_scores=stu_df)
+
+    with st.expander(
+
+        f"Input validation: {report['n_errors']} error(s), {report['n_warnings']} warning(s)",
+
+        expanded=not report["ok"],
+
+    ):
+
+        for issue in report["issues"]:
+
+            show = st.error if issue["severity"] == "error" else st.warning
+
+            show(f"{issue['table']}.{issue['rule']}: {issue['count']} row(s) - {issue['message']}")
+
+            if not issue["sample"].empty:
+
+                st.dataframe(issue["sample"], use_container_width=True)
+
+    if not report["ok"]:
+
+        st.stop()
+
+
+
+    assoc = compute_burt_adjustments_from_students(stu_df, thresholds) if stu_df is not None else None
 
 
 
@@ -248,19 +646,45 @@ elif mode == "PO/PSO Attainment Calculation":
 
     # --------------------
 
-    results = compute_po_attainment_nba(
+    telemetry.inc("copo_dashboard_events_total", event="lookup", fn="po_aggregates")
+
+    aggregates = cached_po_aggregates(co_df, map_df, att_type, assoc)
+
+
+
+    # --------------------
+
+    # What-if targets / thresholds
+
+    # --------------------
+
+    st.sidebar.header("What-if")
+
+    scale_max = float(targets.get("scale_max", 3.0))
+
+    target_level = st.sidebar.slider("Target level", 0.0, scale_max, float(targets.get("target_level", 1.4)), 0.05)
+
+    l3 = st.sidebar.slider("Level 3 from", 0.0, 1.0, float(thresholds[3]), 0.01)
+
+    l2 = st.sidebar.slider("Level 2 from", 0.0, 1.0, float(thresholds[2]), 0.01)
+
+    l1 = st.sidebar.slider("Level 1 from", 0.0, 1.0, float(thresholds[1]), 0.01)
+
+    if not l3 > l2 > l1:
+
+        st.error(f"Level thresholds must satisfy Level 3 > Level 2 > Level 1 (got {l3:g}, {l2:g}, {l1:g})")
+
+        st.stop()
 
-        co_attainment=co_df,
 
-        mapping=map_df,
 
-        thresholds=thresholds,
+    results = finalize_po_attainment(
 
-        targets=targets,
+        aggregates,
 
-        attainment_type=att_type,
+        thresholds={3: l3, 2: l2, 1: l1},
 
-        assoc=assoc,
+        targets={**targets, "target_level": target_level},
 
     )
 
@@ -274,31 +698,91 @@ elif mode == "PO/PSO Attainment Calculation":
 
     st.subheader("CO Attainment (Used)")
 
-    st.dataframe(results["co_attainment_used"], use_container_width=True)
+    show_table(results["co_attainment_used"], "co_attainment_used")
 
 
 
     st.subheader("CO Attainment Levels")
 
-    st.dataframe(results["co_report"], use_container_width=True)
+    show_table(results["co_report"], "co_report_with_levels")
 
 
 
     st.subheader("PO / PSO Attainment (Scale of 3)")
 
-    st.dataframe(results["po_matrix_scale"], use_container_width=True)
+    show_table(results["po_matrix_scale"], "po_pso_matrix_scale_of_3")
+
+
+
+    st.subheader(f"Target Achievement (≥ {target_level:g})")
+
+    show_table(results["po_matrix_target"], "po_pso_matrix_target_YN")
 
 
 
-    st.subheader("Target Achievement (≥ 1.4)")
+    st.subheader("Outcomes Meeting Target vs Target Level")
 
-    st.dataframe(results["po_matrix_target"], use_container_width=True)
+    sweep = sweep_targets(aggregates, target_levels=[round(x * 0.1, 2) for x in range(int(scale_max * 10) + 1)],
+
+                          scale_maxes=[scale_max])
+
+    met_by_target = sweep["target_summary"].groupby("target_level")[["n_met", "n_total"]].sum()
+
+    st.line_chart(met_by_target["n_met"] / met_by_target["n_total"])
 
 
 
     st.subheader("PO / PSO Attainment (%)")
 
-    st.dataframe(results["po_matrix_pct"], use_container_width=True)
+    show_table(results["po_matrix_pct"], "po_pso_matrix_percent")
+
+
+
+    # --------------------
+
+    # History (optional SQLite store written by run.py --store, under COPO_STORE_BASE)
+
+    # --------------------
+
+    store_name = ""
+
+    if os.environ.get("COPO_STORE_BASE"):
+
+        store_name = st.sidebar.text_input("History store (SQLite file)", value="").strip()
+
+    if store_name:
+
+        store_path = path_under("COPO_STORE_BASE", store_name, "History store")
+
+        try:
+
+            conn = open_store(store_path, create=False)
+
+        except (FileNotFoundError, ValueError) as e:
+
+            st.error(str(e))
+
+            st.stop()
+
+        outcomes = sorted(results["po_long"]["outcome"].astype(str).unique())
+
+        outcome = st.selectbox("Trend outcome", outcomes)
+
+        trend = po_trend(conn, outcome, course=str(course), attainment_type=str(att_type))
+
+        conn.close()
+
+        st.subheader(f"{outcome} Attainment Trend ({course})")
+
+        if trend.empty:
+
+            st.info("No stored runs for this course/outcome yet")
+
+        else:
+
+            st.line_chart(trend.set_index("year")["attainment_scale"])
+
+            st.dataframe(trend, use_container_width=True)
 
 
 
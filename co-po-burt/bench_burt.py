@@ -0,0 +1,115 @@
+import argparse
+
+import os
+
+import time
+
+
+
+import numpy as np
+
+import pandas as pd
+
+
+
+from src.burt import compute_burt_adjustments_from_students
+
+
+
+
+
+def synthetic_scores(n_courses: int, n_cos: int, n_students: int, seed: int = 0) -> pd.DataFrame:
+
+    rng = np.random.default_rng(seed)
+
+    n = n_courses * n_cos * n_students
+
+    df = pd.DataFrame({
+
+        "year": 2024,
+
+        "course": np.repeat([f"C{i:04d}" for i in range(n_courses)], n_cos * n_students),
+
+        "student_id": np.tile(np.repeat([f"S{i:05d}" for i in range(n_students)], n_cos), n_courses),
+
+        "co": np.tile([f"CO{i + 1}" for i in range(n_cos)], n_courses * n_students),
+
+        "co_pct": rng.beta(5, 3, n),
+
+    })
+
+    # shuffle so the parallel path has to do the (course, co) sort itself
+
+    df = df.sample(frac=1.0, random_state=seed, ignore_index=True)
+
+    for col in ("course", "student_id", "co"):
+
+        df[col] = df[col].astype("category")
+
+    return df
+
+
+
+
+
+def main():
+
+    p = argparse.ArgumentParser(description="Scaling benchmark for parallel BURT confidence")
+
+    p.add_argument("--courses", type=int, default=2000)
+
+    p.add_argument("--cos", type=int, default=6)
+
+    p.add_argument("--students", type=int, default=120)
+
+    p.add_argument("--jobs", type=str, default="1,2,4,8,16", help="Comma-separated worker counts; n_jobs=1 always runs first as the reference")
+
+    p.add_argument("--repeat", type=int, default=3, help="Best of N timings")
+
+    args = p.parse_args()
+
+
+
+    df = synthetic_scores(args.courses, args.cos, args.students)
+
+    print(f"{len(df):,} student/CO rows, {args.courses * args.cos:,} (course, co) groups, "
+
+          f"{os.cpu_count()} CPUs available")
+
+
+
+    # the serial result is the reference for both the timings and identical=
+
+    jobs = [1] + [j for j in dict.fromkeys(int(j) for j in args.jobs.split(",")) if j != 1]
+
+    serial = None
+
+    base = None
+
+    for n_jobs in jobs:
+
+        best = float("inf")
+
+        for _ in range(args.repeat):
+
+            start = time.perf_counter()
+
+            out = compute_burt_adjustments_from_students(df, thresholds={}, n_jobs=n_jobs)
+
+            best = min(best, time.perf_counter() - start)
+
+        if serial is None:
+
+            serial, base = out, best
+
+        identical = out.equals(serial)
+
+        print(f"n_jobs={n_jobs:>2}  {best:8.3f}s  speedup x{base / best:5.2f}  identical={identical}")
+
+
+
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,115 @@
+import argparse
+
+from pathlib import Path
+
+
+
+import pandas as pd
+
+
+
+from src.nlp_mapping import co_redundancy_clusters, co_redundancy_pairs, load_registry
+
+
+
+
+
+def main():
+
+    p = argparse.ArgumentParser(description="Find near-duplicate course outcomes across courses")
+
+    p.add_argument("--co_statements", type=str, required=True, help="CO statements CSV: course, co, statement")
+
+    p.add_argument("--course_col", type=str, default="course", help="Course column of --co_statements")
+
+    p.add_argument("--out", type=str, default="out/co_redundancy.csv",
+
+                   help="Pair report: course_a, co_a, course_b, co_b, sim")
+
+    p.add_argument("--clusters", type=str, default=None, help="Optional cluster report CSV")
+
+    p.add_argument("--top_k", type=int, default=10, help="Neighbours kept per CO")
+
+    p.add_argument("--min_sim", type=float, default=0.9, help="Minimum cosine similarity of a reported pair")
+
+    p.add_argument("--budget_mb", type=float, default=256, help="Memory budget for the similarity blocks")
+
+    p.add_argument("--jobs", type=int, default=1, help="Similarity blocks computed in parallel")
+
+    p.add_argument("--within_course", action="store_true", help="Also report pairs inside one course")
+
+    p.add_argument("--method", type=str, default="bert", choices=["bert", "tfidf"])
+
+    p.add_argument("--model", type=str, default=None, help="Registry name or checkpoint path")
+
+    p.add_argument("--registry", type=str, default=None, help="Model registry JSON to load")
+
+    p.add_argument("--checkpoint_dir", type=str, default=None, help="Resumable BERT encoding directory")
+
+    args = p.parse_args()
+
+
+
+    if args.registry:
+
+        load_registry(args.registry)
+
+    co_df = pd.read_csv(args.co_statements, encoding="latin1")
+
+
+
+    stats = {}
+
+    pairs = co_redundancy_pairs(
+
+        co_df,
+
+        top_k=args.top_k,
+
+        min_sim=args.min_sim,
+
+        memory_budget_mb=args.budget_mb,
+
+        n_jobs=args.jobs,
+
+        cross_course_only=not args.within_course,
+
+        method=args.method,
+
+        course_col=args.course_col,
+
+        model=args.model,
+
+        checkpoint_dir=args.checkpoint_dir,
+
+        stats=stats,
+
+    )
+
+    Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+
+    pairs.to_csv(args.out, index=False)
+
+    print(f"{stats['co_statements']} COs ({stats['co_encoded']} encoded) in {stats.get('blocks', 0)} blocks: "
+
+          f"{len(pairs)} pairs with sim >= {args.min_sim} -> {args.out}")
+
+
+
+    if args.clusters:
+
+        clusters = co_redundancy_clusters(pairs)
+
+        Path(args.clusters).parent.mkdir(parents=True, exist_ok=True)
+
+        clusters.to_csv(args.clusters, index=False)
+
+        print(f"{clusters['cluster'].nunique()} clusters -> {args.clusters}")
+
+
+
+
+
+if __name__ == "__main__":
+
+    main()
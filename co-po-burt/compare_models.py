@@ -0,0 +1,77 @@
+import argparse
+
+
+
+import pandas as pd
+
+
+
+from src.nlp_mapping import compare_models, load_registry, calibrate_model, save_registry
+
+
+
+
+
+def main():
+
+    p = argparse.ArgumentParser(description="Compare embedding models for CO-PO mapping (throughput and agreement)")
+
+    p.add_argument("--co_statements", type=str, required=True, help="CO statements CSV")
+
+    p.add_argument("--po_statements", type=str, required=True, help="PO / PSO statements CSV")
+
+    p.add_argument("--models", type=str, required=True, help="Comma-separated registry names or checkpoint paths")
+
+    p.add_argument("--registry", type=str, default=None, help="Model registry JSON to load (and update with --calibrate)")
+
+    p.add_argument("--reference", type=str, default=None,
+
+                   help="Reference mapping CSV: co,outcome,weight (default: the first model's mapping)")
+
+    p.add_argument("--calibrate", action="store_true",
+
+                   help="Calibrate every model's thresholds against --reference before comparing")
+
+    args = p.parse_args()
+
+
+
+    if args.registry:
+
+        load_registry(args.registry)
+
+    co_df = pd.read_csv(args.co_statements, encoding="latin1")
+
+    po_df = pd.read_csv(args.po_statements, encoding="latin1")
+
+    reference = pd.read_csv(args.reference) if args.reference else None
+
+    models = [m.strip() for m in args.models.split(",") if m.strip()]
+
+
+
+    if args.calibrate:
+
+        if reference is None:
+
+            raise ValueError("--calibrate requires --reference")
+
+        for name in models:
+
+            print(f"{name}: thresholds (t3, t2, t1) = {calibrate_model(name, co_df, po_df, reference)}")
+
+        if args.registry:
+
+            save_registry(args.registry)
+
+
+
+    print(compare_models(co_df, po_df, models, reference=reference).to_string(index=False))
+
+
+
+
+
+if __name__ == "__main__":
+
+    main()
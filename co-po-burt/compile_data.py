@@ -0,0 +1,65 @@
+import argparse
+
+from pathlib import Path
+
+
+
+from src.io_utils import load_co_attainment, load_mapping, load_student_co_scores
+
+from src.compiled import compile_frames
+
+
+
+
+
+def main():
+
+    p = argparse.ArgumentParser(description="Compile normalized inputs into memory-mapped column files")
+
+    p.add_argument("--co_attainment", type=str, default=None, help="CSV: year,course,co,attainment_type,value")
+
+    p.add_argument("--mapping", type=str, default=None, help="CSV: course,co,outcome,weight (0-3)")
+
+    p.add_argument("--student_co_scores", type=str, default=None, help="CSV: year,course,student_id,co,co_pct")
+
+    p.add_argument("--out", type=str, required=True, help="Output directory; a previous compile there is replaced")
+
+    args = p.parse_args()
+
+
+
+    frames = {}
+
+    if args.co_attainment:
+
+        frames["co_attainment"] = load_co_attainment(args.co_attainment)
+
+    if args.mapping:
+
+        frames["mapping"] = load_mapping(args.mapping)
+
+    if args.student_co_scores:
+
+        frames["student_co_scores"] = load_student_co_scores(args.student_co_scores)
+
+    if not frames:
+
+        raise ValueError("Nothing to compile: pass at least one input CSV")
+
+
+
+    outdir = compile_frames(frames, Path(args.out))
+
+    for name in frames:
+
+        print(f"{name}: {outdir / name}")
+
+    print("Pass these directories in place of the CSV paths to run.py / serve.py")
+
+
+
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,61 @@
+import argparse
+
+import sys
+
+
+
+from src.golden import CASES, GOLDEN_DIR, check, format_failures, record
+
+
+
+
+
+def main():
+
+    p = argparse.ArgumentParser(description="Golden-output regression checks for attainment and mapping numerics")
+
+    p.add_argument("command", choices=["check", "record"],
+
+                   help="check: compare against stored goldens; record: (re)write them after an intended change")
+
+    p.add_argument("--case", action="append", choices=sorted(CASES), default=None,
+
+                   help="Limit to one case (repeatable). Default: all")
+
+    p.add_argument("--golden_dir", type=str, default=str(GOLDEN_DIR))
+
+    p.add_argument("--engine", choices=["pandas", "kernels"], default="pandas",
+
+                   help="check only: engine whose results are compared with the (pandas-recorded) goldens")
+
+    p.add_argument("--regenerate-inputs", dest="regenerate", action="store_true",
+
+                   help="record only: also rebuild the stored synthetic inputs")
+
+    args = p.parse_args()
+
+
+
+    if args.command == "record":
+
+        done = record(args.case, golden_dir=args.golden_dir, regenerate=args.regenerate)
+
+        print(f"Recorded {len(done)} case(s) in {args.golden_dir}: {', '.join(done)}")
+
+        return
+
+
+
+    failures = check(args.case, golden_dir=args.golden_dir, engine=args.engine)
+
+    print(format_failures(failures))
+
+    sys.exit(1 if failures else 0)
+
+
+
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,131 @@
+import argparse
+
+import http.client
+
+import json
+
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+
+import numpy as np
+
+import pandas as pd
+
+
+
+
+
+def _payload(args) -> dict:
+
+    if args.endpoint == "/attainment":
+
+        return {"course": args.course, "attainment_type": args.attainment_type}
+
+    if args.endpoint == "/confidence":
+
+        return {"student_co_scores": pd.read_csv(args.student_co_scores).to_dict(orient="records")}
+
+    raise ValueError(f"No sample payload for {args.endpoint}")
+
+
+
+
+
+def _worker(host, port, endpoint, body, n):
+
+    conn = http.client.HTTPConnection(host, port)
+
+    latencies, errors = [], 0
+
+    for _ in range(n):
+
+        start = time.perf_counter()
+
+        conn.request("POST", endpoint, body=body, headers={"Content-Type": "application/json"})
+
+        resp = conn.getresponse()
+
+        resp.read()
+
+        latencies.append((time.perf_counter() - start) * 1000.0)
+
+        errors += resp.status != 200
+
+    conn.close()
+
+    return latencies, errors
+
+
+
+
+
+def main():
+
+    p = argparse.ArgumentParser(description="Local load test for serve.py")
+
+    p.add_argument("--host", type=str, default="127.0.0.1")
+
+    p.add_argument("--port", type=int, default=8000)
+
+    p.add_argument("--endpoint", choices=["/attainment", "/confidence"], default="/attainment")
+
+    p.add_argument("--course", type=str, default=None)
+
+    p.add_argument("--attainment_type", type=str, default="FINAL")
+
+    p.add_argument("--student_co_scores", type=str, default=None, help="CSV for /confidence")
+
+    p.add_argument("--requests", type=int, default=200)
+
+    p.add_argument("--concurrency", type=int, default=8)
+
+    args = p.parse_args()
+
+
+
+    body = json.dumps(_payload(args)).encode("utf-8")
+
+    per_worker = max(1, args.requests // args.concurrency)
+
+
+
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as ex:
+
+        parts = list(ex.map(lambda _: _worker(args.host, args.port, args.endpoint, body, per_worker),
+
+                            range(args.concurrency)))
+
+    elapsed = time.perf_counter() - start
+
+
+
+    lat = np.array([x for part, _ in parts for x in part])
+
+    errors = sum(e for _, e in parts)
+
+    p50, p95, p99 = np.percentile(lat, [50, 95, 99])
+
+    print(f"{len(lat)} requests in {elapsed:.2f}s ({len(lat) / elapsed:.1f} req/s), {errors} errors")
+
+    print(f"latency ms: p50={p50:.1f} p95={p95:.1f} p99={p99:.1f} max={lat.max():.1f}")
+
+
+
+    conn = http.client.HTTPConnection(args.host, args.port)
+
+    conn.request("GET", "/metrics")
+
+    print("server metrics:", conn.getresponse().read().decode("utf-8"))
+
+
+
+
+
+if __name__ == "__main__":
+
+    main()
@@ -1,16 +1,30 @@
 import argparse
 
+import sys
+
 from pathlib import Path
 
 
 
-from src.io_utils import load_co_attainment, load_mapping, load_thresholds, load_targets, load_student_co_scores
+from src.io_utils import load_co_attainment, load_mapping, load_thresholds, load_targets, load_student_co_scores, harmonize_keys, load_hierarchy
+
+from src.io_utils import validate_inputs, format_validation_report, load_question_marks, load_question_co_map
+
+from src.io_utils import load_workbook
+
+from src.marks import student_co_scores_from_marks, co_attainment_from_students
+
+from src.nba_math import compute_po_attainment_nba, compute_po_aggregates
 
-from src.nba_math import compute_po_attainment_nba
+from src.burt import compute_burt_adjustments_from_students, bootstrap_po_attainment
 
-from src.burt import compute_burt_adjustments_from_students
+from src.reporting import write_outputs, write_outputs_xlsx
 
-from src.reporting import write_outputs
+from src.rollup import blend_attainment_types, rollup_po_attainment
+
+from src.store import open_store, ingest_run
+
+from src import telemetry
 
 
 
@@ -20,13 +34,23 @@ def main():
 
     p = argparse.ArgumentParser()
 
-    p.add_argument("--co_attainment", type=str, required=True, help="CSV: year,course,co,attainment_type,value")
+    p.add_argument("--co_attainment", type=str, default=None,
+
+                   help="CSV: year,course,co,attainment_type,value (required unless --marks is given)")
+
+    p.add_argument("--mapping", type=str, default=None, help="CSV: course,co,outcome,weight (0-3)")
+
+    p.add_argument("--thresholds", type=str, default=None, help="CSV: level,min_pct")
 
-    p.add_argument("--mapping", type=str, required=True, help="CSV: course,co,outcome,weight (0-3)")
+    p.add_argument("--targets", type=str, default=None, help="CSV: metric,value")
 
-    p.add_argument("--thresholds", type=str, required=True, help="CSV: level,min_pct")
+    p.add_argument("--workbook", type=str, default=None,
 
-    p.add_argument("--targets", type=str, required=True, help="CSV: metric,value")
+                   help="NBA attainment .xlsx with co_attainment, mapping, thresholds, targets "
+
+                        "[, student_co_scores] sheets; replaces the per-table CSVs")
+
+    p.add_argument("--xlsx", action="store_true", help="Also write all outputs as sheets of outdir/outputs.xlsx")
 
     p.add_argument("--attainment_type", type=str, default="FINAL", help="Which attainment_type to compute PO/PSO from")
 
@@ -42,27 +66,207 @@ def main():
 
                    help="Required for burt_adjust. CSV: year,course,student_id,co,co_pct")
 
+    p.add_argument("--marks", type=str, default=None,
+
+                   help="CSV: year,course,student_id,assessment,question,marks,max_marks. "
+
+                        "Derives CO attainment and student CO scores from raw marks (needs --question_map)")
+
+    p.add_argument("--question_map", type=str, default=None, help="CSV: course,assessment,question,co[,weight]")
+
+    p.add_argument("--pass_pct", type=float, default=0.6,
+
+                   help="A student attains a CO at co_pct >= pass_pct (CO attainment from --marks, "
+
+                        "and the statistic resampled by --bootstrap)")
+
+    p.add_argument("--marks_chunksize", type=int, default=None, help="With --marks: stream the CSV in row chunks")
+
+    p.add_argument("--burt_stats", action="store_true",
+
+                   help="burt_adjust only: add n, median, IQR and level-band fractions per (course, co) to the detail output")
+
+    p.add_argument("--shrink_n0", type=float, default=None,
+
+                   help="burt_adjust only: scale confidence by n / (n + shrink_n0) to discount small sections")
+
+    p.add_argument("--bootstrap", type=int, default=0,
+
+                   help="burt_adjust only: number of bootstrap replicates for PO attainment CIs (0 = off)")
+
+    p.add_argument("--seed", type=int, default=0, help="Bootstrap RNG seed")
+
+    p.add_argument("--jobs", type=int, default=1, help="Worker processes for BURT confidence and the bootstrap")
+
+    p.add_argument("--hierarchy", type=str, default=None,
+
+                   help="CSV: course,program,department[,credits]. If set, also writes program/department rollups")
+
+    p.add_argument("--blend", type=str, default=None,
+
+                   help="Attainment-type blend for rollups, e.g. FINAL=0.8,SURVEY=0.2 (default: --attainment_type only)")
+
+    p.add_argument("--rollup_weighting", choices=["credits", "mapping", "equal"], default="credits")
+
+    p.add_argument("--engine", choices=["pandas", "kernels"], default="pandas",
+
+                   help="kernels: grouped reductions via src.kernels (numba if installed, else NumPy)")
+
     p.add_argument("--outdir", type=str, default="out")
 
+    p.add_argument("--validate-only", dest="validate_only", action="store_true",
+
+                   help="Check inputs, print the validation report and exit (non-zero on errors)")
+
+    p.add_argument("--store", type=str, default=None, help="If set, append this run to a SQLite history store")
+
+    p.add_argument("--memory_report", action="store_true", help="Print memory saved by key interning per loader")
+
+    p.add_argument("--metrics_file", type=str, default=None,
+
+                   help="Enable telemetry and write Prometheus text metrics here at exit (textfile collector)")
+
+    p.add_argument("--otlp_endpoint", type=str, default=None,
+
+                   help="Enable telemetry and send stage spans to this OTLP/HTTP collector, "
+
+                        "e.g. http://localhost:4318/v1/traces")
+
     args = p.parse_args()
 
 
 
+    if args.metrics_file or args.otlp_endpoint:
+
+        telemetry.enable()
+
+    try:
+
+        with telemetry.span("run", mode=args.mode):
+
+            run(args)
+
+    finally:
+
+        telemetry.flush(args.metrics_file, args.otlp_endpoint)
+
+
+
+
+
+def run(args):
+
+
+
     outdir = Path(args.outdir)
 
     outdir.mkdir(parents=True, exist_ok=True)
 
 
 
-    thresholds = load_thresholds(args.thresholds)
+    reports = {"co_attainment": {}, "mapping": {}, "student_co_scores": {}}
+
+    book = None
+
+    if args.workbook:
+
+        book = load_workbook(args.workbook, report=reports)
+
+    elif not (args.mapping and args.thresholds and args.targets):
+
+        raise ValueError("--mapping, --thresholds and --targets are required (or pass --workbook)")
+
+
+
+    thresholds = book["thresholds"] if book else load_thresholds(args.thresholds)
+
+    targets = book["targets"] if book else load_targets(args.targets)
+
+
+
+    if args.marks and not args.question_map:
+
+        raise ValueError("--marks requires --question_map")
+
+    if not (args.marks or args.co_attainment or book):
+
+        raise ValueError("one of --co_attainment, --marks or --workbook is required")
+
+    book_students = book is not None and book["student_co_scores"] is not None
+
+    if args.mode == "burt_adjust" and not (args.student_co_scores or args.marks or book_students):
+
+        raise ValueError("burt_adjust mode requires --student_co_scores (or --marks)")
+
+
+
+    map_df = book["mapping"] if book else load_mapping(args.mapping, report=reports["mapping"])
 
-    targets = load_targets(args.targets)
+    stu_df = None
 
+    if args.marks:
 
+        marks_stats = {}
 
-    co_df = load_co_attainment(args.co_attainment)
+        stu_df = student_co_scores_from_marks(
 
-    map_df = load_mapping(args.mapping)
+            load_question_marks(args.marks, chunksize=args.marks_chunksize),
+
+            load_question_co_map(args.question_map),
+
+            stats=marks_stats,
+
+        )
+
+        co_df = co_attainment_from_students(stu_df, pass_pct=args.pass_pct, attainment_type=args.attainment_type)
+
+        co_df.to_csv(outdir / "co_attainment_from_marks.csv", index=False)
+
+        stu_df.to_csv(outdir / "student_co_scores_from_marks.csv", index=False)
+
+        print(f"Marks: {marks_stats['rows']} rows -> {marks_stats['student_co_rows']} student/CO scores "
+
+              f"({marks_stats['unmapped_rows']} rows on questions without a CO)")
+
+        if args.mode != "burt_adjust":
+
+            stu_df = None
+
+    elif book and not args.co_attainment:
+
+        co_df = book["co_attainment"]
+
+    else:
+
+        co_df = load_co_attainment(args.co_attainment, report=reports["co_attainment"])
+
+    if args.mode == "burt_adjust":
+
+        if stu_df is None and args.student_co_scores:
+
+            stu_df = load_student_co_scores(args.student_co_scores, report=reports["student_co_scores"])
+
+        elif stu_df is None:
+
+            stu_df = book["student_co_scores"]
+
+        co_df, map_df, stu_df = harmonize_keys(co_df, map_df, stu_df)
+
+    else:
+
+        co_df, map_df = harmonize_keys(co_df, map_df)
+
+
+
+    if args.memory_report:
+
+        for name, rep in reports.items():
+
+            if rep:
+
+                print(f"{name}: {rep['rows']} rows, {rep['bytes_before']:,} -> {rep['bytes_after']:,} bytes "
+
+                      f"({rep['bytes_saved']:,} saved)")
 
 
 
@@ -72,35 +276,45 @@ def main():
 
         co_df = co_df[co_df["year"] == args.year]
 
+        if stu_df is not None:
+
+            stu_df = stu_df[stu_df["year"] == args.year]
+
     if args.course is not None:
 
         co_df = co_df[co_df["course"] == args.course]
 
         map_df = map_df[map_df["course"] == args.course]
 
+        if stu_df is not None:
 
+            stu_df = stu_df[stu_df["course"] == args.course]
 
-    # Compute optional Burt adjustments
 
-    assoc_df = None
 
-    if args.mode == "burt_adjust":
+    # validate what will actually be computed (rows outside --year/--course don't count)
 
-        if not args.student_co_scores:
+    if args.validate_only:
 
-            raise ValueError("burt_adjust mode requires --student_co_scores")
+        report = validate_inputs(co_df, map_df, thresholds, targets, student_co_scores=stu_df)
 
-        stu_df = load_student_co_scores(args.student_co_scores)
+        print(format_validation_report(report))
 
-        if args.year is not None:
+        sys.exit(0 if report["ok"] else 1)
 
-            stu_df = stu_df[stu_df["year"] == args.year]
 
-        if args.course is not None:
 
-            stu_df = stu_df[stu_df["course"] == args.course]
+    # Compute optional Burt adjustments
 
-        assoc_df = compute_burt_adjustments_from_students(stu_df, thresholds)
+    assoc_df = None
+
+    if stu_df is not None:
+
+        assoc_df = compute_burt_adjustments_from_students(stu_df, thresholds, n_jobs=args.jobs,
+
+                                                          extended=args.burt_stats, shrink_n0=args.shrink_n0,
+
+                                                          engine=args.engine)
 
 
 
@@ -118,12 +332,74 @@ def main():
 
         assoc=assoc_df,  # None in nba mode
 
+        engine=args.engine,
+
     )
 
 
 
     write_outputs(results, outdir)
 
+    if args.xlsx:
+
+        write_outputs_xlsx(results, outdir / "outputs.xlsx")
+
+
+
+    boot_df = None
+
+    if stu_df is not None and args.bootstrap > 0:
+
+        # resample the fraction of students attaining each CO, i.e. the co_attainment value
+
+        boot_df = bootstrap_po_attainment(stu_df, map_df, targets, n_boot=args.bootstrap, seed=args.seed,
+
+                                          pass_pct=args.pass_pct, n_jobs=args.jobs)
+
+        boot_df.to_csv(outdir / "po_bootstrap_ci.csv", index=False)
+
+    if args.hierarchy:
+
+        hierarchy = load_hierarchy(args.hierarchy)
+
+        if args.blend:
+
+            blend = {k: float(v) for k, v in (part.split("=") for part in args.blend.split(","))}
+
+        else:
+
+            blend = {args.attainment_type: 1.0}
+
+        po_by_type = {
+
+            atype: compute_po_aggregates(co_df, map_df, attainment_type=atype, assoc=assoc_df)["po_agg"]
+
+            for atype in blend
+
+        }
+
+        rollup_df = rollup_po_attainment(
+
+            blend_attainment_types(po_by_type, blend), hierarchy, weighting=args.rollup_weighting, targets=targets
+
+        )
+
+        rollup_df.to_csv(outdir / "po_pso_rollup.csv", index=False)
+
+
+
+    if args.store:
+
+        conn = open_store(args.store)
+
+        run_id = ingest_run(conn, results, args.attainment_type, bootstrap=boot_df)
+
+        conn.close()
+
+        print(f"Stored run {run_id} in {args.store}")
+
+
+
     print(f"✅ Done. Outputs written to: {outdir.resolve()}")
 
 
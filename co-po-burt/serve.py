@@ -0,0 +1,83 @@
+import argparse
+
+import asyncio
+
+
+
+from src import telemetry
+
+from src.server import AttainmentServer
+
+
+
+
+
+def main():
+
+    p = argparse.ArgumentParser(description="HTTP API for PO attainment, BURT confidence and CO-PO mapping")
+
+    p.add_argument("--host", type=str, default="127.0.0.1")
+
+    p.add_argument("--port", type=int, default=8000)
+
+    p.add_argument("--co_attainment", type=str, default=None, help="Preload CSV: year,course,co,attainment_type,value")
+
+    p.add_argument("--mapping", type=str, default=None, help="Preload CSV: course,co,outcome,weight (0-3)")
+
+    p.add_argument("--thresholds", type=str, default=None, help="Preload CSV: level,min_pct")
+
+    p.add_argument("--targets", type=str, default=None, help="Preload CSV: metric,value")
+
+    p.add_argument("--po_statements", type=str, default=None, help="Preload PO/PSO statements CSV for /mapping")
+
+    p.add_argument("--warm_encoder", action="store_true", help="Load the BERT encoder at startup")
+
+    p.add_argument("--workers", type=int, default=4)
+
+    p.add_argument("--pool", choices=["thread", "process"], default="thread",
+
+                   help="Where CPU work runs; process workers each load the reference data once")
+
+    p.add_argument("--telemetry", action="store_true",
+
+                   help="Collect metrics for GET /metrics?format=prometheus (stage metrics need --pool thread)")
+
+    args = p.parse_args()
+
+
+
+    if args.telemetry:
+
+        telemetry.enable()
+
+
+
+    config = {
+
+        "co_attainment": args.co_attainment,
+
+        "mapping": args.mapping,
+
+        "thresholds": args.thresholds,
+
+        "targets": args.targets,
+
+        "po_statements": args.po_statements,
+
+        "warm_encoder": args.warm_encoder,
+
+    }
+
+    server = AttainmentServer(config, workers=args.workers, pool=args.pool)
+
+    print(f"Serving on http://{args.host}:{args.port}")
+
+    asyncio.run(server.serve(args.host, args.port))
+
+
+
+
+
+if __name__ == "__main__":
+
+    main()
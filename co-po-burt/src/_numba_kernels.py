@@ -0,0 +1,135 @@
+# Numba versions of the src.kernels reductions. Imported lazily, only when numba is installed.
+
+# cache=True keeps the compiled machine code on disk (__pycache__, or NUMBA_CACHE_DIR),
+
+# so the JIT cost is paid once per machine, not once per process.
+
+import math
+
+
+
+import numpy as np
+
+from numba import njit
+
+
+
+
+
+@njit(cache=True)
+
+def weighted_sums(values, weights, offsets):
+
+    # Kahan-compensated like pandas' groupby sum; NaN products are skipped like skipna
+
+    n_groups = len(offsets) - 1
+
+    num = np.zeros(n_groups)
+
+    den = np.zeros(n_groups)
+
+    for g in range(n_groups):
+
+        s, c, sw, cw = 0.0, 0.0, 0.0, 0.0
+
+        for i in range(offsets[g], offsets[g + 1]):
+
+            w = weights[i]
+
+            vw = values[i] * w
+
+            if vw == vw:
+
+                y = vw - c
+
+                t = s + y
+
+                c = (t - s) - y
+
+                s = t
+
+            if w == w:
+
+                y = w - cw
+
+                t = sw + y
+
+                cw = (t - sw) - y
+
+                sw = t
+
+        num[g] = s
+
+        den[g] = sw
+
+    return num, den
+
+
+
+
+
+@njit(cache=True)
+
+def group_min(values, offsets):
+
+    n_groups = len(offsets) - 1
+
+    out = np.empty(n_groups)
+
+    for g in range(n_groups):
+
+        m = np.nan
+
+        for i in range(offsets[g], offsets[g + 1]):
+
+            v = values[i]
+
+            if v == v and (m != m or v < m):
+
+                m = v
+
+        out[g] = m
+
+    return out
+
+
+
+
+
+@njit(cache=True)
+
+def group_mean_std(values, offsets):
+
+    # two-pass population mean/std per group (NaN propagates, like np.mean/np.std)
+
+    n_groups = len(offsets) - 1
+
+    mean = np.empty(n_groups)
+
+    std = np.empty(n_groups)
+
+    for g in range(n_groups):
+
+        lo, hi = offsets[g], offsets[g + 1]
+
+        s = 0.0
+
+        for i in range(lo, hi):
+
+            s += values[i]
+
+        m = s / (hi - lo)
+
+        ss = 0.0
+
+        for i in range(lo, hi):
+
+            d = values[i] - m
+
+            ss += d * d
+
+        mean[g] = m
+
+        std[g] = math.sqrt(ss / (hi - lo))
+
+    return mean, std
@@ -0,0 +1,215 @@
+import json
+
+import os
+
+import shutil
+
+import uuid
+
+from pathlib import Path
+
+
+
+import numpy as np
+
+import pandas as pd
+
+
+
+from src.io_utils import harmonize_keys
+
+
+
+
+
+# categories dir -> {column: CategoricalDtype}; the only part of a dataset that is parsed on open
+
+_CATEGORY_CACHE = {}
+
+
+
+
+
+def compile_frames(frames: dict, outdir) -> Path:
+
+    """
+
+    Writes normalized frames (e.g. {"co_attainment": ..., "mapping": ...}) as memory-mappable
+
+    .npy columns. Key columns are harmonized first and their shared category dictionary is
+
+    stored once under outdir/categories. Layout:
+
+        outdir/categories/<column>.json
+
+        outdir/<name>/meta.json, outdir/<name>/<column>.npy
+
+    Each compile is written to a temporary sibling directory and renamed into place, so a
+
+    recompile replaces the previous output as a whole (no stale datasets or categories).
+
+    """
+
+    outdir = Path(outdir)
+
+    if outdir.exists() and any(outdir.iterdir()) and not (outdir / "categories").is_dir():
+
+        raise ValueError(f"Output dir {outdir} already exists and is not a compiled dataset directory")
+
+    outdir.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp = outdir.parent / f".{outdir.name}.{uuid.uuid4().hex}"
+
+    tmp.mkdir()
+
+    try:
+
+        _write_frames(frames, tmp)
+
+        if outdir.exists():
+
+            old = outdir.parent / f".{outdir.name}.old.{uuid.uuid4().hex}"
+
+            os.replace(outdir, old)
+
+            try:
+
+                os.replace(tmp, outdir)
+
+            except OSError:
+
+                os.replace(old, outdir)
+
+                raise
+
+            shutil.rmtree(old, ignore_errors=True)
+
+        else:
+
+            os.replace(tmp, outdir)
+
+    except BaseException:
+
+        shutil.rmtree(tmp, ignore_errors=True)
+
+        raise
+
+    cat_dir = str((outdir / "categories").resolve())
+
+    for key in [k for k in _CATEGORY_CACHE if k[0] == cat_dir]:
+
+        del _CATEGORY_CACHE[key]
+
+    return outdir
+
+
+
+
+
+def _write_frames(frames: dict, outdir: Path) -> None:
+
+    (outdir / "categories").mkdir()
+
+    names = list(frames)
+
+    for name, df in zip(names, harmonize_keys(*frames.values())):
+
+        ddir = outdir / name
+
+        ddir.mkdir()
+
+        columns = []
+
+        for col in df.columns:
+
+            s = df[col]
+
+            if s.dtype == object or pd.api.types.is_string_dtype(s.dtype):
+
+                s = s.astype("category")
+
+            if isinstance(s.dtype, pd.CategoricalDtype):
+
+                cat_file = outdir / "categories" / f"{col}.json"
+
+                cats = [str(c) for c in s.cat.categories]
+
+                if cat_file.exists() and json.loads(cat_file.read_text(encoding="utf-8")) != cats:
+
+                    raise ValueError(f"Column {col} has different categories across frames")
+
+                cat_file.write_text(json.dumps(cats), encoding="utf-8")
+
+                np.save(ddir / f"{col}.npy", np.ascontiguousarray(s.cat.codes.to_numpy()))
+
+                columns.append({"name": col, "kind": "category"})
+
+            elif pd.api.types.is_numeric_dtype(s.dtype) or pd.api.types.is_bool_dtype(s.dtype):
+
+                np.save(ddir / f"{col}.npy", np.ascontiguousarray(s.to_numpy()))
+
+                columns.append({"name": col, "kind": "numeric"})
+
+            else:
+
+                raise ValueError(f"Cannot compile column {col} with dtype {s.dtype}")
+
+        (ddir / "meta.json").write_text(json.dumps({"rows": len(df), "columns": columns}), encoding="utf-8")
+
+
+
+
+
+def is_compiled(path) -> bool:
+
+    return (Path(path) / "meta.json").exists()
+
+
+
+
+
+def _categories(cat_dir: Path, col: str) -> pd.CategoricalDtype:
+
+    key = (str(cat_dir.resolve()), col)
+
+    if key not in _CATEGORY_CACHE:
+
+        cats = json.loads((cat_dir / f"{col}.json").read_text(encoding="utf-8"))
+
+        _CATEGORY_CACHE[key] = pd.CategoricalDtype(cats)
+
+    return _CATEGORY_CACHE[key]
+
+
+
+
+
+def open_compiled(path) -> pd.DataFrame:
+
+    """
+
+    Opens one compiled dataset (outdir/<name>). Column data is memory-mapped read-only,
+
+    so several worker processes share the same pages through the OS page cache.
+
+    """
+
+    ddir = Path(path)
+
+    meta = json.loads((ddir / "meta.json").read_text(encoding="utf-8"))
+
+    cat_dir = ddir.parent / "categories"
+
+    data = {}
+
+    for c in meta["columns"]:
+
+        arr = np.load(ddir / f"{c['name']}.npy", mmap_mode="r")
+
+        if c["kind"] == "category":
+
+            arr = pd.Categorical.from_codes(arr, dtype=_categories(cat_dir, c["name"]), validate=False)
+
+        data[c["name"]] = arr
+
+    return pd.DataFrame(data, copy=False)
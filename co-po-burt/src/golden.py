@@ -0,0 +1,663 @@
+# Golden-output regression harness.
+
+# Each case runs the reference pipeline on fixed inputs and compares every artifact with the
+
+# CSV stored under golden/<case>/. Floats are compared with explicit tolerances; levels, Y/N
+
+# flags, weight bands and all key/text columns must match exactly. Synthetic inputs are stored
+
+# next to their goldens (golden/<case>/inputs/), so checks don't depend on numpy's RNG streams.
+
+import re
+
+import tempfile
+
+from pathlib import Path
+
+
+
+import numpy as np
+
+import pandas as pd
+
+
+
+from src.burt import compute_burt_adjustments_from_students
+
+from src.io_utils import (
+
+    load_co_attainment,
+
+    load_mapping,
+
+    load_student_co_scores,
+
+    load_targets,
+
+    load_thresholds,
+
+)
+
+from src.nba_math import compute_po_attainment_nba
+
+from src.reporting import OUTPUTS, write_outputs
+
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+GOLDEN_DIR = ROOT / "golden"
+
+DATA_DIR = ROOT / "data"
+
+
+
+FLOAT_RTOL = 1e-9
+
+FLOAT_ATOL = 1e-12
+
+# column -> (rtol, atol) overrides; similarity is rounded to 4 decimals by the mapping
+
+COLUMN_TOLERANCE = {"similarity": (0.0, 1.5e-4)}
+
+# compared with zero tolerance even when stored as floats
+
+EXACT_COLUMNS = {"level", "target_met", "weight", "effective_weight"}
+
+
+
+_FIXTURE_MODEL = "golden-tiny-bert"
+
+# bands for the random fixture encoder, chosen so every weight 0-3 occurs
+
+_FIXTURE_THRESHOLDS = (0.91, 0.85, 0.77)
+
+
+
+
+
+# ---------- Fixtures ----------
+
+def _synthetic_attainment(n_courses=25, n_cos=6, n_pos=12, seed=0) -> dict:
+
+    rng = np.random.default_rng(seed)
+
+    courses = [f"SY{i:03d}" for i in range(n_courses)]
+
+    cos = [f"CO{i + 1}" for i in range(n_cos)]
+
+    outcomes = [f"PO{i + 1}" for i in range(n_pos)] + ["PSO1", "PSO2"]
+
+
+
+    co_rows = []
+
+    for year in (2023, 2024):
+
+        for course in courses:
+
+            for co in cos:
+
+                for atype in ("FINAL", "INTERNAL"):
+
+                    co_rows.append((year, course, co, atype, round(float(rng.uniform(0.3, 0.95)), 4)))
+
+    co_attainment = pd.DataFrame(co_rows, columns=["year", "course", "co", "attainment_type", "value"])
+
+    # exact threshold boundaries, so a >= / > slip changes a level
+
+    co_attainment.loc[:5, "value"] = [0.70, 0.60, 0.50, 0.6999, 0.5999, 0.4999]
+
+
+
+    map_rows = [
+
+        (course, co, outcome, int(rng.choice([0, 1, 2, 3], p=[0.4, 0.2, 0.2, 0.2])))
+
+        for course in courses
+
+        for co in cos
+
+        for outcome in outcomes
+
+    ]
+
+    mapping = pd.DataFrame(map_rows, columns=["course", "co", "outcome", "weight"])
+
+
+
+    stu_rows = []
+
+    for year in (2023, 2024):
+
+        for ci, course in enumerate(courses):
+
+            # a few small sections, so confidence sees tiny groups too
+
+            n_students = 3 if ci % 7 == 0 else 30
+
+            for s in range(n_students):
+
+                for co in cos:
+
+                    stu_rows.append((year, course, f"S{s:03d}", co, round(float(rng.beta(5, 3)), 4)))
+
+    students = pd.DataFrame(stu_rows, columns=["year", "course", "student_id", "co", "co_pct"])
+
+    return {"co_attainment": co_attainment, "mapping": mapping, "student_co_scores": students}
+
+
+
+
+
+def _data_students(seed=1) -> pd.DataFrame:
+
+    rng = np.random.default_rng(seed)
+
+    co = pd.read_csv(DATA_DIR / "co_attainment.csv")
+
+    rows = [
+
+        (r.year, r.course, f"S{s:03d}", r.co, round(float(rng.beta(6, 3)), 4))
+
+        for r in co.drop_duplicates(["year", "course", "co"]).itertuples()
+
+        for s in range(40)
+
+    ]
+
+    return pd.DataFrame(rows, columns=["year", "course", "student_id", "co", "co_pct"])
+
+
+
+
+
+_VERBS = ["apply", "analyze", "design", "evaluate", "explain", "implement", "model", "compare"]
+
+_TOPICS = [
+
+    "sorting algorithms", "network protocols", "database normalization", "thermodynamic cycles",
+
+    "control systems", "digital circuits", "software testing", "operating system scheduling",
+
+    "fluid mechanics", "machine learning models", "compiler parsing", "signal processing",
+
+]
+
+_PO_STATEMENTS = [
+
+    "Apply knowledge of mathematics, science and engineering fundamentals to complex problems",
+
+    "Identify, formulate and analyze complex engineering problems",
+
+    "Design solutions and system components that meet specified needs",
+
+    "Conduct investigations of complex problems using research based knowledge",
+
+    "Create, select and apply modern tools and techniques to model engineering activities",
+
+    "Apply ethical principles and commit to professional ethics and responsibilities",
+
+    "Function effectively as an individual and as a member of diverse teams",
+
+    "Communicate effectively on complex engineering activities with the community",
+
+]
+
+
+
+
+
+def _synthetic_statements(n_cos=40, seed=2) -> dict:
+
+    rng = np.random.default_rng(seed)
+
+    co_rows = []
+
+    for i in range(n_cos):
+
+        verb, topic, other = rng.choice(_VERBS), rng.choice(_TOPICS), rng.choice(_TOPICS)
+
+        co_rows.append((f"CO{i + 1}", f"{verb.capitalize()} {topic} to solve complex engineering problems in {other}"))
+
+    # close paraphrases of PO statements give the lexical (TF-IDF) path non-zero bands too
+
+    for j, po_text in enumerate(_PO_STATEMENTS[:4]):
+
+        co_rows.append((f"CO{len(co_rows) + 1}", f"{po_text} in {_TOPICS[j]}"))
+
+    # exact and near duplicates exercise the prefilter path
+
+    co_rows.append((f"CO{len(co_rows) + 1}", co_rows[0][1]))
+
+    co_rows.append((f"CO{len(co_rows) + 1}", co_rows[1][1] + "."))
+
+    co = pd.DataFrame(co_rows, columns=["CO", "Statement"])
+
+    po = pd.DataFrame({"PO": [f"PO{i + 1}" for i in range(len(_PO_STATEMENTS))], "Description": _PO_STATEMENTS})
+
+    return {"co_statements": co, "po_statements": po}
+
+
+
+
+
+def fixture_model(workdir: Path) -> str:
+
+    """
+
+    Builds (once per workdir) a tiny, seeded BERT with a word-level vocab over the fixture
+
+    statements and registers it as golden-tiny-bert. No download needed.
+
+    """
+
+    import torch
+
+    from tokenizers import Tokenizer, models, normalizers, pre_tokenizers, processors
+
+    from transformers import BertConfig, BertModel, PreTrainedTokenizerFast
+
+
+
+    from src.nlp_mapping import register_model
+
+
+
+    path = Path(workdir) / _FIXTURE_MODEL
+
+    if not (path / "config.json").exists():
+
+        words = set()
+
+        for text in _VERBS + _TOPICS + _PO_STATEMENTS + ["to solve complex engineering problems in"]:
+
+            words.update(re.findall(r"[a-z]+", text.lower()))
+
+        vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + sorted(words) + list(".,")
+
+        ids = {tok: i for i, tok in enumerate(vocab)}
+
+        tok = Tokenizer(models.WordPiece(ids, unk_token="[UNK]"))
+
+        tok.normalizer = normalizers.BertNormalizer(lowercase=True)
+
+        tok.pre_tokenizer = pre_tokenizers.BertPreTokenizer()
+
+        tok.post_processor = processors.TemplateProcessing(
+
+            single="[CLS] $A [SEP]", special_tokens=[("[CLS]", ids["[CLS]"]), ("[SEP]", ids["[SEP]"])]
+
+        )
+
+        PreTrainedTokenizerFast(
+
+            tokenizer_object=tok, unk_token="[UNK]", pad_token="[PAD]", cls_token="[CLS]",
+
+            sep_token="[SEP]", mask_token="[MASK]",
+
+        ).save_pretrained(str(path))
+
+
+
+        torch.manual_seed(0)
+
+        config = BertConfig(
+
+            vocab_size=len(vocab), hidden_size=32, num_hidden_layers=2, num_attention_heads=2,
+
+            intermediate_size=64, max_position_embeddings=128, initializer_range=1.0,
+
+        )
+
+        BertModel(config).save_pretrained(str(path))
+
+    register_model(_FIXTURE_MODEL, path, pooling="mean", thresholds=_FIXTURE_THRESHOLDS)
+
+    return _FIXTURE_MODEL
+
+
+
+
+
+# ---------- Cases ----------
+
+def _write_inputs(case_dir: Path, frames: dict) -> None:
+
+    inputs = case_dir / "inputs"
+
+    inputs.mkdir(parents=True, exist_ok=True)
+
+    for name, df in frames.items():
+
+        df.to_csv(inputs / f"{name}.csv", index=False)
+
+
+
+
+
+def _attainment_outputs(co_path, map_path, outdir: Path, student_path=None, engine="pandas") -> None:
+
+    thresholds = load_thresholds(DATA_DIR / "thresholds.csv")
+
+    targets = load_targets(DATA_DIR / "targets.csv")
+
+    assoc = None
+
+    if student_path is not None:
+
+        assoc = compute_burt_adjustments_from_students(
+
+            load_student_co_scores(student_path), thresholds, engine=engine
+
+        )
+
+    results = compute_po_attainment_nba(
+
+        co_attainment=load_co_attainment(co_path),
+
+        mapping=load_mapping(map_path),
+
+        thresholds=thresholds,
+
+        targets=targets,
+
+        attainment_type="FINAL",
+
+        assoc=assoc,
+
+        engine=engine,
+
+    )
+
+    write_outputs(results, outdir)
+
+
+
+
+
+def _run_data(case_dir, outdir, regenerate, burt, engine):
+
+    student_path = None
+
+    if burt:
+
+        if regenerate or not (case_dir / "inputs" / "student_co_scores.csv").exists():
+
+            _write_inputs(case_dir, {"student_co_scores": _data_students()})
+
+        student_path = case_dir / "inputs" / "student_co_scores.csv"
+
+    _attainment_outputs(DATA_DIR / "co_attainment.csv", DATA_DIR / "co_po_map.csv", outdir, student_path, engine)
+
+
+
+
+
+def _run_synthetic(case_dir, outdir, regenerate, burt, engine):
+
+    inputs = case_dir / "inputs"
+
+    if regenerate or not (inputs / "co_attainment.csv").exists():
+
+        frames = _synthetic_attainment()
+
+        if not burt:
+
+            frames.pop("student_co_scores")
+
+        _write_inputs(case_dir, frames)
+
+    student_path = inputs / "student_co_scores.csv" if burt else None
+
+    _attainment_outputs(inputs / "co_attainment.csv", inputs / "mapping.csv", outdir, student_path, engine)
+
+
+
+
+
+def _run_mapping(case_dir, outdir, regenerate, method, engine):
+
+    from src.nlp_mapping import generate_co_po_mapping
+
+
+
+    inputs = case_dir / "inputs"
+
+    if regenerate or not (inputs / "co_statements.csv").exists():
+
+        _write_inputs(case_dir, _synthetic_statements())
+
+    model = fixture_model(outdir.parent) if method == "bert" else None
+
+    mapping = generate_co_po_mapping(
+
+        pd.read_csv(inputs / "co_statements.csv"),
+
+        pd.read_csv(inputs / "po_statements.csv"),
+
+        method=method,
+
+        model=model,
+
+    )
+
+    mapping.to_csv(outdir / "mapping.csv", index=False)
+
+
+
+
+
+# case -> runner(case_dir, outdir, regenerate, engine); engine only affects the attainment cases
+
+CASES = {
+
+    "data_nba": lambda d, o, r, e: _run_data(d, o, r, burt=False, engine=e),
+
+    "data_burt": lambda d, o, r, e: _run_data(d, o, r, burt=True, engine=e),
+
+    "synthetic_nba": lambda d, o, r, e: _run_synthetic(d, o, r, burt=False, engine=e),
+
+    "synthetic_burt": lambda d, o, r, e: _run_synthetic(d, o, r, burt=True, engine=e),
+
+    "mapping_tfidf": lambda d, o, r, e: _run_mapping(d, o, r, method="tfidf", engine=e),
+
+    "mapping_bert": lambda d, o, r, e: _run_mapping(d, o, r, method="bert", engine=e),
+
+}
+
+
+
+
+
+def _artifacts(case: str) -> list:
+
+    if case.startswith("mapping_"):
+
+        return ["mapping"]
+
+    return [name for _, name in OUTPUTS]
+
+
+
+
+
+# ---------- Compare ----------
+
+def compare_frames(expected: pd.DataFrame, actual: pd.DataFrame) -> list:
+
+    """
+
+    Problems found between a golden frame and a fresh one (empty list = match).
+
+    """
+
+    if list(expected.columns) != list(actual.columns):
+
+        return [f"columns {list(actual.columns)} != golden {list(expected.columns)}"]
+
+    if len(expected) != len(actual):
+
+        return [f"{len(actual)} rows != golden {len(expected)}"]
+
+
+
+    problems = []
+
+    for col in expected.columns:
+
+        e, a = expected[col], actual[col]
+
+        numeric = pd.api.types.is_numeric_dtype(e) and pd.api.types.is_numeric_dtype(a)
+
+        if numeric and col not in EXACT_COLUMNS and (
+
+            pd.api.types.is_float_dtype(e) or pd.api.types.is_float_dtype(a)
+
+        ):
+
+            rtol, atol = COLUMN_TOLERANCE.get(col, (FLOAT_RTOL, FLOAT_ATOL))
+
+            ev, av = e.to_numpy(dtype=np.float64), a.to_numpy(dtype=np.float64)
+
+            bad = ~np.isclose(av, ev, rtol=rtol, atol=atol, equal_nan=True)
+
+            detail = f"max abs diff {np.nanmax(np.abs(av - ev)):.3g}" if bad.any() else ""
+
+        elif numeric:
+
+            ev, av = e.to_numpy(dtype=np.float64), a.to_numpy(dtype=np.float64)
+
+            bad = ~((ev == av) | (np.isnan(ev) & np.isnan(av)))
+
+            detail = "exact column"
+
+        else:
+
+            bad = (e.astype(str) != a.astype(str)).to_numpy()
+
+            detail = "exact column"
+
+        if bad.any():
+
+            row = int(np.flatnonzero(bad)[0])
+
+            problems.append(
+
+                f"{col}: {int(bad.sum())} mismatch(es), {detail}; first at row {row}: "
+
+                f"golden={e.iloc[row]} actual={a.iloc[row]}"
+
+            )
+
+    return problems
+
+
+
+
+
+def record(cases=None, golden_dir=GOLDEN_DIR, regenerate=False) -> list:
+
+    """
+
+    (Re)writes golden outputs for the given cases (default: all). Returns the case names.
+
+    regenerate: also rebuild the stored synthetic inputs.
+
+    """
+
+    cases = list(cases or CASES)
+
+    for case in cases:
+
+        case_dir = Path(golden_dir) / case
+
+        case_dir.mkdir(parents=True, exist_ok=True)
+
+        with tempfile.TemporaryDirectory() as tmp:
+
+            outdir = Path(tmp) / "out"
+
+            outdir.mkdir()
+
+            CASES[case](case_dir, outdir, regenerate, "pandas")
+
+            for name in _artifacts(case):
+
+                (case_dir / f"{name}.csv").write_bytes((outdir / f"{name}.csv").read_bytes())
+
+    return cases
+
+
+
+
+
+def check(cases=None, golden_dir=GOLDEN_DIR, engine="pandas") -> list:
+
+    """
+
+    Re-runs the cases against the stored goldens (goldens are always recorded with the
+
+    reference pandas engine; engine="kernels" checks the compiled path against them).
+
+    Returns [{"case", "artifact", "problems"}] for every artifact that differs (empty = all match).
+
+    """
+
+    failures = []
+
+    for case in list(cases or CASES):
+
+        case_dir = Path(golden_dir) / case
+
+        if not case_dir.exists():
+
+            failures.append({"case": case, "artifact": "-", "problems": ["no golden recorded"]})
+
+            continue
+
+        with tempfile.TemporaryDirectory() as tmp:
+
+            outdir = Path(tmp) / "out"
+
+            outdir.mkdir()
+
+            CASES[case](case_dir, outdir, False, engine)
+
+            for name in _artifacts(case):
+
+                golden = case_dir / f"{name}.csv"
+
+                if not golden.exists():
+
+                    failures.append({"case": case, "artifact": name, "problems": ["no golden recorded"]})
+
+                    continue
+
+                problems = compare_frames(pd.read_csv(golden), pd.read_csv(outdir / f"{name}.csv"))
+
+                if problems:
+
+                    failures.append({"case": case, "artifact": name, "problems": problems})
+
+    return failures
+
+
+
+
+
+def format_failures(failures: list) -> str:
+
+    if not failures:
+
+        return "All golden outputs match."
+
+    lines = [f"{len(failures)} artifact(s) differ from golden:"]
+
+    for f in failures:
+
+        lines.append(f"  {f['case']}/{f['artifact']}")
+
+        lines += [f"    - {p}" for p in f["problems"]]
+
+    return "\n".join(lines)
@@ -1,12 +1,168 @@
+import re
+
+from pathlib import Path
+
+from typing import Optional
+
+
+
+import numpy as np
+
 import pandas as pd
 
 
 
+from src import telemetry
 
 
-def load_co_attainment(path: str) -> pd.DataFrame:
 
-    df = pd.read_csv(path)
+
+
+# Join/groupby keys shared between co_attainment, mapping and student_co_scores
+
+KEY_COLUMNS = ("course", "co", "outcome", "attainment_type", "student_id")
+
+
+
+
+
+def _to_key(s: pd.Series, upper: bool = True) -> pd.Series:
+
+    """
+
+    Normalizes a key column on its unique values only and returns it as a categorical
+
+    with lexically sorted categories (so groupby/sort order matches plain strings).
+
+    """
+
+    codes, uniques = pd.factorize(s, use_na_sentinel=False)
+
+    labels = pd.Index(uniques).astype(str).str.strip()
+
+    if upper:
+
+        labels = labels.str.upper()
+
+    # normalization can merge labels (e.g. "co1" and "CO1 ")
+
+    remap, cats = pd.factorize(labels, sort=True)
+
+    return pd.Series(
+
+        pd.Categorical.from_codes(remap[codes], categories=cats),
+
+        index=s.index,
+
+        name=s.name,
+
+    )
+
+
+
+
+
+def _fill_report(report: Optional[dict], before: int, df: pd.DataFrame) -> None:
+
+    if report is None:
+
+        return
+
+    after = int(df.memory_usage(index=True, deep=True).sum())
+
+    report.update({"rows": len(df), "bytes_before": before, "bytes_after": after, "bytes_saved": before - after})
+
+
+
+
+
+def harmonize_keys(*frames: pd.DataFrame) -> list:
+
+    """
+
+    Gives every key column shared by the frames one common category dictionary,
+
+    so merges between them join on integer codes instead of hashing strings.
+
+    """
+
+    out = [df.copy(deep=False) for df in frames]
+
+    for col in KEY_COLUMNS:
+
+        having = [df for df in out if col in df.columns]
+
+        if len(having) < 2:
+
+            continue
+
+        cats = set()
+
+        for df in having:
+
+            cats.update(df[col].astype("category").cat.categories)
+
+        dtype = pd.CategoricalDtype(sorted(cats))
+
+        for df in having:
+
+            df[col] = df[col].astype(dtype)
+
+    return out
+
+
+
+
+
+def _is_compiled(path) -> bool:
+
+    return isinstance(path, (str, Path)) and (Path(path) / "meta.json").is_file()
+
+
+
+
+
+def _open_compiled(path) -> pd.DataFrame:
+
+    from src.compiled import open_compiled
+
+
+
+    return open_compiled(path)
+
+
+
+
+
+@telemetry.rows_loaded("co_attainment")
+
+def load_co_attainment(path: str, report: Optional[dict] = None) -> pd.DataFrame:
+
+    """
+
+    report (optional dict) is filled with rows and memory before/after key interning.
+
+    path may also be a compiled dataset directory (see src.compiled), which is memory-mapped.
+
+    """
+
+    if _is_compiled(path):
+
+        return _open_compiled(path)
+
+    return prepare_co_attainment(pd.read_csv(path), report=report)
+
+
+
+
+
+def prepare_co_attainment(df: pd.DataFrame, report: Optional[dict] = None) -> pd.DataFrame:
+
+    """
+
+    Checks and normalizes an already-parsed co_attainment frame (modified in place).
+
+    """
 
     required = {"year", "course", "co", "attainment_type", "value"}
 
@@ -16,11 +172,21 @@ def load_co_attainment(path: str) -> pd.DataFrame:
 
         raise ValueError(f"co_attainment missing columns: {missing}")
 
-    df["co"] = df["co"].astype(str).str.upper().str.strip()
+    before = int(df.memory_usage(index=True, deep=True).sum()) if report is not None else 0
 
-    df["course"] = df["course"].astype(str).str.strip()
+    df["co"] = _to_key(df["co"])
 
-    df["attainment_type"] = df["attainment_type"].astype(str).str.upper().str.strip()
+    df["course"] = _to_key(df["course"], upper=False)
+
+    df["attainment_type"] = _to_key(df["attainment_type"])
+
+    df["year"] = pd.to_numeric(df["year"], downcast="integer")
+
+    # values stay float64: levels compare them against thresholds like 0.70
+
+    df["value"] = df["value"].astype(float)
+
+    _fill_report(report, before, df)
 
     return df
 
@@ -28,9 +194,21 @@ def load_co_attainment(path: str) -> pd.DataFrame:
 
 
 
-def load_mapping(path: str) -> pd.DataFrame:
+@telemetry.rows_loaded("mapping")
 
-    df = pd.read_csv(path)
+def load_mapping(path: str, report: Optional[dict] = None) -> pd.DataFrame:
+
+    if _is_compiled(path):
+
+        return _open_compiled(path)
+
+    return prepare_mapping(pd.read_csv(path), report=report)
+
+
+
+
+
+def prepare_mapping(df: pd.DataFrame, report: Optional[dict] = None) -> pd.DataFrame:
 
     required = {"course", "co", "outcome", "weight"}
 
@@ -40,13 +218,19 @@ def load_mapping(path: str) -> pd.DataFrame:
 
         raise ValueError(f"mapping missing columns: {missing}")
 
-    df["co"] = df["co"].astype(str).str.upper().str.strip()
+    before = int(df.memory_usage(index=True, deep=True).sum()) if report is not None else 0
 
-    df["outcome"] = df["outcome"].astype(str).str.upper().str.strip()
+    df["co"] = _to_key(df["co"])
 
-    df["course"] = df["course"].astype(str).str.strip()
+    df["outcome"] = _to_key(df["outcome"])
 
-    df["weight"] = df["weight"].astype(float)
+    df["course"] = _to_key(df["course"], upper=False)
+
+    # 0..3 bands are exact in float32
+
+    df["weight"] = df["weight"].astype(np.float32)
+
+    _fill_report(report, before, df)
 
     return df
 
@@ -54,6 +238,8 @@ def load_mapping(path: str) -> pd.DataFrame:
 
 
 
+@telemetry.rows_loaded("thresholds")
+
 def load_thresholds(path: str) -> dict:
 
     """
@@ -62,7 +248,13 @@ def load_thresholds(path: str) -> dict:
 
     """
 
-    df = pd.read_csv(path)
+    return prepare_thresholds(pd.read_csv(path))
+
+
+
+
+
+def prepare_thresholds(df: pd.DataFrame) -> dict:
 
     required = {"level", "min_pct"}
 
@@ -88,9 +280,17 @@ def load_thresholds(path: str) -> dict:
 
 
 
+@telemetry.rows_loaded("targets")
+
 def load_targets(path: str) -> dict:
 
-    df = pd.read_csv(path)
+    return prepare_targets(pd.read_csv(path))
+
+
+
+
+
+def prepare_targets(df: pd.DataFrame) -> dict:
 
     required = {"metric", "value"}
 
@@ -116,9 +316,31 @@ def load_targets(path: str) -> dict:
 
 
 
-def load_student_co_scores(path: str) -> pd.DataFrame:
+@telemetry.rows_loaded("student_co_scores")
+
+def load_student_co_scores(path: str, report: Optional[dict] = None, chunksize: Optional[int] = None):
+
+    """
+
+    With chunksize, returns an iterator of prepared chunks (e.g. for burt_dispersion_stats).
+
+    """
+
+    if _is_compiled(path):
+
+        return _open_compiled(path)
+
+    if chunksize is not None:
+
+        return (prepare_student_co_scores(chunk) for chunk in pd.read_csv(path, chunksize=chunksize))
+
+    return prepare_student_co_scores(pd.read_csv(path), report=report)
+
+
 
-    df = pd.read_csv(path)
+
+
+def prepare_student_co_scores(df: pd.DataFrame, report: Optional[dict] = None) -> pd.DataFrame:
 
     required = {"year", "course", "student_id", "co", "co_pct"}
 
@@ -128,12 +350,540 @@ def load_student_co_scores(path: str) -> pd.DataFrame:
 
         raise ValueError(f"student_co_scores missing columns: {missing}")
 
-    df["co"] = df["co"].astype(str).str.upper().str.strip()
+    before = int(df.memory_usage(index=True, deep=True).sum()) if report is not None else 0
 
-    df["course"] = df["course"].astype(str).str.strip()
+    df["co"] = _to_key(df["co"])
+
+    df["course"] = _to_key(df["course"], upper=False)
 
-    df["student_id"] = df["student_id"].astype(str).str.strip()
+    df["student_id"] = _to_key(df["student_id"], upper=False)
+
+    df["year"] = pd.to_numeric(df["year"], downcast="integer")
 
     df["co_pct"] = df["co_pct"].astype(float)
 
+    _fill_report(report, before, df)
+
     return df
+
+
+
+
+
+@telemetry.rows_loaded("hierarchy")
+
+def load_hierarchy(path: str) -> pd.DataFrame:
+
+    """
+
+    course -> program -> department table for rollups (optional credits column).
+
+    """
+
+    df = pd.read_csv(path)
+
+    required = {"course", "program", "department"}
+
+    missing = required - set(df.columns)
+
+    if missing:
+
+        raise ValueError(f"hierarchy missing columns: {missing}")
+
+    df["course"] = df["course"].astype(str).str.strip()
+
+    df["program"] = df["program"].astype(str).str.upper().str.strip()
+
+    df["department"] = df["department"].astype(str).str.upper().str.strip()
+
+    if "credits" in df.columns:
+
+        df["credits"] = df["credits"].astype(float)
+
+    if df["course"].duplicated().any():
+
+        raise ValueError("hierarchy must list each course once")
+
+    return df
+
+
+
+
+
+def prepare_question_marks(df: pd.DataFrame) -> pd.DataFrame:
+
+    """
+
+    Raw question-level marks: one row per (student, assessment, question).
+
+    Missing marks (absent / not attempted) count as zero.
+
+    """
+
+    required = {"year", "course", "student_id", "assessment", "question", "marks", "max_marks"}
+
+    missing = required - set(df.columns)
+
+    if missing:
+
+        raise ValueError(f"question marks missing columns: {missing}")
+
+    df["course"] = _to_key(df["course"], upper=False)
+
+    df["student_id"] = _to_key(df["student_id"], upper=False)
+
+    df["assessment"] = _to_key(df["assessment"])
+
+    df["question"] = _to_key(df["question"])
+
+    df["year"] = pd.to_numeric(df["year"], downcast="integer")
+
+    df["marks"] = df["marks"].astype(float).fillna(0.0)
+
+    df["max_marks"] = df["max_marks"].astype(float)
+
+    return df
+
+
+
+
+
+@telemetry.rows_loaded("question_marks")
+
+def load_question_marks(path: str, chunksize: Optional[int] = None):
+
+    """
+
+    Returns the prepared marks frame, or with chunksize an iterator of prepared chunks
+
+    (for semester-sized exports that should not be read in one go).
+
+    """
+
+    if chunksize is None:
+
+        return prepare_question_marks(pd.read_csv(path))
+
+    return (prepare_question_marks(chunk) for chunk in pd.read_csv(path, chunksize=chunksize))
+
+
+
+
+
+@telemetry.rows_loaded("question_co_map")
+
+def load_question_co_map(path: str) -> pd.DataFrame:
+
+    """
+
+    course,assessment,question,co[,weight]: which CO(s) each question assesses.
+
+    weight (default 1) splits a question's marks across several COs.
+
+    """
+
+    df = pd.read_csv(path)
+
+    required = {"course", "assessment", "question", "co"}
+
+    missing = required - set(df.columns)
+
+    if missing:
+
+        raise ValueError(f"question_co_map missing columns: {missing}")
+
+    df["course"] = _to_key(df["course"], upper=False)
+
+    df["assessment"] = _to_key(df["assessment"])
+
+    df["question"] = _to_key(df["question"])
+
+    df["co"] = _to_key(df["co"])
+
+    df["weight"] = df["weight"].astype(float) if "weight" in df.columns else 1.0
+
+    if df.duplicated(subset=["course", "assessment", "question", "co"]).any():
+
+        raise ValueError("question_co_map must list each (course, assessment, question, co) once")
+
+    return df
+
+
+
+
+
+# ---------- Excel workbooks ----------
+
+# input table -> accepted sheet names (matched ignoring case, spaces and punctuation)
+
+WORKBOOK_SHEETS = {
+
+    "co_attainment": ("co_attainment", "co attainment"),
+
+    "mapping": ("mapping", "co_po_map", "co po mapping"),
+
+    "thresholds": ("thresholds",),
+
+    "targets": ("targets",),
+
+    "student_co_scores": ("student_co_scores", "student scores"),
+
+}
+
+_WORKBOOK_COLUMNS = {
+
+    "co_attainment": ("year", "course", "co", "attainment_type", "value"),
+
+    "mapping": ("course", "co", "outcome", "weight"),
+
+    "thresholds": ("level", "min_pct"),
+
+    "targets": ("metric", "value"),
+
+    "student_co_scores": ("year", "course", "student_id", "co", "co_pct"),
+
+}
+
+_OPTIONAL_SHEETS = {"student_co_scores"}
+
+
+
+
+
+def _sheet_key(name) -> str:
+
+    return re.sub(r"[^a-z0-9]", "", str(name).lower())
+
+
+
+
+
+def _cell_range(cells: str) -> dict:
+
+    """
+
+    "B3:F200" (or open-ended "B3:F") -> read_excel kwargs; the range's first row is the header.
+
+    """
+
+    m = re.fullmatch(r"([A-Za-z]+)(\d+):([A-Za-z]+)(\d*)", cells.strip())
+
+    if not m:
+
+        raise ValueError(f"Bad cell range: {cells}. Use e.g. B3:F200")
+
+    first_col, first_row, last_col, last_row = m.groups()
+
+    kwargs = {"usecols": f"{first_col}:{last_col}", "skiprows": int(first_row) - 1}
+
+    if last_row:
+
+        kwargs["nrows"] = int(last_row) - int(first_row)
+
+    return kwargs
+
+
+
+
+
+@telemetry.rows_loaded("workbook")
+
+def load_workbook(path: str, sheets: Optional[dict] = None, report: Optional[dict] = None) -> dict:
+
+    """
+
+    Reads the multi-sheet NBA attainment workbook with the calamine engine,
+
+    parsing only the input sheets and only their known columns.
+
+    sheets (optional): {table: "Sheet name" or "Sheet name!B3:F200"} to override detection.
+
+    report (optional dict) is filled per table like the CSV loaders' reports.
+
+    Returns {"co_attainment", "mapping", "thresholds", "targets", "student_co_scores"};
+
+    student_co_scores is None when the workbook has no such sheet.
+
+    """
+
+    sheets = sheets or {}
+
+    book = pd.ExcelFile(path, engine="calamine")
+
+    by_key = {_sheet_key(name): name for name in book.sheet_names}
+
+
+
+    frames = {}
+
+    for table, aliases in WORKBOOK_SHEETS.items():
+
+        spec = sheets.get(table)
+
+        if spec is None:
+
+            name = next((by_key[_sheet_key(a)] for a in aliases if _sheet_key(a) in by_key), None)
+
+            cells = ""
+
+        else:
+
+            name, _, cells = spec.partition("!")
+
+        if name is None and table in _OPTIONAL_SHEETS:
+
+            frames[table] = None
+
+            continue
+
+        if name not in book.sheet_names:
+
+            raise ValueError(f"workbook has no {table} sheet. Sheets found: {book.sheet_names}")
+
+
+
+        if cells:
+
+            kwargs = _cell_range(cells)
+
+        else:
+
+            wanted = set(_WORKBOOK_COLUMNS[table])
+
+            kwargs = {"usecols": lambda c, wanted=wanted: str(c).strip() in wanted}
+
+        df = book.parse(name, **kwargs)
+
+        df.columns = [str(c).strip() for c in df.columns]
+
+        frames[table] = df.dropna(how="all")
+
+
+
+    def table_report(table):
+
+        return report.setdefault(table, {}) if report is not None else None
+
+
+
+    out = {
+
+        "co_attainment": prepare_co_attainment(frames["co_attainment"], report=table_report("co_attainment")),
+
+        "mapping": prepare_mapping(frames["mapping"], report=table_report("mapping")),
+
+        "thresholds": prepare_thresholds(frames["thresholds"]),
+
+        "targets": prepare_targets(frames["targets"]),
+
+        "student_co_scores": None,
+
+    }
+
+    if frames["student_co_scores"] is not None:
+
+        out["student_co_scores"] = prepare_student_co_scores(
+
+            frames["student_co_scores"], report=table_report("student_co_scores")
+
+        )
+
+    return out
+
+
+
+
+
+# ---------- Validation ----------
+
+def _issue(report: list, rule: str, table: str, severity: str, df: Optional[pd.DataFrame], mask, sample_rows: int,
+
+           message: str) -> None:
+
+    count = int(np.count_nonzero(mask)) if df is not None else int(bool(mask))
+
+    if count == 0:
+
+        return
+
+    sample = df.loc[np.asarray(mask)].head(sample_rows) if df is not None else pd.DataFrame()
+
+    report.append({"rule": rule, "table": table, "severity": severity, "count": count,
+
+                   "message": message, "sample": sample})
+
+
+
+
+
+def _keys_in(df: pd.DataFrame, cols: list, other: pd.DataFrame) -> np.ndarray:
+
+    left = pd.MultiIndex.from_frame(df[cols].astype(str))
+
+    right = pd.MultiIndex.from_frame(other[cols].astype(str))
+
+    return left.isin(right)
+
+
+
+
+
+def _out_of_range(s: pd.Series, lo: float, hi: float) -> np.ndarray:
+
+    v = pd.to_numeric(s, errors="coerce").to_numpy(dtype=np.float64)
+
+    return np.isnan(v) | (v < lo) | (v > hi)
+
+
+
+
+
+def validate_inputs(
+
+    co_attainment: Optional[pd.DataFrame] = None,
+
+    mapping: Optional[pd.DataFrame] = None,
+
+    thresholds: Optional[dict] = None,
+
+    targets: Optional[dict] = None,
+
+    student_co_scores: Optional[pd.DataFrame] = None,
+
+    sample_rows: int = 5,
+
+) -> dict:
+
+    """
+
+    Runs every input rule as one vectorized mask over the loaded frames.
+
+    Returns {"ok": no errors, "n_errors", "n_warnings", "issues": [
+
+        {rule, table, severity ("error"/"warning"), count, message, sample (offending rows)}]}
+
+    """
+
+    issues = []
+
+
+
+    if co_attainment is not None:
+
+        df = co_attainment
+
+        _issue(issues, "value_range", "co_attainment", "error", df, _out_of_range(df["value"], 0.0, 1.0),
+
+               sample_rows, "value must be a number in 0..1")
+
+        _issue(issues, "duplicate_key", "co_attainment", "error", df,
+
+               df.duplicated(["year", "course", "co", "attainment_type"], keep=False).to_numpy(),
+
+               sample_rows, "duplicate (year, course, co, attainment_type) rows")
+
+
+
+    if mapping is not None:
+
+        df = mapping
+
+        _issue(issues, "weight_range", "mapping", "error", df, _out_of_range(df["weight"], 0.0, 3.0),
+
+               sample_rows, "weight must be a number in 0..3")
+
+        _issue(issues, "duplicate_key", "mapping", "error", df,
+
+               df.duplicated(["course", "co", "outcome"], keep=False).to_numpy(),
+
+               sample_rows, "duplicate (course, co, outcome) rows")
+
+
+
+    if co_attainment is not None and mapping is not None:
+
+        _issue(issues, "co_not_in_attainment", "mapping", "warning", mapping,
+
+               ~_keys_in(mapping, ["course", "co"], co_attainment),
+
+               sample_rows, "(course, co) mapped but has no CO attainment rows; it contributes nothing")
+
+        _issue(issues, "co_not_mapped", "co_attainment", "warning", co_attainment,
+
+               ~_keys_in(co_attainment, ["course", "co"], mapping),
+
+               sample_rows, "(course, co) has attainment but no mapping rows; it is ignored")
+
+
+
+    if student_co_scores is not None:
+
+        df = student_co_scores
+
+        _issue(issues, "co_pct_range", "student_co_scores", "error", df, _out_of_range(df["co_pct"], 0.0, 1.0),
+
+               sample_rows, "co_pct must be a number in 0..1")
+
+        _issue(issues, "duplicate_key", "student_co_scores", "warning", df,
+
+               df.duplicated(["year", "course", "student_id", "co"], keep=False).to_numpy(),
+
+               sample_rows, "duplicate (year, course, student_id, co) rows")
+
+        if mapping is not None:
+
+            _issue(issues, "co_not_mapped", "student_co_scores", "warning", df,
+
+                   ~_keys_in(df, ["course", "co"], mapping),
+
+                   sample_rows, "(course, co) has student scores but no mapping rows")
+
+
+
+    if thresholds is not None:
+
+        t3, t2, t1 = (float(thresholds[k]) for k in (3, 2, 1))
+
+        _issue(issues, "thresholds_monotonic", "thresholds", "error", None, not (t3 >= t2 >= t1),
+
+               sample_rows, f"level cutoffs must satisfy 3 >= 2 >= 1 (got {t3}, {t2}, {t1})")
+
+        _issue(issues, "thresholds_range", "thresholds", "error", None,
+
+               not all(0.0 <= t <= 1.0 for t in (t3, t2, t1)), sample_rows, "level cutoffs must be in 0..1")
+
+
+
+    if targets is not None:
+
+        scale_max = float(targets.get("scale_max", 3.0))
+
+        target_level = float(targets.get("target_level", 1.4))
+
+        _issue(issues, "target_range", "targets", "error", None, not (0.0 < target_level <= scale_max),
+
+               sample_rows, f"target_level must be in (0, scale_max={scale_max}] (got {target_level})")
+
+
+
+    n_errors = sum(1 for i in issues if i["severity"] == "error")
+
+    return {"ok": n_errors == 0, "n_errors": n_errors, "n_warnings": len(issues) - n_errors, "issues": issues}
+
+
+
+
+
+def format_validation_report(report: dict) -> str:
+
+    lines = [f"Validation: {report['n_errors']} error(s), {report['n_warnings']} warning(s)"]
+
+    for i in report["issues"]:
+
+        lines.append(f"  [{i['severity'].upper()}] {i['table']}.{i['rule']}: {i['count']} - {i['message']}")
+
+        if not i["sample"].empty:
+
+            lines.extend("      " + line for line in i["sample"].to_string(index=False).splitlines())
+
+    return "\n".join(lines)
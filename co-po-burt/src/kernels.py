@@ -0,0 +1,221 @@
+import os
+
+
+
+import numpy as np
+
+import pandas as pd
+
+
+
+
+
+# "auto" uses numba when it is installed, else the NumPy reduceat kernels
+
+_BACKEND = os.environ.get("COPO_KERNEL_BACKEND", "auto")
+
+_BACKENDS = ("auto", "numba", "numpy")
+
+_numba = None
+
+
+
+
+
+def set_backend(name: str) -> None:
+
+    global _BACKEND
+
+    if name not in _BACKENDS:
+
+        raise ValueError(f"Unknown kernel backend: {name}. Use one of {_BACKENDS}")
+
+    _BACKEND = name
+
+
+
+
+
+def _numba_kernels():
+
+    global _numba
+
+    if _numba is None:
+
+        from src import _numba_kernels
+
+
+
+        _numba = _numba_kernels
+
+    return _numba
+
+
+
+
+
+def backend() -> str:
+
+    """
+
+    The backend the kernels will actually use ("numba" or "numpy").
+
+    """
+
+    if _BACKEND == "numpy":
+
+        return "numpy"
+
+    try:
+
+        _numba_kernels()
+
+    except ImportError:
+
+        if _BACKEND == "numba":
+
+            raise
+
+        return "numpy"
+
+    return "numba"
+
+
+
+
+
+def group_offsets(frame: pd.DataFrame, keys) -> tuple:
+
+    """
+
+    Integer-codes the key columns and sorts rows by group (stable, so rows keep their order
+
+    inside a group). Groups come out in groupby(keys, sort=True, observed=True) order and
+
+    rows with a missing key are dropped, as groupby does.
+
+    Returns (order, offsets): rows order[offsets[g]:offsets[g + 1]] form group g.
+
+    """
+
+    codes = []
+
+    for key in keys:
+
+        s = frame[key]
+
+        if isinstance(s.dtype, pd.CategoricalDtype):
+
+            codes.append(s.cat.codes.to_numpy(dtype=np.int64))
+
+        else:
+
+            codes.append(pd.factorize(s, sort=True)[0].astype(np.int64))
+
+    valid = np.all([c >= 0 for c in codes], axis=0) if codes else np.ones(len(frame), dtype=bool)
+
+    order = np.lexsort(codes[::-1])
+
+    order = order[valid[order]]
+
+    if not len(order):
+
+        return order, np.zeros(1, dtype=np.int64)
+
+    sorted_codes = np.column_stack([c[order] for c in codes])
+
+    change = np.any(sorted_codes[1:] != sorted_codes[:-1], axis=1)
+
+    starts = np.flatnonzero(np.concatenate([[True], change]))
+
+    return order, np.append(starts, len(order)).astype(np.int64)
+
+
+
+
+
+def weighted_sums(values, weights, offsets) -> tuple:
+
+    """
+
+    Per group sum(value * w) and sum(w), NaNs skipped (numerator / denom of the PO formula).
+
+    """
+
+    values = np.ascontiguousarray(values, dtype=np.float64)
+
+    weights = np.ascontiguousarray(weights, dtype=np.float64)
+
+    if backend() == "numba":
+
+        return _numba_kernels().weighted_sums(values, weights, offsets)
+
+    starts = offsets[:-1]
+
+    if not len(starts):
+
+        return np.zeros(0), np.zeros(0)
+
+    vw = values * weights
+
+    num = np.add.reduceat(np.where(np.isnan(vw), 0.0, vw), starts)
+
+    den = np.add.reduceat(np.where(np.isnan(weights), 0.0, weights), starts)
+
+    return num, den
+
+
+
+
+
+def group_min(values, offsets) -> np.ndarray:
+
+    """
+
+    Per group minimum, NaNs skipped (all-NaN group -> NaN).
+
+    """
+
+    values = np.ascontiguousarray(values, dtype=np.float64)
+
+    if backend() == "numba":
+
+        return _numba_kernels().group_min(values, offsets)
+
+    if len(offsets) < 2:
+
+        return np.zeros(0)
+
+    return np.fmin.reduceat(values, offsets[:-1])
+
+
+
+
+
+def group_mean_std(values, offsets) -> tuple:
+
+    """
+
+    Per group mean and population std (ddof=0), like np.mean / np.std on each group.
+
+    """
+
+    values = np.ascontiguousarray(values, dtype=np.float64)
+
+    if backend() == "numba":
+
+        return _numba_kernels().group_mean_std(values, offsets)
+
+    starts = offsets[:-1]
+
+    if not len(starts):
+
+        return np.zeros(0), np.zeros(0)
+
+    sizes = np.diff(offsets)
+
+    mean = np.add.reduceat(values, starts) / sizes
+
+    dev = values - np.repeat(mean, sizes)
+
+    return mean, np.sqrt(np.add.reduceat(dev * dev, starts) / sizes)
@@ -0,0 +1,171 @@
+from typing import Iterable, Optional, Union
+
+
+
+import pandas as pd
+
+
+
+from src.io_utils import _to_key, prepare_co_attainment, prepare_student_co_scores
+
+
+
+
+
+_QUESTION_KEYS = ["course", "assessment", "question"]
+
+_STUDENT_CO_KEYS = ["year", "course", "student_id", "co"]
+
+
+
+
+
+def _co_sums(marks: pd.DataFrame, question_co_map: pd.DataFrame, stats: dict) -> pd.DataFrame:
+
+    """
+
+    Per (year, course, student_id, co) sums of obtained and possible marks for one chunk.
+
+    """
+
+    qmap = question_co_map[_QUESTION_KEYS + ["co", "weight"]].copy(deep=False)
+
+    for col in _QUESTION_KEYS:
+
+        # join on the chunk's category codes; questions the chunk never saw become NaN
+
+        qmap[col] = qmap[col].astype(str).astype(marks[col].dtype)
+
+    qmap = qmap.dropna(subset=_QUESTION_KEYS)
+
+
+
+    m = marks[_STUDENT_CO_KEYS[:3] + _QUESTION_KEYS[1:] + ["marks", "max_marks"]].merge(
+
+        qmap, on=_QUESTION_KEYS, how="left"
+
+    )
+
+    unmapped = m["co"].isna().to_numpy()
+
+    stats["rows"] += len(marks)
+
+    stats["unmapped_rows"] += int(unmapped.sum())
+
+    m = m[~unmapped]
+
+
+
+    m["obtained"] = m["marks"] * m["weight"]
+
+    m["possible"] = m["max_marks"] * m["weight"]
+
+    return m.groupby(_STUDENT_CO_KEYS, observed=True, as_index=False)[["obtained", "possible"]].sum()
+
+
+
+
+
+def student_co_scores_from_marks(
+
+    marks: Union[pd.DataFrame, Iterable[pd.DataFrame]],
+
+    question_co_map: pd.DataFrame,
+
+    stats: Optional[dict] = None,
+
+) -> pd.DataFrame:
+
+    """
+
+    Per-student CO percentages from raw question marks:
+
+    co_pct = sum(marks * weight) / sum(max_marks * weight) over the questions mapped to the CO.
+
+    marks: prepared frame or an iterable of prepared chunks (see load_question_marks);
+
+    only the per-(student, co) sums are kept between chunks, so a student may span chunks.
+
+    Returns year, course, student_id, co, co_pct (ready for compute_burt_adjustments_from_students).
+
+    stats (optional dict) is filled with rows read and rows whose question has no CO.
+
+    """
+
+    if stats is None:
+
+        stats = {}
+
+    stats.update({"rows": 0, "unmapped_rows": 0})
+
+
+
+    frames = [marks] if isinstance(marks, pd.DataFrame) else marks
+
+    partials = [_co_sums(chunk, question_co_map, stats) for chunk in frames]
+
+    partials = [p for p in partials if len(p)]
+
+    if not partials:
+
+        return prepare_student_co_scores(pd.DataFrame(columns=_STUDENT_CO_KEYS + ["co_pct"]))
+
+
+
+    sums = pd.concat(partials, ignore_index=True)
+
+    for col in ("course", "student_id", "co"):
+
+        sums[col] = _to_key(sums[col], upper=col == "co")
+
+    if len(partials) > 1:
+
+        sums = sums.groupby(_STUDENT_CO_KEYS, observed=True, as_index=False)[["obtained", "possible"]].sum()
+
+
+
+    sums = sums[sums["possible"] > 0]
+
+    out = sums[_STUDENT_CO_KEYS].assign(co_pct=(sums["obtained"] / sums["possible"]).to_numpy())
+
+    out = out.sort_values(_STUDENT_CO_KEYS, ignore_index=True)
+
+    stats["student_co_rows"] = len(out)
+
+    return prepare_student_co_scores(out)
+
+
+
+
+
+def co_attainment_from_students(
+
+    student_co_scores: pd.DataFrame, pass_pct: float = 0.6, attainment_type: str = "FINAL"
+
+) -> pd.DataFrame:
+
+    """
+
+    Direct CO attainment: fraction of students with co_pct >= pass_pct, per (year, course, co).
+
+    Returns year, course, co, attainment_type, value (ready for compute_po_attainment_nba).
+
+    """
+
+    passed = (student_co_scores["co_pct"] >= pass_pct).astype(float)
+
+    out = (
+
+        student_co_scores[["year", "course", "co"]]
+
+        .assign(value=passed.to_numpy())
+
+        .groupby(["year", "course", "co"], observed=True, as_index=False)["value"]
+
+        .mean()
+
+    )
+
+    out.insert(3, "attainment_type", attainment_type)
+
+    return prepare_co_attainment(out)
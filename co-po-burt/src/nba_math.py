@@ -1,3 +1,5 @@
+from collections.abc import Mapping
+
 from typing import Optional
 
 import numpy as np
@@ -6,6 +8,10 @@ import pandas as pd
 
 
 
+from src import kernels, telemetry
+
+
+
 
 
 def pct_to_level(x: float, thresholds: dict) -> int:
@@ -30,32 +36,34 @@ def pct_to_level(x: float, thresholds: dict) -> int:
 
 
 
-def compute_po_attainment_nba(
+def compute_po_aggregates(
 
     co_attainment: pd.DataFrame,
 
     mapping: pd.DataFrame,
 
-    thresholds: dict,
-
-    targets: dict,
-
     attainment_type: str = "FINAL",
 
     assoc: Optional[pd.DataFrame] = None,
 
+    engine: str = "pandas",
+
 ) -> dict:
 
     """
 
-    co_attainment: year,course,co,attainment_type,value (0..1)
+    Target/threshold independent part of compute_po_attainment_nba: the merge and the
 
-    mapping: course,co,outcome,weight (0..3)
+    per (year, course, outcome) numerator/denom. Compute once, then finalize or sweep.
 
-    assoc (optional): course,co,assoc in [0,1] confidence scores (Option A: no weight adjustment)
+    engine: "pandas" (reference groupby) or "kernels" (src.kernels over sorted integer codes).
 
     """
 
+    if engine not in ("pandas", "kernels"):
+
+        raise ValueError(f"Unknown engine: {engine}. Use 'pandas' or 'kernels'")
+
     atype = attainment_type.upper().strip()
 
     co_use = co_attainment[co_attainment["attainment_type"] == atype].copy()
@@ -114,17 +122,23 @@ def compute_po_attainment_nba(
 
     # Aggregate PO attainment (base_po, no modification)
 
-    agg = merged.groupby(["year", "course", "outcome"], as_index=False).agg(
+    if engine == "kernels":
+
+        agg = _po_agg_kernels(merged)
 
-        numerator=("num", "sum"),
+    else:
 
-        denom=("effective_weight", "sum"),
+        agg = merged.groupby(["year", "course", "outcome"], as_index=False, observed=True).agg(
 
-        # Aggregate confidence: use minimum (most conservative) across COs contributing to this outcome
+            numerator=("num", "sum"),
 
-        po_confidence=("confidence", "min")
+            denom=("effective_weight", "sum"),
 
-    )
+            # Aggregate confidence: use minimum (most conservative) across COs contributing to this outcome
+
+            po_confidence=("confidence", "min")
+
+        )
 
     agg["attainment_value"] = np.where(agg["denom"] > 0, agg["numerator"] / agg["denom"], 0.0)
 
@@ -134,6 +148,224 @@ def compute_po_attainment_nba(
 
 
 
+    return {"co_attainment_used": co_use, "merged_detail": merged, "po_agg": agg}
+
+
+
+
+
+def _po_agg_kernels(merged: pd.DataFrame) -> pd.DataFrame:
+
+    # same frame as the groupby above, from one sort and three grouped reductions
+
+    keys = ["year", "course", "outcome"]
+
+    order, offsets = kernels.group_offsets(merged, keys)
+
+    numerator, denom = kernels.weighted_sums(
+
+        merged["value"].to_numpy()[order], merged["effective_weight"].to_numpy()[order], offsets
+
+    )
+
+    agg = merged[keys].iloc[order[offsets[:-1]]].reset_index(drop=True)
+
+    agg["numerator"] = numerator
+
+    agg["denom"] = denom
+
+    agg["po_confidence"] = kernels.group_min(merged["confidence"].to_numpy()[order], offsets)
+
+    return agg
+
+
+
+
+
+class PoAttainmentResult(Mapping):
+
+    """
+
+    Result of compute_po_attainment_nba.
+
+    Holds the CO rows, merged detail and po_long once; co_report and the po_matrix_* pivots
+
+    are derived on first access and cached. Reads like the old dict (results["po_long"],
+
+    .keys(), .items()), so existing callers keep working.
+
+    """
+
+
+
+    __slots__ = ("co_attainment_used", "merged_detail", "po_long", "thresholds", "targets", "_cache")
+
+
+
+    KEYS = (
+
+        "co_attainment_used",
+
+        "co_report",
+
+        "merged_detail",
+
+        "po_long",
+
+        "po_matrix_value",
+
+        "po_matrix_pct",
+
+        "po_matrix_scale",
+
+        "po_matrix_target",
+
+        "po_matrix_confidence",
+
+    )
+
+
+
+    # matrix key -> (po_long column, aggfunc, fill_value)
+
+    _MATRICES = {
+
+        "po_matrix_value": ("attainment_value", "mean", 0.0),
+
+        "po_matrix_pct": ("attainment_pct", "mean", 0.0),
+
+        "po_matrix_scale": ("attainment_scale", "mean", 0.0),
+
+        "po_matrix_target": ("target_met", "first", "N"),
+
+        "po_matrix_confidence": ("po_confidence", "mean", 1.0),
+
+    }
+
+
+
+    def __init__(self, co_attainment_used, merged_detail, po_long, thresholds, targets):
+
+        self.co_attainment_used = co_attainment_used
+
+        self.merged_detail = merged_detail
+
+        self.po_long = po_long
+
+        self.thresholds = thresholds
+
+        self.targets = targets
+
+        self._cache = {}
+
+
+
+    def __getitem__(self, key):
+
+        if key in ("co_attainment_used", "merged_detail", "po_long"):
+
+            return getattr(self, key)
+
+        if key not in self.KEYS:
+
+            raise KeyError(key)
+
+        if key not in self._cache:
+
+            if key == "co_report":
+
+                self._cache[key] = self._build_co_report()
+
+            else:
+
+                self._cache[key] = self._build_matrix(*self._MATRICES[key])
+
+        return self._cache[key]
+
+
+
+    def __iter__(self):
+
+        return iter(self.KEYS)
+
+
+
+    def __len__(self):
+
+        return len(self.KEYS)
+
+
+
+    @property
+
+    def co_report(self) -> pd.DataFrame:
+
+        return self["co_report"]
+
+
+
+    def _build_co_report(self) -> pd.DataFrame:
+
+        # CO-level reporting too (vectorized pct_to_level)
+
+        co_rep = self.co_attainment_used.copy()
+
+        co_rep["level"] = levels_for_thresholds(co_rep["value"], [self.thresholds])[0].astype(np.int64)
+
+        return co_rep
+
+
+
+    def _build_matrix(self, values, aggfunc, fill_value) -> pd.DataFrame:
+
+        return self.po_long.pivot_table(
+
+            index=["year", "course"], columns="outcome", values=values, observed=True,
+
+            aggfunc=aggfunc, fill_value=fill_value,
+
+        ).reset_index()
+
+
+
+    def to_dict(self) -> dict:
+
+        return {k: self[k] for k in self.KEYS}
+
+
+
+    def to_arrow(self, key: str):
+
+        """
+
+        pyarrow.Table for one result key (numeric columns are handed over without copying).
+
+        """
+
+        import pyarrow as pa
+
+
+
+        return pa.Table.from_pandas(self[key], preserve_index=False)
+
+
+
+
+
+def finalize_po_attainment(aggregates: dict, thresholds: dict, targets: dict) -> PoAttainmentResult:
+
+    """
+
+    Applies targets and level thresholds to compute_po_aggregates output.
+
+    Returns the same result as compute_po_attainment_nba.
+
+    """
+
+    agg = aggregates["po_agg"].copy()
+
+
+
     scale_max = float(targets.get("scale_max", 3.0))
 
     target_level = float(targets.get("target_level", 1.4))
@@ -148,46 +380,220 @@ def compute_po_attainment_nba(
 
 
 
-    # CO-level reporting too
+    # co_report and the pivot matrices are built lazily by the result object
 
-    co_rep = co_use.copy()
+    return PoAttainmentResult(
 
-    co_rep["level"] = co_rep["value"].apply(lambda x: pct_to_level(float(x), thresholds))
+        co_attainment_used=aggregates["co_attainment_used"],
 
+        merged_detail=aggregates["merged_detail"],
 
+        po_long=agg,
 
-    # Pivot matrix outputs for convenience
+        thresholds=thresholds,
 
-    po_matrix = agg.pivot_table(index=["year", "course"], columns="outcome", values="attainment_value", fill_value=0.0)
+        targets=targets,
 
-    po_matrix_pct = agg.pivot_table(index=["year", "course"], columns="outcome", values="attainment_pct", fill_value=0.0)
+    )
 
-    po_matrix_scale = agg.pivot_table(index=["year", "course"], columns="outcome", values="attainment_scale", fill_value=0.0)
 
-    po_matrix_target = agg.pivot_table(index=["year", "course"], columns="outcome", values="target_met", aggfunc="first", fill_value="N")
 
-    po_matrix_confidence = agg.pivot_table(index=["year", "course"], columns="outcome", values="po_confidence", fill_value=1.0)
 
 
+@telemetry.stage("compute_po_attainment_nba")
 
-    return {
+def compute_po_attainment_nba(
 
-        "co_attainment_used": co_use,
+    co_attainment: pd.DataFrame,
 
-        "co_report": co_rep,
+    mapping: pd.DataFrame,
 
-        "merged_detail": merged,
+    thresholds: dict,
 
-        "po_long": agg,
+    targets: dict,
 
-        "po_matrix_value": po_matrix.reset_index(),
+    attainment_type: str = "FINAL",
 
-        "po_matrix_pct": po_matrix_pct.reset_index(),
+    assoc: Optional[pd.DataFrame] = None,
 
-        "po_matrix_scale": po_matrix_scale.reset_index(),
+    engine: str = "pandas",
 
-        "po_matrix_target": po_matrix_target.reset_index(),
+) -> PoAttainmentResult:
 
-        "po_matrix_confidence": po_matrix_confidence.reset_index(),
+    """
 
-    }
+    co_attainment: year,course,co,attainment_type,value (0..1)
+
+    mapping: course,co,outcome,weight (0..3)
+
+    assoc (optional): course,co,assoc in [0,1] confidence scores (Option A: no weight adjustment)
+
+    """
+
+    aggregates = compute_po_aggregates(co_attainment, mapping, attainment_type=attainment_type, assoc=assoc,
+
+                                       engine=engine)
+
+    return finalize_po_attainment(aggregates, thresholds, targets)
+
+
+
+
+
+def levels_for_thresholds(values, thresholds_grid) -> np.ndarray:
+
+    """
+
+    Vectorized pct_to_level for many threshold dicts at once.
+
+    Returns int8 array of shape (len(thresholds_grid), len(values)).
+
+    """
+
+    v = np.asarray(values, dtype=np.float64)[None, :]
+
+    t = np.array([[th[3], th[2], th[1]] for th in thresholds_grid], dtype=np.float64)
+
+    return np.select(
+
+        [v >= t[:, 0:1], v >= t[:, 1:2], v >= t[:, 2:3]],
+
+        [3, 2, 1],
+
+        default=0,
+
+    ).astype(np.int8)
+
+
+
+
+
+def sweep_targets(
+
+    aggregates: dict,
+
+    target_levels,
+
+    scale_maxes=(3.0,),
+
+    thresholds_grid=(),
+
+) -> dict:
+
+    """
+
+    What-if evaluation over a grid of targets/thresholds from compute_po_aggregates output,
+
+    without redoing the merge/groupby.
+
+
+
+    Returns:
+
+      po_keys: year,course,outcome (axis 2 of target_met)
+
+      target_met: bool cube (len(target_levels), len(scale_maxes), len(po_keys))
+
+      target_summary: target_level,scale_max,outcome,n_met,n_total
+
+      co_levels / level_counts (only with thresholds_grid): int8 (len(grid), n_co) and
+
+        grid_id,level_3,level_2,level_1,level,n_cos
+
+    """
+
+    agg = aggregates["po_agg"]
+
+    po_keys = agg[["year", "course", "outcome"]].reset_index(drop=True)
+
+
+
+    tl = np.asarray(target_levels, dtype=np.float64)
+
+    sm = np.asarray(scale_maxes, dtype=np.float64)
+
+    scale = agg["attainment_value"].to_numpy(dtype=np.float64)[None, :] * sm[:, None]  # (S, N)
+
+    met = scale[None, :, :] >= tl[:, None, None]  # (T, S, N)
+
+
+
+    # per-outcome counts across courses/years: segment sums over rows sorted by outcome
+
+    out_codes, out_labels = pd.factorize(po_keys["outcome"], sort=True)
+
+    n_out = len(out_labels)
+
+    order = np.argsort(out_codes, kind="stable")
+
+    n_total = np.bincount(out_codes, minlength=n_out)
+
+    starts = np.concatenate([[0], np.cumsum(n_total)[:-1]])
+
+    if len(order):
+
+        n_met = np.add.reduceat(met[:, :, order].astype(np.int64), starts, axis=2)  # (T, S, O)
+
+    else:
+
+        n_met = np.zeros((len(tl), len(sm), 0), dtype=np.int64)
+
+
+
+    T, S = len(tl), len(sm)
+
+    summary = pd.DataFrame(
+
+        {
+
+            "target_level": np.repeat(tl, S * n_out),
+
+            "scale_max": np.tile(np.repeat(sm, n_out), T),
+
+            "outcome": np.tile(np.asarray(out_labels, dtype=object), T * S),
+
+            "n_met": n_met.ravel(),
+
+            "n_total": np.tile(n_total, T * S),
+
+        }
+
+    )
+
+
+
+    out = {"po_keys": po_keys, "target_met": met, "target_summary": summary}
+
+
+
+    if len(thresholds_grid):
+
+        levels = levels_for_thresholds(aggregates["co_attainment_used"]["value"], thresholds_grid)
+
+        counts = np.stack([(levels == lv).sum(axis=1) for lv in (0, 1, 2, 3)], axis=1)  # (G, 4)
+
+        G = len(thresholds_grid)
+
+        out["co_levels"] = levels
+
+        out["level_counts"] = pd.DataFrame(
+
+            {
+
+                "grid_id": np.repeat(np.arange(G), 4),
+
+                "level_3": np.repeat([float(th[3]) for th in thresholds_grid], 4),
+
+                "level_2": np.repeat([float(th[2]) for th in thresholds_grid], 4),
+
+                "level_1": np.repeat([float(th[1]) for th in thresholds_grid], 4),
+
+                "level": np.tile([0, 1, 2, 3], G),
+
+                "n_cos": counts.ravel(),
+
+            }
+
+        )
+
+    return out
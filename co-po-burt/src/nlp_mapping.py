@@ -1,10 +1,29 @@
+import hashlib
+import itertools
+import json
+import os
+import re
+import tempfile
+import time
+import warnings
+import uuid
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
 import pandas as pd
 import numpy as np
 import torch
 
 from transformers import AutoTokenizer, AutoModel
+from sklearn.feature_extraction.text import TfidfVectorizer
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
 from sklearn.metrics.pairwise import cosine_similarity
 
+from src import telemetry
+
 
 
 def detect_id_column(df, keywords):
@@ -53,14 +72,22 @@ def detect_id_column(df, keywords):
 
 
 
-def detect_text_column(df, id_col):
+def detect_text_column(df, id_col, sample_rows=500):
 
     """
 
-    Detect the text/statement column (anything except ID)
+    Detect the text/statement column (anything except ID).
+
+    Only the first sample_rows rows are scanned for average string length.
 
     """
 
+    if sample_rows is not None:
+
+        df = df.head(sample_rows)
+
+
+
     candidates = [c for c in df.columns if c != id_col]
 
 
@@ -125,6 +152,84 @@ def detect_text_column(df, id_col):
 
 
 
+CO_ID_KEYWORDS = ("co",)
+
+PO_ID_KEYWORDS = ("po", "pso", "outcome")
+
+
+
+# (header, keywords) -> (id_col, text_col); uploads from the same export share a schema
+
+_SCHEMA_CACHE = {}
+
+
+
+
+
+def detect_statement_columns(df, keywords, sample_rows=500):
+
+    """
+
+    Returns (id_col, text_col), memoized by the header signature.
+
+    """
+
+    key = (tuple(str(c) for c in df.columns), tuple(keywords))
+
+    telemetry.cache_lookup("schema", hits=int(key in _SCHEMA_CACHE), misses=int(key not in _SCHEMA_CACHE))
+
+    if key not in _SCHEMA_CACHE:
+
+        id_col = detect_id_column(df, list(keywords))
+
+        _SCHEMA_CACHE[key] = (id_col, detect_text_column(df, id_col, sample_rows=sample_rows))
+
+    return _SCHEMA_CACHE[key]
+
+
+
+
+
+def read_statement_csv(source, keywords, id_col=None, text_col=None, encoding="latin1", sample_rows=500):
+
+    """
+
+    Reads only the ID and statement columns of a CO/PO statements CSV.
+
+    Columns that are not pinned via id_col/text_col are detected from the first sample_rows rows.
+
+    Returns a frame with exactly [id_col, text_col].
+
+    """
+
+    if id_col is None or text_col is None:
+
+        if hasattr(source, "seek"):
+
+            source.seek(0)
+
+        sample = pd.read_csv(source, encoding=encoding, nrows=sample_rows)
+
+        det_id, det_text = detect_statement_columns(sample, keywords, sample_rows=sample_rows)
+
+        id_col = id_col or det_id
+
+        text_col = text_col or (det_text if id_col == det_id else detect_text_column(sample, id_col, sample_rows))
+
+
+
+    if hasattr(source, "seek"):
+
+        source.seek(0)
+
+    df = pd.read_csv(source, encoding=encoding, usecols=[id_col, text_col])
+
+    return df[[id_col, text_col]]
+
+
+
+
+
 def similarity_to_weight(sim, t3=0.75, t2=0.50, t1=0.26):
 
     if sim >= t3:
@@ -147,202 +252,2012 @@ def similarity_to_weight(sim, t3=0.75, t2=0.50, t1=0.26):
 
 # ---------- BERT embedding helpers ----------
 
+_POOLINGS = ("mean", "cls", "max")
+
+_DEFAULT_THRESHOLDS = (0.75, 0.50, 0.26)  # (t3, t2, t1), tuned for bert-base-uncased mean pooling
+
+
+
+# name -> {"path": local dir or hub id, "pooling", "thresholds": calibrated (t3, t2, t1) or None}
+
+MODEL_REGISTRY = {
+
+    "bert-base-uncased": {"path": "bert-base-uncased", "pooling": "mean", "thresholds": _DEFAULT_THRESHOLDS},
+
+}
+
 _MODEL_NAME = "bert-base-uncased"
 
-_tokenizer = None
+_models = {}  # path -> (tokenizer, model)
 
-_model = None
 
 
+# (tokenizer path, max_length) -> LRU {text: int32 token ids}; mirrored to disk when a cache dir is set
 
-def _load_bert():
+_token_ids = {}
 
-    global _tokenizer, _model
+_TOKEN_CACHE_DIR = os.environ.get("COPO_TOKEN_CACHE_DIR")
 
-    if _tokenizer is None or _model is None:
+_TOKEN_CACHE_MAX = int(os.environ.get("COPO_TOKEN_CACHE_MAX", 200000))  # texts kept in memory per tokenizer
 
-        _tokenizer = AutoTokenizer.from_pretrained(_MODEL_NAME)
+_TOKEN_FILES_COMPACT = 64  # merge the on-disk chunk files once there are more than this
 
-        _model = AutoModel.from_pretrained(_MODEL_NAME)
+# on-disk chunk files per tokenizer; the oldest are deleted once they add up to more than this
 
-        _model.eval()
+_TOKEN_CACHE_DISK_MB = float(os.environ.get("COPO_TOKEN_CACHE_DISK_MB", 512))
 
-    return _tokenizer, _model
 
 
 
-@torch.no_grad()
 
-def bert_encode_texts(texts, batch_size=16, max_length=128, device=None):
+def register_model(name, path, pooling="mean", thresholds=None):
 
     """
 
-    Returns L2-normalized sentence embeddings using mean pooling over token embeddings.
+    Adds a (sentence-)transformer checkpoint, e.g. a local MiniLM directory.
+
+    thresholds: calibrated (t3, t2, t1); None until calibrate_model has been run.
 
     """
 
-    tokenizer, model = _load_bert()
+    if pooling not in _POOLINGS:
 
+        raise ValueError(f"Unknown pooling: {pooling}. Use one of {_POOLINGS}")
 
+    MODEL_REGISTRY[name] = {
 
-    if device is None:
+        "path": str(path),
 
-        device = "cuda" if torch.cuda.is_available() else "cpu"
+        "pooling": pooling,
 
+        "thresholds": tuple(float(t) for t in thresholds) if thresholds is not None else None,
 
+    }
 
-    model.to(device)
 
 
 
-    all_embs = []
+
+def load_registry(path):
+
+    """
+
+    Merges registry entries from a JSON file ({name: {path, pooling, thresholds}}).
+
+    """
+
+    with open(path, encoding="utf-8") as f:
+
+        for name, entry in json.load(f).items():
+
+            register_model(name, entry["path"], entry.get("pooling", "mean"), entry.get("thresholds"))
+
+
+
+
+
+def save_registry(path):
+
+    with open(path, "w", encoding="utf-8") as f:
+
+        json.dump(MODEL_REGISTRY, f, indent=2)
+
+
+
+
+
+def _resolve_model(model=None):
+
+    name = model or _MODEL_NAME
+
+    if name in MODEL_REGISTRY:
+
+        return {"name": name, **MODEL_REGISTRY[name]}
+
+    for registered, entry in MODEL_REGISTRY.items():
+
+        if entry["path"] == str(name):
+
+            return {"name": registered, **entry}
+
+    # unregistered checkpoint path: usable for encoding, but its cutoffs must be calibrated
+
+    # (the BERT defaults only hold for bert-base-uncased)
+
+    return {"name": name, "path": str(name), "pooling": "mean", "thresholds": None}
+
+
+
+
+
+def model_thresholds(model=None):
+
+    entry = _resolve_model(model)
+
+    if entry["thresholds"] is None:
+
+        raise ValueError(f"Model {entry['name']} has no calibrated thresholds. Run calibrate_model first.")
+
+    return entry["thresholds"]
+
+
+
+
+
+def _load_model(path):
+
+    telemetry.cache_lookup("model", hits=int(path in _models), misses=int(path not in _models))
+
+    if path not in _models:
+
+        tokenizer = AutoTokenizer.from_pretrained(path, use_fast=True)
+
+        if not tokenizer.is_fast:
+
+            warnings.warn(
+
+                f"No fast (Rust) tokenizer available for {path}; falling back to the slow Python tokenizer.",
+
+                RuntimeWarning,
+
+            )
+
+        model = AutoModel.from_pretrained(path)
+
+        model.eval()
+
+        _models[path] = (tokenizer, model)
+
+    return _models[path]
 
 
 
-    for start in range(0, len(texts), batch_size):
 
-        batch = texts[start : start + batch_size]
 
+def set_token_cache_dir(path):
 
+    """
+
+    Persist token ids under path so other processes / later runs skip tokenization.
+
+    None keeps the cache in memory only.
+
+    """
+
+    global _TOKEN_CACHE_DIR
+
+    _TOKEN_CACHE_DIR = str(path) if path is not None else None
+
+    if _TOKEN_CACHE_DIR:
+
+        Path(_TOKEN_CACHE_DIR).mkdir(parents=True, exist_ok=True)
+
+
+
+
+
+def _token_cache_stem(path, max_length):
+
+    key = hashlib.sha1(f"{path}|{max_length}".encode("utf-8")).hexdigest()[:16]
+
+    return f"tokens_{key}"
 
-        enc = tokenizer(
 
-            batch,
 
-            padding=True,
 
-            truncation=True,
 
-            max_length=max_length,
+def _write_token_file(entries, stem):
 
-            return_tensors="pt",
+    # npz of texts + concatenated ids (no pickle), published atomically under a unique name
+
+    texts = list(entries)
+
+    ids = [entries[t] for t in texts]
+
+    directory = Path(_TOKEN_CACHE_DIR)
+
+    directory.mkdir(parents=True, exist_ok=True)
+
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+
+    with os.fdopen(fd, "wb") as fh:
+
+        np.savez(
+
+            fh,
+
+            texts=np.array(texts, dtype=str),
+
+            lengths=np.array([len(x) for x in ids], dtype=np.int64),
+
+            ids=np.concatenate(ids).astype(np.int32) if ids else np.empty(0, dtype=np.int32),
 
         )
 
-        enc = {k: v.to(device) for k, v in enc.items()}
+    os.replace(tmp, directory / f"{stem}_{uuid.uuid4().hex}.npz")
 
 
 
-        out = model(**enc)  # last_hidden_state: (B, T, H)
 
-        last_hidden = out.last_hidden_state
 
-        attention_mask = enc["attention_mask"].unsqueeze(-1)  # (B, T, 1)
+def _read_token_file(f):
 
+    with np.load(f, allow_pickle=False) as z:
 
+        ids, bounds = z["ids"], np.concatenate([[0], np.cumsum(z["lengths"])])
 
-        # mean pooling with mask
+        return {t: ids[a:b] for t, a, b in zip(z["texts"].tolist(), bounds[:-1], bounds[1:])}
 
-        masked = last_hidden * attention_mask
 
-        summed = masked.sum(dim=1)
 
-        counts = attention_mask.sum(dim=1).clamp(min=1e-9)
 
-        mean_pooled = summed / counts  # (B, H)
 
+def _trim_token_cache(cache):
 
+    while len(cache) > _TOKEN_CACHE_MAX:
 
-        # L2 normalize
+        cache.popitem(last=False)
 
-        mean_pooled = torch.nn.functional.normalize(mean_pooled, p=2, dim=1)
 
 
 
-        all_embs.append(mean_pooled.cpu().numpy())
 
+def _token_files(stem):
 
+    # (mtime, size, file) of one tokenizer's chunk files, newest first; stat only, nothing is read
 
-    return np.vstack(all_embs)
+    files = []
 
+    for f in Path(_TOKEN_CACHE_DIR).glob(f"{stem}_*.npz"):
 
+        try:
 
+            st = f.stat()
 
+        except OSError:  # removed by another process
 
-def generate_co_po_mapping(co_df: pd.DataFrame, po_df: pd.DataFrame) -> pd.DataFrame:
+            continue
 
-    # ---- detect columns safely ----
+        files.append((st.st_mtime, st.st_size, f))
 
-    co_id_col = detect_id_column(co_df, ["co"])
+    return sorted(files, key=lambda x: x[0], reverse=True)
 
-    po_id_col = detect_id_column(po_df, ["po", "pso", "outcome"])
 
 
 
-    co_text_col = detect_text_column(co_df, co_id_col)
 
-    po_text_col = detect_text_column(po_df, po_id_col)
+def _trim_token_files(stem):
 
+    total = 0
 
+    for _, size, f in _token_files(stem):
 
-    # ---- clean data ----
+        total += size
 
-    co_df = co_df.dropna(subset=[co_text_col])
+        if total > _TOKEN_CACHE_DISK_MB * 2**20:
 
-    po_df = po_df.dropna(subset=[po_text_col])
+            f.unlink(missing_ok=True)
 
 
 
-    co_ids = co_df[co_id_col].astype(str).str.strip().tolist()
 
-    po_ids = po_df[po_id_col].astype(str).str.strip().tolist()
 
+def _token_cache(path, max_length):
 
+    key = (path, max_length)
 
-    # normalize text a bit
+    if key not in _token_ids:
 
-    co_texts = (
+        cache = OrderedDict()
 
-        co_df[co_text_col].astype(str).str.replace(r"\s+", " ", regex=True).str.strip().tolist()
+        if _TOKEN_CACHE_DIR and Path(_TOKEN_CACHE_DIR).is_dir():
 
-    )
+            stem = _token_cache_stem(path, max_length)
 
-    po_texts = (
+            # newest files first, only until the in-memory cap is reached
 
-        po_df[po_text_col].astype(str).str.replace(r"\s+", " ", regex=True).str.strip().tolist()
+            loaded, read, n = [], [], 0
 
-    )
+            for _, _, f in _token_files(stem):
 
+                if n >= _TOKEN_CACHE_MAX:
 
+                    break
 
-    # ---- BERT embeddings ----
+                try:
 
-    co_emb = bert_encode_texts(co_texts, batch_size=16, max_length=128)
+                    loaded.append(_read_token_file(f))
 
-    po_emb = bert_encode_texts(po_texts, batch_size=16, max_length=128)
+                    read.append(f)
 
+                    n += len(loaded[-1])
 
+                except (OSError, ValueError, KeyError):  # compacted away by another process, or truncated
 
-    sim_matrix = cosine_similarity(co_emb, po_emb)
+                    continue
 
+            for entries in reversed(loaded):
 
+                cache.update(entries)
 
-    # ---- build mapping ----
+            _trim_token_cache(cache)
 
-    rows = []
+            if len(read) > _TOKEN_FILES_COMPACT:
 
-    for i, co in enumerate(co_ids):
+                _write_token_file(cache, stem)
 
-        for j, outcome in enumerate(po_ids):
+                for f in read:
 
-            sim = float(sim_matrix[i, j])
+                    f.unlink(missing_ok=True)
 
-            rows.append(
+            _trim_token_files(stem)
 
-                {
+        _token_ids[key] = cache
 
-                    "co": co,
+    return _token_ids[key]
 
-                    "outcome": outcome,
 
-                    "similarity": round(sim, 4),
 
-                    "weight": similarity_to_weight(sim, t3=0.75, t2=0.50, t1=0.26),
 
-                }
 
-            )
+def tokenize_corpus(texts, max_length=128, model=None):
+
+    """
+
+    Token ids (int32 arrays, unpadded) for every text.
+
+    Texts not seen before are tokenized in one tokenizer call; the rest come from the cache.
+
+    New ids are appended to the cache dir as one file per call (never rewriting earlier ones);
+
+    the oldest files go once the directory holds more than COPO_TOKEN_CACHE_DISK_MB per tokenizer.
+
+    """
+
+    path = _resolve_model(model)["path"]
+
+    tokenizer, _ = _load_model(path)
+
+    cache = _token_cache(path, max_length)
+
+
+
+    unique = dict.fromkeys(texts)
+
+    found = {}
+
+    for t in unique:
+
+        if t in cache:
+
+            cache.move_to_end(t)
+
+            found[t] = cache[t]
+
+    missing = [t for t in unique if t not in found]
+
+    telemetry.cache_lookup("token", hits=len(found), misses=len(missing))
+
+    if missing:
+
+        enc = tokenizer(missing, truncation=True, max_length=max_length)
+
+        new = {text: np.asarray(ids, dtype=np.int32) for text, ids in zip(missing, enc["input_ids"])}
+
+        found.update(new)
+
+        cache.update(new)
+
+        _trim_token_cache(cache)
+
+        if _TOKEN_CACHE_DIR:
+
+            stem = _token_cache_stem(path, max_length)
+
+            _write_token_file(new, stem)
+
+            _trim_token_files(stem)
+
+
+
+    return [found[t] for t in texts]
+
+
+
+
+
+def _structural_ids(tokenizer):
+
+    # [CLS]/[SEP]/[PAD]-style ids; [UNK] stays, it still stands for a word
+
+    return [i for i in tokenizer.all_special_ids if i != tokenizer.unk_token_id]
+
+
+
+
+
+def _collate(token_ids, tokenizer):
+
+    # right-pad a batch of cached ids, same tensors as tokenizer(batch, padding=True)
+
+    width = max(len(ids) for ids in token_ids)
+
+    input_ids = np.full((len(token_ids), width), tokenizer.pad_token_id, dtype=np.int64)
+
+    attention_mask = np.zeros((len(token_ids), width), dtype=np.int64)
+
+    for i, ids in enumerate(token_ids):
+
+        input_ids[i, : len(ids)] = ids
+
+        attention_mask[i, : len(ids)] = 1
+
+
+
+    enc = {"input_ids": torch.from_numpy(input_ids), "attention_mask": torch.from_numpy(attention_mask)}
+
+    if "token_type_ids" in tokenizer.model_input_names:
+
+        enc["token_type_ids"] = torch.zeros_like(enc["input_ids"])
+
+    return enc
+
+
+
+
+
+def _load_bert(model=None):
+
+    return _load_model(_resolve_model(model)["path"])
+
+
+
+
+
+def _pool(last_hidden, attention_mask, pooling):
+
+    # last_hidden: (B, T, H), attention_mask: (B, T, 1)
+
+    if pooling == "cls":
+
+        return last_hidden[:, 0]
+
+    if pooling == "max":
+
+        return last_hidden.masked_fill(attention_mask == 0, float("-inf")).max(dim=1).values
+
+    # mean pooling with mask
+
+    masked = last_hidden * attention_mask
+
+    summed = masked.sum(dim=1)
+
+    counts = attention_mask.sum(dim=1).clamp(min=1e-9)
 
+    return summed / counts
 
 
+
+
+
+def _texts_digest(texts):
+
+    h = hashlib.sha1()
+
+    for t in texts:
+
+        h.update(t.encode("utf-8"))
+
+        h.update(b"\0")
+
+    return h.hexdigest()
+
+
+
+
+
+def _read_checkpoint(ckpt, meta):
+
+    """
+
+    (finished embedding shards, complete flag) from an encoding checkpoint directory.
+
+    """
+
+    manifest = ckpt / "manifest.json"
+
+    if not manifest.exists():
+
+        return [], False
+
+    with open(manifest, encoding="utf-8") as f:
+
+        saved = json.load(f)
+
+    if any(saved.get(k) != v for k, v in meta.items()):
+
+        raise ValueError(
+
+            f"Checkpoint {ckpt} was written for different texts or model settings. Use a new checkpoint_dir."
+
+        )
+
+    return [np.load(ckpt / shard) for shard in saved["shards"]], saved["complete"]
+
+
+
+
+
+def _write_checkpoint(ckpt, meta, shards, n_rows, complete):
+
+    # shards are append-only; the manifest is replaced atomically after each new shard
+
+    tmp = ckpt / f"manifest.json.{os.getpid()}.tmp"
+
+    with open(tmp, "w", encoding="utf-8") as f:
+
+        json.dump({**meta, "shards": shards, "n_rows": n_rows, "complete": complete}, f, indent=2)
+
+    os.replace(tmp, ckpt / "manifest.json")
+
+
+
+
+
+def _save_shard(ckpt, shards, embs):
+
+    name = f"shard_{len(shards):05d}.npy"
+
+    tmp = ckpt / f"{name}.{os.getpid()}.tmp"
+
+    with open(tmp, "wb") as f:
+
+        np.save(f, np.vstack(embs))
+
+    os.replace(tmp, ckpt / name)
+
+    shards.append(name)
+
+
+
+
+
+@torch.no_grad()
+
+@telemetry.stage("bert_encode_texts")
+
+def bert_encode_texts(
+
+    texts,
+
+    batch_size=16,
+
+    max_length=128,
+
+    device=None,
+
+    model=None,
+
+    pooling=None,
+
+    token_states=None,
+
+    checkpoint_dir=None,
+
+    checkpoint_every=32,
+
+):
+
+    """
+
+    Returns L2-normalized sentence embeddings.
+
+    model: registry name or checkpoint path (default _MODEL_NAME)
+
+    pooling: "mean" (masked), "cls" or "max"; defaults to the model's registry entry.
+
+    token_states (optional list): extended with one (n_tokens, H) float32 array of
+
+    L2-normalized token embeddings per text (special tokens dropped), for explain mode.
+
+    checkpoint_dir (optional): every checkpoint_every batches, finished embeddings are saved
+
+    as a shard plus manifest.json; a rerun with the same texts resumes after the last shard,
+
+    and a completed checkpoint is returned without loading the model.
+
+    """
+
+    entry = _resolve_model(model)
+
+    pooling = pooling or entry["pooling"]
+
+    if pooling not in _POOLINGS:
+
+        raise ValueError(f"Unknown pooling: {pooling}. Use one of {_POOLINGS}")
+
+
+
+    all_embs, shards, pending = [], [], []
+
+    if checkpoint_dir is not None:
+
+        if token_states is not None:
+
+            raise ValueError("token_states cannot be combined with checkpoint_dir")
+
+        ckpt = Path(checkpoint_dir)
+
+        ckpt.mkdir(parents=True, exist_ok=True)
+
+        meta = {
+
+            "model": entry["path"],
+
+            "pooling": pooling,
+
+            "max_length": max_length,
+
+            "n_texts": len(texts),
+
+            "texts_sha1": _texts_digest(texts),
+
+        }
+
+        all_embs, complete = _read_checkpoint(ckpt, meta)
+
+        shards = [f"shard_{i:05d}.npy" for i in range(len(all_embs))]
+
+        done = sum(len(e) for e in all_embs)
+
+        telemetry.cache_lookup("encode_checkpoint", hits=done, misses=len(texts) - done)
+
+        if complete:
+
+            return np.vstack(all_embs)
+
+    resume_from = sum(len(e) for e in all_embs)
+
+    telemetry.set_attribute("n_texts", len(texts))
+
+
+
+    tokenizer, model = _load_model(entry["path"])
+
+    token_ids = tokenize_corpus(texts, max_length=max_length, model=entry["path"])
+
+
+
+    if device is None:
+
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+
+
+
+    model.to(device)
+
+
+
+    started = time.perf_counter()
+
+    for start in range(resume_from, len(texts), batch_size):
+
+        enc = _collate(token_ids[start : start + batch_size], tokenizer)
+
+        enc = {k: v.to(device) for k, v in enc.items()}
+
+
+
+        out = model(**enc)  # last_hidden_state: (B, T, H)
+
+        last_hidden = out.last_hidden_state
+
+        attention_mask = enc["attention_mask"].unsqueeze(-1)  # (B, T, 1)
+
+
+
+        pooled = _pool(last_hidden, attention_mask, pooling)  # (B, H)
+
+
+
+        if token_states is not None:
+
+            normed = torch.nn.functional.normalize(last_hidden, p=2, dim=2).cpu().numpy()
+
+            for i, ids in enumerate(token_ids[start : start + batch_size]):
+
+                keep = ~np.isin(ids, _structural_ids(tokenizer))
+
+                token_states.append(normed[i, : len(ids)][keep].astype(np.float32))
+
+
+
+        # L2 normalize
+
+        pooled = torch.nn.functional.normalize(pooled, p=2, dim=1)
+
+
+
+        all_embs.append(pooled.cpu().numpy())
+
+
+
+        if checkpoint_dir is not None:
+
+            pending.append(all_embs[-1])
+
+            if len(pending) >= checkpoint_every:
+
+                _save_shard(ckpt, shards, pending)
+
+                _write_checkpoint(ckpt, meta, shards, start + len(pending[-1]), complete=False)
+
+                pending = []
+
+
+
+    if checkpoint_dir is not None:
+
+        if pending:
+
+            _save_shard(ckpt, shards, pending)
+
+        _write_checkpoint(ckpt, meta, shards, len(texts), complete=True)
+
+
+
+    telemetry.throughput("copo_texts_encoded", len(texts) - resume_from, time.perf_counter() - started, model=entry["path"])
+
+    return np.vstack(all_embs)
+
+
+
+
+
+# ---------- Prefilter helpers ----------
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+_MINHASH_PRIME = (1 << 31) - 1
+
+
+
+
+
+def _shingles(text, n=3):
+
+    words = _WORD_RE.findall(text.lower())
+
+    if len(words) < n:
+
+        return {" ".join(words)}
+
+    return {" ".join(words[i : i + n]) for i in range(len(words) - n + 1)}
+
+
+
+
+
+def _minhash(shingle_sets, num_perm=64, seed=0):
+
+    """
+
+    (N, num_perm) MinHash signatures for a list of shingle sets.
+
+    """
+
+    rng = np.random.default_rng(seed)
+
+    a = rng.integers(1, _MINHASH_PRIME, size=num_perm, dtype=np.uint64)
+
+    b = rng.integers(0, _MINHASH_PRIME, size=num_perm, dtype=np.uint64)
+
+
+
+    sigs = np.empty((len(shingle_sets), num_perm), dtype=np.uint64)
+
+    for i, sh in enumerate(shingle_sets):
+
+        h = np.array([zlib.crc32(x.encode("utf-8")) % _MINHASH_PRIME for x in sh], dtype=np.uint64)
+
+        sigs[i] = ((np.outer(h, a) + b) % _MINHASH_PRIME).min(axis=0)
+
+    return sigs
+
+
+
+
+
+def dedupe_statements(texts, near_dup_threshold=None, num_perm=64, bands=16):
+
+    """
+
+    Groups statements so that each group only needs to be encoded once.
+
+    Returns (unique_texts, inverse) with texts[i] represented by unique_texts[inverse[i]].
+
+
+
+    Exact duplicates always collapse. Near duplicates (Jaccard over word 3-shingles,
+
+    candidates found with MinHash LSH) only collapse when near_dup_threshold is set,
+
+    since they then share the embedding of the first statement in their group.
+
+    """
+
+    codes, uniques = pd.factorize(pd.Series(list(texts), dtype=object))
+
+    uniques = list(uniques)
+
+    if near_dup_threshold is None or len(uniques) < 2:
+
+        return uniques, codes
+
+
+
+    shingle_sets = [_shingles(t) for t in uniques]
+
+    sigs = _minhash(shingle_sets, num_perm=num_perm)
+
+
+
+    parent = list(range(len(uniques)))
+
+
+
+    def find(i):
+
+        while parent[i] != i:
+
+            parent[i] = parent[parent[i]]
+
+            i = parent[i]
+
+        return i
+
+
+
+    rows = num_perm // bands
+
+    checked = set()
+
+    for b in range(bands):
+
+        buckets = {}
+
+        for i, band in enumerate(map(bytes, sigs[:, b * rows : (b + 1) * rows])):
+
+            buckets.setdefault(band, []).append(i)
+
+        # every pair sharing a bucket is a candidate; pairs already joined need no check
+
+        for members in buckets.values():
+
+            for i, j in itertools.combinations(members, 2):
+
+                if (i, j) in checked or find(i) == find(j):
+
+                    continue
+
+                checked.add((i, j))
+
+                inter = len(shingle_sets[i] & shingle_sets[j])
+
+                union = len(shingle_sets[i] | shingle_sets[j])
+
+                if union and inter / union >= near_dup_threshold:
+
+                    ri, rj = find(i), find(j)
+
+                    parent[max(ri, rj)] = min(ri, rj)
+
+
+
+    roots = np.array([find(i) for i in range(len(uniques))])
+
+    rep_ids, rep_inv = np.unique(roots, return_inverse=True)
+
+    return [uniques[r] for r in rep_ids], rep_inv[codes]
+
+
+
+
+
+def fit_tfidf(texts):
+
+    """
+
+    Cheap lexical vectorizer for preview runs (fit once on the unique CO + PO statements).
+
+    """
+
+    vec = TfidfVectorizer(lowercase=True, ngram_range=(1, 2), sublinear_tf=True)
+
+    vec.fit(list(dict.fromkeys(texts)))
+
+    return vec
+
+
+
+
+
+def _resolve_columns(df, keywords, cols):
+
+    if cols is None:
+
+        return detect_statement_columns(df, keywords)
+
+    missing = [c for c in cols if c not in df.columns]
+
+    if missing:
+
+        raise ValueError(f"Pinned columns not found: {missing}. Columns found: {list(df.columns)}")
+
+    return tuple(cols)
+
+
+
+
+
+def _prepare_statements(co_df: pd.DataFrame, po_df: pd.DataFrame, co_cols=None, po_cols=None):
+
+    # ---- detect columns safely (or use the pinned (id, text) pairs) ----
+
+    co_id_col, co_text_col = _resolve_columns(co_df, CO_ID_KEYWORDS, co_cols)
+
+    po_id_col, po_text_col = _resolve_columns(po_df, PO_ID_KEYWORDS, po_cols)
+
+
+
+    # ---- clean data ----
+
+    co_df = co_df.dropna(subset=[co_text_col])
+
+    po_df = po_df.dropna(subset=[po_text_col])
+
+
+
+    co_ids = co_df[co_id_col].astype(str).str.strip().tolist()
+
+    po_ids = po_df[po_id_col].astype(str).str.strip().tolist()
+
+
+
+    # normalize text a bit
+
+    co_texts = (
+
+        co_df[co_text_col].astype(str).str.replace(r"\s+", " ", regex=True).str.strip().tolist()
+
+    )
+
+    po_texts = (
+
+        po_df[po_text_col].astype(str).str.replace(r"\s+", " ", regex=True).str.strip().tolist()
+
+    )
+
+    return co_ids, co_texts, po_ids, po_texts
+
+
+
+
+
+def _mapping_frame(co_ids, po_ids, sim_matrix, t3=0.75, t2=0.50, t1=0.26) -> pd.DataFrame:
+
+    """
+
+    Long (co, outcome, similarity, weight) rows for a CO x PO similarity block, CO-major.
+
+    Vectorized equivalent of similarity_to_weight over the block.
+
+    """
+
+    sims = np.asarray(sim_matrix, dtype=np.float64).ravel()
+
+    weights = np.select([sims >= t3, sims >= t2, sims >= t1], [3, 2, 1], default=0)
+
+    return pd.DataFrame(
+
+        {
+
+            "co": np.repeat(np.asarray(co_ids, dtype=object), len(po_ids)),
+
+            "outcome": np.tile(np.asarray(po_ids, dtype=object), len(co_ids)),
+
+            # python round() (not np.round) so values match the row-by-row output exactly
+
+            "similarity": np.array([round(x, 4) for x in sims.tolist()], dtype=np.float64),
+
+            "weight": weights.astype(np.int64),
+
+        }
+
+    )
+
+
+
+
+
+def _ckpt(checkpoint_dir, name):
+
+    return None if checkpoint_dir is None else Path(checkpoint_dir) / name
+
+
+
+
+
+def iter_co_po_mapping(
+
+    co_df: pd.DataFrame,
+
+    po_df: pd.DataFrame,
+
+    chunk_size=1024,
+
+    method: str = "bert",
+
+    near_dup_threshold=None,
+
+    stats=None,
+
+    co_cols=None,
+
+    po_cols=None,
+
+    model=None,
+
+    checkpoint_dir=None,
+
+    explain_top_k=0,
+
+    explanations=None,
+
+):
+
+    """
+
+    Yields the CO-PO mapping as DataFrame chunks of at most chunk_size COs (x all POs).
+
+    PO embeddings are computed once. CO statements are deduplicated once over the whole input
+
+    (so near-duplicate groups, and hence the output, match the single-chunk run) and each chunk
+
+    encodes only the representatives it uses, so peak memory is bounded by chunk_size rather
+
+    than by the number of COs. chunk_size=None processes everything as a single chunk.
+
+    Without COs a single empty chunk is yielded, so writers still get the columns.
+
+    stats (optional dict) is filled with prefilter counts.
+
+    co_cols / po_cols (optional): pinned (id_col, text_col) pairs, skipping detection.
+
+    model (optional): registry name or checkpoint path; its calibrated thresholds band the weights.
+
+    checkpoint_dir (optional, BERT only): resumable encoding; PO statements and each CO chunk
+
+    checkpoint under their own subdirectory (see bert_encode_texts). Rerunning with the same
+
+    inputs and directory only redoes the similarity/weight stage.
+
+    explain_top_k (BERT only): for every chunk, also appends the top contributing token pairs of
+
+    its non-zero cells to explanations (list), from the token states of this same encoding pass.
+
+    """
+
+    if method not in ("bert", "tfidf"):
+
+        raise ValueError(f"Unknown similarity method: {method}")
+
+    if explain_top_k and (method != "bert" or explanations is None):
+
+        raise ValueError("explain_top_k needs method='bert' and an explanations list")
+
+
+
+    co_ids, co_texts, po_ids, po_texts = _prepare_statements(co_df, po_df, co_cols=co_cols, po_cols=po_cols)
+
+    t3, t2, t1 = model_thresholds(model) if method == "bert" else _DEFAULT_THRESHOLDS
+
+
+
+    if stats is None:
+
+        stats = {}
+
+    stats.update({"method": method, "co_statements": len(co_texts), "co_encoded": 0})
+
+
+
+    # ---- prefilter: encode each unique statement once ----
+
+    po_unique, po_inv = dedupe_statements(po_texts, near_dup_threshold=near_dup_threshold)
+
+    stats.update({"po_statements": len(po_texts), "po_encoded": len(po_unique)})
+
+
+
+    po_states = [] if explain_top_k else None
+
+    if method == "tfidf":
+
+        vec = fit_tfidf(co_texts + po_texts)
+
+        po_emb = vec.transform(po_unique)
+
+    else:
+
+        # ---- BERT embeddings ----
+
+        po_emb = bert_encode_texts(
+
+            po_unique, batch_size=16, max_length=128, model=model, token_states=po_states,
+
+            checkpoint_dir=_ckpt(checkpoint_dir, "po"),
+
+        )
+
+    if explain_top_k:
+
+        po_tokens = _token_strings(po_unique, model)
+
+
+
+    if not co_texts:
+
+        yield _mapping_frame([], po_ids, np.empty((0, len(po_ids))), t3=t3, t2=t2, t1=t1)
+
+        return
+
+
+
+    all_unique, all_inv = dedupe_statements(co_texts, near_dup_threshold=near_dup_threshold)
+
+    step = chunk_size or len(co_texts)
+
+    for start in range(0, len(co_texts), step):
+
+        chunk_ids = co_ids[start : start + step]
+
+        # representatives this chunk uses, in order of first use
+
+        reps = pd.unique(all_inv[start : start + step])
+
+        co_unique = [all_unique[r] for r in reps]
+
+        co_inv = pd.Index(reps).get_indexer(all_inv[start : start + step])
+
+        stats["co_encoded"] += len(co_unique)
+
+
+
+        co_states = [] if explain_top_k else None
+
+        if method == "tfidf":
+
+            co_emb = vec.transform(co_unique)
+
+        else:
+
+            co_emb = bert_encode_texts(
+
+                co_unique, batch_size=16, max_length=128, model=model, token_states=co_states,
+
+                checkpoint_dir=_ckpt(checkpoint_dir, f"co_{step}_{start:09d}"),
+
+            )
+
+        sim_unique = cosine_similarity(co_emb, po_emb)
+
+
+
+        # fan the unique results back out to every statement
+
+        frame = _mapping_frame(chunk_ids, po_ids, sim_unique[np.ix_(co_inv, po_inv)], t3=t3, t2=t2, t1=t1)
+
+        if explain_top_k:
+
+            explanations.append(
+
+                _explain_chunk(
+
+                    frame, co_inv, po_inv, (co_states, _token_strings(co_unique, model)), (po_states, po_tokens),
+
+                    explain_top_k,
+
+                )
+
+            )
+
+        yield frame
+
+
+
+
+
+def write_co_po_mapping(co_df: pd.DataFrame, po_df: pd.DataFrame, path, chunk_size=1024, **kwargs) -> int:
+
+    """
+
+    Streams the mapping straight to .csv or .parquet without materializing it.
+
+    The CSV is byte-identical to generate_co_po_mapping(...).to_csv(path, index=False).
+
+    Returns the number of rows written.
+
+    """
+
+    path = Path(path)
+
+    suffix = path.suffix.lower()
+
+    if suffix not in (".csv", ".parquet"):
+
+        raise ValueError(f"Unsupported mapping output format: {path.suffix}")
+
+
+
+    n_rows = 0
+
+    writer = None
+
+    try:
+
+        for chunk in iter_co_po_mapping(co_df, po_df, chunk_size=chunk_size, **kwargs):
+
+            if suffix == ".csv":
+
+                chunk.to_csv(path, index=False, header=n_rows == 0, mode="w" if n_rows == 0 else "a")
+
+            else:
+
+                import pyarrow as pa
+
+                import pyarrow.parquet as pq
+
+
+
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+
+                if writer is None:
+
+                    writer = pq.ParquetWriter(str(path), table.schema)
+
+                writer.write_table(table)
+
+            n_rows += len(chunk)
+
+    finally:
+
+        if writer is not None:
+
+            writer.close()
+
+
+
+    return n_rows
+
+
+
+
+
+def generate_co_po_mapping(
+
+    co_df: pd.DataFrame,
+
+    po_df: pd.DataFrame,
+
+    method: str = "bert",
+
+    near_dup_threshold=None,
+
+    co_cols=None,
+
+    po_cols=None,
+
+    model=None,
+
+    checkpoint_dir=None,
+
+) -> pd.DataFrame:
+
+    """
+
+    method: "bert" (final runs) or "tfidf" (fast lexical preview)
+
+    near_dup_threshold: if set, near-duplicate statements share one encoding (see dedupe_statements)
+
+    co_cols / po_cols: optional pinned (id_col, text_col) pairs
+
+    model: optional registry name or checkpoint path (default bert-base-uncased)
+
+    checkpoint_dir: optional directory for resumable BERT encoding (see iter_co_po_mapping)
+
+    """
+
+    stats = {}
+
+    chunks = list(
+
+        iter_co_po_mapping(
+
+            co_df,
+
+            po_df,
+
+            chunk_size=None,
+
+            method=method,
+
+            near_dup_threshold=near_dup_threshold,
+
+            stats=stats,
+
+            co_cols=co_cols,
+
+            po_cols=po_cols,
+
+            model=model,
+
+            checkpoint_dir=checkpoint_dir,
+
+        )
+
+    )
+
+    out = pd.concat(chunks, ignore_index=True)
+
+    out.attrs["prefilter"] = stats
+
+    return out
+
+
+
+
+
+# ---------- Explain mode ----------
+
+_EXPLAIN_COLUMNS = ["co", "outcome", "similarity", "weight", "rank", "co_token", "po_token", "token_sim"]
+
+
+
+
+
+def _token_strings(texts, model=None, max_length=128):
+
+    # the tokens behind bert_encode_texts' token_states (special tokens dropped)
+
+    path = _resolve_model(model)["path"]
+
+    tokenizer, _ = _load_model(path)
+
+    special = _structural_ids(tokenizer)
+
+    ids = tokenize_corpus(texts, max_length=max_length, model=path)
+
+    return [tokenizer.convert_ids_to_tokens(x[~np.isin(x, special)].tolist()) for x in ids]
+
+
+
+
+
+def _top_token_pairs(co_states, po_states, top_k):
+
+    sim = co_states @ po_states.T  # (n_co_tokens, n_po_tokens)
+
+    flat = sim.ravel()
+
+    k = min(top_k, flat.size)
+
+    top = np.argpartition(-flat, k - 1)[:k]
+
+    top = top[np.argsort(-flat[top], kind="stable")]
+
+    return np.unravel_index(top, sim.shape) + (flat[top],)
+
+
+
+
+
+def _explain_chunk(frame, co_inv, po_inv, co_side, po_side, top_k) -> pd.DataFrame:
+
+    """
+
+    Explanation rows for the non-zero cells of one CO-major mapping chunk.
+
+    co_side / po_side: (token_states, token strings) per unique statement; cell i of the
+
+    chunk is CO row i // n_po, so repeated CO ids keep their own statement.
+
+    """
+
+    (co_states, co_tokens), (po_states, po_tokens) = co_side, po_side
+
+    n_po = len(po_inv)
+
+    co, outcome = frame["co"].to_numpy(), frame["outcome"].to_numpy()
+
+    similarity, weight = frame["similarity"].to_numpy(), frame["weight"].to_numpy()
+
+
+
+    rows = []
+
+    for cell in np.flatnonzero(weight > 0):
+
+        ci, pj = co_inv[cell // n_po], po_inv[cell % n_po]
+
+        if not len(co_states[ci]) or not len(po_states[pj]):
+
+            continue
+
+        a, b, sims = _top_token_pairs(co_states[ci], po_states[pj], top_k)
+
+        for rank, (x, y, sim) in enumerate(zip(a, b, sims), start=1):
+
+            rows.append(
+
+                (co[cell], outcome[cell], similarity[cell], weight[cell], rank,
+
+                 co_tokens[ci][x], po_tokens[pj][y], round(float(sim), 4))
+
+            )
+
+    return pd.DataFrame(rows, columns=_EXPLAIN_COLUMNS)
+
+
+
+
+
+def explain_co_po_mapping(
+
+    co_df: pd.DataFrame,
+
+    po_df: pd.DataFrame,
+
+    top_k=3,
+
+    memory_budget_mb=256,
+
+    near_dup_threshold=None,
+
+    co_cols=None,
+
+    po_cols=None,
+
+    model=None,
+
+):
+
+    """
+
+    BERT mapping plus the top contributing (CO token, PO token) pairs for every non-zero cell,
+
+    by cosine similarity of the contextual token embeddings (last_hidden_state) kept from the
+
+    same encoding pass. COs are processed in chunks whose token states fit memory_budget_mb.
+
+    Returns (mapping, explanations); explanation rows are co, outcome, similarity, weight,
+
+    rank, co_token, po_token, token_sim, in mapping order.
+
+    """
+
+    _, bert = _load_bert(model)
+
+    # worst case every CO fills max_length tokens of float32 states
+
+    chunk_size = max(1, int(memory_budget_mb * 2**20) // (128 * bert.config.hidden_size * 4))
+
+
+
+    stats, explanations = {}, []
+
+    chunks = list(
+
+        iter_co_po_mapping(
+
+            co_df,
+
+            po_df,
+
+            chunk_size=chunk_size,
+
+            near_dup_threshold=near_dup_threshold,
+
+            stats=stats,
+
+            co_cols=co_cols,
+
+            po_cols=po_cols,
+
+            model=model,
+
+            explain_top_k=top_k,
+
+            explanations=explanations,
+
+        )
+
+    )
+
+    mapping = pd.concat(chunks, ignore_index=True)
+
+    mapping.attrs["prefilter"] = stats
+
+    explained = pd.concat(explanations, ignore_index=True) if explanations else pd.DataFrame(columns=_EXPLAIN_COLUMNS)
+
+    return mapping, explained
+
+
+
+
+
+# ---------- CO redundancy ----------
+
+def _block_top_k(emb, start, stop, top_k, min_sim, course_codes=None):
+
+    """
+
+    (row, col, sim) of the top_k neighbours of rows start:stop with sim >= min_sim (self excluded).
+
+    course_codes (optional int array): only columns of another course compete for the top_k.
+
+    """
+
+    sims = emb[start:stop] @ emb.T
+
+    sims = np.asarray(sims.todense() if hasattr(sims, "todense") else sims, dtype=np.float32)
+
+    rows = np.arange(stop - start)
+
+    sims[rows, rows + start] = -np.inf
+
+    if course_codes is not None:
+
+        sims[course_codes[start:stop, None] == course_codes[None, :]] = -np.inf
+
+    k = min(top_k, sims.shape[1] - 1)
+
+    if k <= 0:
+
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float32)
+
+    cols = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+
+    vals = np.take_along_axis(sims, cols, axis=1)
+
+    keep = vals >= min_sim
+
+    return np.repeat(rows + start, k)[keep.ravel()], cols[keep], vals[keep]
+
+
+
+
+
+def co_redundancy_pairs(
+
+    co_df: pd.DataFrame,
+
+    top_k=10,
+
+    min_sim=0.9,
+
+    memory_budget_mb=256,
+
+    n_jobs=1,
+
+    cross_course_only=True,
+
+    method: str = "bert",
+
+    course_col="course",
+
+    co_cols=None,
+
+    model=None,
+
+    checkpoint_dir=None,
+
+    stats=None,
+
+):
+
+    """
+
+    Near-duplicate CO pairs over a multi-course CO statements frame (course, co id, statement).
+
+    The CO x CO similarity is computed in row blocks whose float32 block fits memory_budget_mb,
+
+    keeping each CO's top_k neighbours with sim >= min_sim; n_jobs blocks run at once in
+
+    threads (the matmul and partition release the GIL and share one embedding matrix).
+
+    Statements are deduplicated and encoded once (checkpoint_dir as in bert_encode_texts).
+
+    Returns course_a, co_a, course_b, co_b, sim (each pair once, highest sim first).
+
+    """
+
+    if method not in ("bert", "tfidf"):
+
+        raise ValueError(f"Unknown similarity method: {method}")
+
+    if course_col not in co_df.columns:
+
+        raise ValueError(f"Course column '{course_col}' not found. Columns found: {list(co_df.columns)}")
+
+    columns = ["course_a", "co_a", "course_b", "co_b", "sim"]
+
+
+
+    id_col, text_col = _resolve_columns(co_df.drop(columns=[course_col]), CO_ID_KEYWORDS, co_cols)
+
+    co_df = co_df.dropna(subset=[text_col])
+
+    courses = co_df[course_col].astype(str).str.strip().to_numpy(dtype=object)
+
+    co_ids = co_df[id_col].astype(str).str.strip().to_numpy(dtype=object)
+
+    texts = co_df[text_col].astype(str).str.replace(r"\s+", " ", regex=True).str.strip().tolist()
+
+
+
+    unique, inverse = dedupe_statements(texts)
+
+    if stats is None:
+
+        stats = {}
+
+    stats.update({"method": method, "co_statements": len(texts), "co_encoded": len(unique), "blocks": 0})
+
+    if len(texts) < 2:
+
+        return pd.DataFrame(columns=columns)
+
+
+
+    if method == "tfidf":
+
+        emb = fit_tfidf(unique).transform(unique)[inverse].tocsr()
+
+    else:
+
+        emb = bert_encode_texts(unique, batch_size=16, max_length=128, model=model, checkpoint_dir=checkpoint_dir)
+
+        emb = np.ascontiguousarray(emb[inverse], dtype=np.float32)
+
+
+
+    # each in-flight block holds a (block, n) float32 similarity slab, its negation for the
+
+    # partition, the int64 partition indices and the same-course mask
+
+    n = len(texts)
+
+    bytes_per_row = n * (4 + 4 + 8 + 1) * max(n_jobs, 1)
+
+    block = int(min(n, max(1, memory_budget_mb * 2**20 // bytes_per_row)))
+
+    starts = list(range(0, n, block))
+
+    stats["blocks"] = len(starts)
+
+
+
+    # same-course columns are masked before the top_k is taken, so they can't crowd out cross-course pairs
+
+    course_codes = pd.factorize(courses)[0] if cross_course_only else None
+
+
+
+    def run(start):
+
+        return _block_top_k(emb, start, min(start + block, n), top_k, min_sim, course_codes)
+
+
+
+    if n_jobs > 1:
+
+        with ThreadPoolExecutor(max_workers=n_jobs) as ex:
+
+            parts = list(ex.map(run, starts))
+
+    else:
+
+        parts = [run(s) for s in starts]
+
+
+
+    rows = np.concatenate([p[0] for p in parts])
+
+    cols = np.concatenate([p[1] for p in parts])
+
+    sims = np.concatenate([p[2] for p in parts]).astype(np.float64)
+
+
+
+    # a pair found from both ends is reported once, as (lower row, higher row)
+
+    a, b = np.minimum(rows, cols), np.maximum(rows, cols)
+
+    pairs = pd.DataFrame({"a": a, "b": b, "sim": sims}).drop_duplicates(["a", "b"])
+
+    pairs = pairs.sort_values(["sim", "a", "b"], ascending=[False, True, True], kind="stable")
+
+    return pd.DataFrame(
+
+        {
+
+            "course_a": courses[pairs["a"].to_numpy()],
+
+            "co_a": co_ids[pairs["a"].to_numpy()],
+
+            "course_b": courses[pairs["b"].to_numpy()],
+
+            "co_b": co_ids[pairs["b"].to_numpy()],
+
+            "sim": [round(x, 4) for x in pairs["sim"].tolist()],
+
+        },
+
+        columns=columns,
+
+    )
+
+
+
+
+
+def co_redundancy_clusters(pairs: pd.DataFrame, min_sim=None) -> pd.DataFrame:
+
+    """
+
+    Groups COs linked by near-duplicate pairs (connected components over pairs with
+
+    sim >= min_sim, default all pairs). Returns cluster, course, co, size, max_sim,
+
+    largest clusters first; COs without a pair are left out.
+
+    """
+
+    columns = ["cluster", "course", "co", "size", "max_sim"]
+
+    if min_sim is not None:
+
+        pairs = pairs[pairs["sim"] >= min_sim]
+
+    if pairs.empty:
+
+        return pd.DataFrame(columns=columns)
+
+
+
+    a = list(zip(pairs["course_a"], pairs["co_a"]))
+
+    b = list(zip(pairs["course_b"], pairs["co_b"]))
+
+    codes, nodes = pd.factorize(pd.Series(a + b, dtype=object))
+
+    ia, ib = codes[: len(a)], codes[len(a) :]
+
+    graph = sparse.coo_matrix((np.ones(len(ia)), (ia, ib)), shape=(len(nodes), len(nodes)))
+
+    _, labels = connected_components(graph, directed=False)
+
+
+
+    best = np.zeros(len(nodes))
+
+    np.maximum.at(best, ia, pairs["sim"].to_numpy(dtype=np.float64))
+
+    np.maximum.at(best, ib, pairs["sim"].to_numpy(dtype=np.float64))
+
+    out = pd.DataFrame(
+
+        {
+
+            "label": labels,
+
+            "course": [c for c, _ in nodes],
+
+            "co": [c for _, c in nodes],
+
+            "max_sim": best,
+
+        }
+
+    )
+
+    out["size"] = out.groupby("label")["label"].transform("size")
+
+    out["top"] = out.groupby("label")["max_sim"].transform("max")
+
+    out = out.sort_values(["size", "top", "label", "course", "co"], ascending=[False, False, True, True, True], kind="stable")
+
+    out["cluster"] = pd.factorize(out["label"])[0] + 1
+
+    return out[columns].reset_index(drop=True)
+
+
+
+
+
+# ---------- Model calibration / comparison ----------
+
+def _best_cut(sims, positive):
+
+    """
+
+    Threshold on sims that best separates positive (sim >= t) from negative rows.
+
+    """
+
+    order = np.argsort(sims, kind="stable")
+
+    s, pos = sims[order], positive[order]
+
+    # errors if everything from position i upward is predicted positive
+
+    pos_below = np.concatenate([[0], np.cumsum(pos)])
+
+    neg_above = np.concatenate([np.cumsum((~pos)[::-1])[::-1], [0]])
+
+    i = int(np.argmin(pos_below + neg_above))
+
+    if i == 0:
+
+        return float(s[0])
+
+    if i == len(s):
+
+        return float(s[-1]) + 1e-6
+
+    return float((s[i - 1] + s[i]) / 2.0)
+
+
+
+
+
+def calibrate_thresholds(sims, reference_weights):
+
+    """
+
+    Fits (t3, t2, t1) so that banding sims reproduces reference 0-3 weights as closely as possible
+
+    (each cut k separates reference weight >= k from < k).
+
+    """
+
+    sims = np.asarray(sims, dtype=np.float64)
+
+    ref = np.asarray(reference_weights)
+
+    cuts = [_best_cut(sims, ref >= k) for k in (3, 2, 1)]
+
+    # keep t3 >= t2 >= t1
+
+    return tuple(float(c) for c in np.maximum.accumulate(cuts[::-1])[::-1])
+
+
+
+
+
+def _agreement(mapping, reference):
+
+    cols = ["co", "outcome", "weight"] + (["similarity"] if "similarity" in reference else [])
+
+    both = mapping.merge(reference[cols], on=["co", "outcome"], suffixes=("", "_ref"))
+
+    return float((both["weight"] == both["weight_ref"]).mean()) if len(both) else float("nan"), both
+
+
+
+
+
+def calibrate_model(name, co_df, po_df, reference: pd.DataFrame):
+
+    """
+
+    Calibrates a model's thresholds against a reference mapping (co, outcome, weight),
+
+    e.g. a faculty-approved mapping or the bert-base-uncased output. Updates MODEL_REGISTRY.
+
+    """
+
+    if name not in MODEL_REGISTRY:
+
+        register_model(name, name)
+
+    co_ids, co_texts, po_ids, po_texts = _prepare_statements(co_df, po_df)
+
+    sims = cosine_similarity(bert_encode_texts(co_texts, model=name), bert_encode_texts(po_texts, model=name))
+
+    # only the similarity column is used; weights are re-banded below
+
+    _, both = _agreement(_mapping_frame(co_ids, po_ids, sims), reference)
+
+    if both.empty:
+
+        raise ValueError("Reference mapping does not overlap the generated (co, outcome) pairs")
+
+    MODEL_REGISTRY[name]["thresholds"] = calibrate_thresholds(both["similarity"], both["weight_ref"])
+
+    return MODEL_REGISTRY[name]["thresholds"]
+
+
+
+
+
+def compare_models(co_df, po_df, models, reference: pd.DataFrame = None) -> pd.DataFrame:
+
+    """
+
+    Encoding throughput and mapping agreement per model.
+
+    Agreement is measured against reference (co, outcome, weight), or against the first model.
+
+    Returns model, pooling, dim, n_texts, seconds, texts_per_sec, weight_agreement, similarity_spearman
+
+    """
+
+    co_ids, co_texts, po_ids, po_texts = _prepare_statements(co_df, po_df)
+
+    texts = list(dict.fromkeys(co_texts + po_texts))
+
+
+
+    rows, base = [], reference
+
+    for name in models:
+
+        entry = _resolve_model(name)
+
+        bert_encode_texts(texts[:2], model=name)  # load + warm up outside the timing
+
+        start = time.perf_counter()
+
+        emb = bert_encode_texts(texts, model=name)
+
+        seconds = time.perf_counter() - start
+
+
+
+        mapping = generate_co_po_mapping(co_df, po_df, model=name)
+
+        if base is None:
+
+            base = mapping
+
+        agreement, both = _agreement(mapping, base)
+
+        sim_ref = "similarity_ref" if "similarity_ref" in both and base is not mapping else None
+
+        rows.append(
+
+            {
+
+                "model": name,
+
+                "pooling": entry["pooling"],
+
+                "dim": emb.shape[1],
+
+                "n_texts": len(texts),
+
+                "seconds": seconds,
+
+                "texts_per_sec": len(texts) / seconds if seconds > 0 else float("inf"),
+
+                "weight_agreement": agreement,
+
+                "similarity_spearman": both["similarity"].corr(both[sim_ref], method="spearman") if sim_ref else float("nan"),
+
+            }
+
+        )
+
     return pd.DataFrame(rows)
@@ -1,23 +1,113 @@
+from collections.abc import Mapping
+
 from pathlib import Path
 
 
 
-def write_outputs(results: dict, outdir: Path) -> None:
+# result key -> output name (CSV file stem / workbook sheet)
+
+OUTPUTS = (
+
+    ("co_attainment_used", "co_attainment_used"),
+
+    ("co_report", "co_report_with_levels"),
+
+    ("merged_detail", "detail_joined_co_mapping"),
+
+    ("po_long", "po_pso_attainment_long"),
+
+    ("po_matrix_value", "po_pso_matrix_value"),
+
+    ("po_matrix_pct", "po_pso_matrix_percent"),
+
+    ("po_matrix_scale", "po_pso_matrix_scale_of_3"),
+
+    ("po_matrix_target", "po_pso_matrix_target_YN"),
+
+)
+
+_EXCEL_MAX_ROWS = 1_048_576
+
+
+
+
+
+def write_outputs(results: Mapping, outdir: Path) -> None:
+
+    for key, name in OUTPUTS:
+
+        results[key].to_csv(outdir / f"{name}.csv", index=False)
+
+
+
+
+
+def _excel_rows(df, chunk_rows):
+
+    # python scalars in bounded slices; NaN/NA become blank cells
+
+    for start in range(0, len(df), chunk_rows):
+
+        block = df.iloc[start : start + chunk_rows].astype(object)
+
+        block = block.where(block.notna(), None)
+
+        yield from block.itertuples(index=False, name=None)
+
+
+
+
+
+def write_outputs_xlsx(results: Mapping, path, chunk_rows: int = 10_000) -> None:
+
+    """
+
+    Writes every write_outputs artifact as a sheet of one .xlsx workbook.
+
+    Uses xlsxwriter in constant_memory mode (rows are flushed as they are written),
+
+    so memory stays flat for institution-wide results. Sheets longer than Excel's
+
+    row limit continue on "<name>_2", "<name>_3", ...
+
+    """
+
+    import xlsxwriter
+
+
+
+    workbook = xlsxwriter.Workbook(str(path), {"constant_memory": True})
+
+    bold = workbook.add_format({"bold": True})
+
+    try:
+
+        for key, name in OUTPUTS:
+
+            df = results[key]
+
+            header = [str(c) for c in df.columns]
+
+            part, row = 1, _EXCEL_MAX_ROWS
+
+            for values in _excel_rows(df, chunk_rows):
 
-    results["co_attainment_used"].to_csv(outdir / "co_attainment_used.csv", index=False)
+                if row == _EXCEL_MAX_ROWS:
 
-    results["co_report"].to_csv(outdir / "co_report_with_levels.csv", index=False)
+                    sheet = workbook.add_worksheet((name if part == 1 else f"{name}_{part}")[:31])
 
-    results["merged_detail"].to_csv(outdir / "detail_joined_co_mapping.csv", index=False)
+                    sheet.write_row(0, 0, header, bold)
 
-    results["po_long"].to_csv(outdir / "po_pso_attainment_long.csv", index=False)
+                    part, row = part + 1, 1
 
+                sheet.write_row(row, 0, values)
 
+                row += 1
 
-    results["po_matrix_value"].to_csv(outdir / "po_pso_matrix_value.csv", index=False)
+            if part == 1:
 
-    results["po_matrix_pct"].to_csv(outdir / "po_pso_matrix_percent.csv", index=False)
+                workbook.add_worksheet(name[:31]).write_row(0, 0, header, bold)
 
-    results["po_matrix_scale"].to_csv(outdir / "po_pso_matrix_scale_of_3.csv", index=False)
+    finally:
 
-    results["po_matrix_target"].to_csv(outdir / "po_pso_matrix_target_YN.csv", index=False)
+        workbook.close()
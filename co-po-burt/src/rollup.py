@@ -0,0 +1,289 @@
+from typing import Optional
+
+
+
+import numpy as np
+
+import pandas as pd
+
+
+
+
+
+ROLLUP_LEVELS = ("program", "department", "institution")
+
+
+
+
+
+def blend_attainment_types(po_by_type: dict, blend: Optional[dict] = None) -> pd.DataFrame:
+
+    """
+
+    po_by_type: {attainment_type: po_long} from compute_po_attainment_nba / compute_po_aggregates
+
+    blend: {attainment_type: share}, e.g. {"FINAL": 0.8, "SURVEY": 0.2} (direct/indirect).
+
+    Shares are renormalized over the types a (year, course, outcome) actually has.
+
+    Returns year, course, outcome, attainment_value, denom.
+
+    """
+
+    if blend is None:
+
+        if len(po_by_type) != 1:
+
+            raise ValueError("blend is required when more than one attainment_type is given")
+
+        blend = {next(iter(po_by_type)): 1.0}
+
+    blend = {k.upper().strip(): float(v) for k, v in blend.items()}
+
+    missing = set(blend) - {k.upper().strip() for k in po_by_type}
+
+    if missing:
+
+        raise ValueError(f"No PO attainment given for blended attainment types: {missing}")
+
+
+
+    parts = []
+
+    for atype, po in po_by_type.items():
+
+        share = blend.get(atype.upper().strip(), 0.0)
+
+        if share <= 0:
+
+            continue
+
+        part = po[["year", "course", "outcome", "attainment_value", "denom"]].copy()
+
+        part["share"] = share
+
+        parts.append(part)
+
+    df = pd.concat(parts, ignore_index=True)
+
+    for c in ("course", "outcome"):
+
+        df[c] = df[c].astype(str)
+
+    df["sv"] = df["share"] * df["attainment_value"]
+
+    df["sd"] = df["share"] * df["denom"]
+
+
+
+    out = df.groupby(["year", "course", "outcome"], as_index=False, sort=True, observed=True).agg(
+
+        sv=("sv", "sum"), sd=("sd", "sum"), share=("share", "sum")
+
+    )
+
+    out["attainment_value"] = out["sv"] / out["share"]
+
+    out["denom"] = out["sd"] / out["share"]
+
+    return out[["year", "course", "outcome", "attainment_value", "denom"]]
+
+
+
+
+
+def _contributions(course_po: pd.DataFrame, hierarchy: pd.DataFrame, weighting: str) -> pd.DataFrame:
+
+    """
+
+    Additive per-node partial sums (wv, w, n_courses) for every rollup level, in one groupby.
+
+    """
+
+    df = course_po.merge(hierarchy, on="course", how="left")
+
+    for level in ("program", "department"):
+
+        df[level] = df[level].fillna("UNASSIGNED").astype(str)
+
+
+
+    if weighting == "credits":
+
+        w = df["credits"].fillna(1.0).to_numpy(dtype=np.float64) if "credits" in df else np.ones(len(df))
+
+    elif weighting == "mapping":
+
+        w = df["denom"].to_numpy(dtype=np.float64)
+
+    elif weighting == "equal":
+
+        w = np.ones(len(df))
+
+    else:
+
+        raise ValueError(f"Unknown rollup weighting: {weighting}")
+
+
+
+    base = pd.DataFrame(
+
+        {
+
+            "year": df["year"].to_numpy(),
+
+            "outcome": df["outcome"].astype(str).to_numpy(),
+
+            "wv": w * df["attainment_value"].to_numpy(dtype=np.float64),
+
+            "w": w,
+
+            "n_courses": 1,
+
+        }
+
+    )
+
+    nodes = {"program": df["program"].to_numpy(), "department": df["department"].to_numpy(),
+
+             "institution": np.full(len(df), "ALL", dtype=object)}
+
+    long = pd.concat([base.assign(level=lv, node=nodes[lv]) for lv in ROLLUP_LEVELS], ignore_index=True)
+
+    return long.groupby(["level", "node", "year", "outcome"], as_index=False, sort=True, observed=True).agg(
+
+        wv=("wv", "sum"), w=("w", "sum"), n_courses=("n_courses", "sum")
+
+    )
+
+
+
+
+
+def _finalize(sums: pd.DataFrame, targets: Optional[dict]) -> pd.DataFrame:
+
+    out = sums.copy()
+
+    out["attainment_value"] = np.where(out["w"] > 0, out["wv"] / out["w"].where(out["w"] > 0, 1.0), 0.0)
+
+    out["attainment_pct"] = out["attainment_value"] * 100.0
+
+    if targets is not None:
+
+        out["attainment_scale"] = out["attainment_value"] * float(targets.get("scale_max", 3.0))
+
+        out["target_met"] = np.where(out["attainment_scale"] >= float(targets.get("target_level", 1.4)), "Y", "N")
+
+    return out
+
+
+
+
+
+def rollup_po_attainment(
+
+    course_po: pd.DataFrame,
+
+    hierarchy: pd.DataFrame,
+
+    weighting: str = "credits",
+
+    targets: Optional[dict] = None,
+
+) -> pd.DataFrame:
+
+    """
+
+    course_po: year, course, outcome, attainment_value, denom (see blend_attainment_types)
+
+    hierarchy: course, program, department [, credits]
+
+    weighting: "credits" (hierarchy credits, default 1), "mapping" (sum of mapping weights) or "equal"
+
+    Returns level, node, year, outcome, wv, w, n_courses, attainment_value, attainment_pct
+
+    (+ attainment_scale, target_met if targets). wv/w are kept so update_rollup can patch nodes.
+
+    """
+
+    return _finalize(_contributions(course_po, hierarchy, weighting), targets)
+
+
+
+
+
+def update_rollup(
+
+    rollup: pd.DataFrame,
+
+    old_course_po: pd.DataFrame,
+
+    new_course_po: pd.DataFrame,
+
+    hierarchy: pd.DataFrame,
+
+    weighting: str = "credits",
+
+    targets: Optional[dict] = None,
+
+    old_hierarchy: Optional[pd.DataFrame] = None,
+
+) -> pd.DataFrame:
+
+    """
+
+    Re-rolls only the ancestors of changed courses: subtracts the old rows' contributions,
+
+    adds the new ones, and refinalizes just those nodes.
+
+    old_course_po / new_course_po: the previous and replacement rows of the changed course(s).
+
+    old_hierarchy: the hierarchy the rollup was built with, if it has changed since (a course
+
+    moved program/department or changed credits); the old rows are taken out of their old nodes.
+
+    """
+
+    if old_hierarchy is None:
+
+        old_hierarchy = hierarchy
+
+    delta = pd.concat(
+
+        [
+
+            _contributions(old_course_po, old_hierarchy, weighting).assign(sign=-1.0),
+
+            _contributions(new_course_po, hierarchy, weighting).assign(sign=1.0),
+
+        ],
+
+        ignore_index=True,
+
+    )
+
+    keys = ["level", "node", "year", "outcome"]
+
+    sums = ["wv", "w", "n_courses"]
+
+    for c in sums:
+
+        delta[c] = delta[c] * delta["sign"]
+
+    delta = delta.groupby(keys, sort=False, observed=True)[sums].sum()
+
+
+
+    current = rollup.set_index(keys)
+
+    patched = current[sums].reindex(delta.index, fill_value=0) + delta
+
+    patched["n_courses"] = patched["n_courses"].round().astype(np.int64)
+
+    patched = _finalize(patched[patched["n_courses"] > 0].reset_index(), targets)
+
+
+
+    untouched = current.drop(index=delta.index, errors="ignore").reset_index()
+
+    return pd.concat([untouched, patched], ignore_index=True).sort_values(keys, ignore_index=True)
@@ -0,0 +1,553 @@
+import asyncio
+
+import io
+
+import json
+
+import time
+
+from collections import deque
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from typing import Optional
+
+from urllib.parse import parse_qs, urlsplit
+
+
+
+import numpy as np
+
+import pandas as pd
+
+
+
+from src.io_utils import (
+
+    load_co_attainment,
+
+    load_mapping,
+
+    load_thresholds,
+
+    load_targets,
+
+    prepare_co_attainment,
+
+    prepare_mapping,
+
+    prepare_student_co_scores,
+
+)
+
+from src.nba_math import compute_po_attainment_nba
+
+from src.burt import compute_burt_adjustments_from_students
+
+from src import telemetry
+
+
+
+
+
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+
+PROMETHEUS_TEXT = "text/plain; version=0.0.4"
+
+
+
+# Warm reference data, loaded once per process (see init_state)
+
+_STATE = {}
+
+
+
+
+
+def init_state(config: dict) -> None:
+
+    """
+
+    Loads reference mappings/thresholds/targets (and optionally the encoder) into this process.
+
+    Also used as the process-pool initializer, so every worker starts warm.
+
+    """
+
+    _STATE.clear()
+
+    if config.get("co_attainment"):
+
+        _STATE["co_attainment"] = load_co_attainment(config["co_attainment"])
+
+    if config.get("mapping"):
+
+        _STATE["mapping"] = load_mapping(config["mapping"])
+
+    _STATE["thresholds"] = load_thresholds(config["thresholds"]) if config.get("thresholds") else {3: 0.70, 2: 0.60, 1: 0.50}
+
+    _STATE["targets"] = load_targets(config["targets"]) if config.get("targets") else {"target_level": 1.4, "scale_max": 3.0}
+
+    if config.get("po_statements"):
+
+        _STATE["po_statements"] = pd.read_csv(config["po_statements"], encoding="latin1")
+
+    if config.get("warm_encoder"):
+
+        from src.nlp_mapping import _load_bert
+
+
+
+        _load_bert()
+
+
+
+
+
+# ---------- request payload helpers ----------
+
+def _frame(payload: dict, key: str) -> Optional[pd.DataFrame]:
+
+    if key not in payload:
+
+        return None
+
+    value = payload[key]
+
+    return value if isinstance(value, pd.DataFrame) else pd.DataFrame(value)
+
+
+
+
+
+def _thresholds(payload: dict) -> dict:
+
+    if "thresholds" in payload:
+
+        return {int(k): float(v) for k, v in payload["thresholds"].items()}
+
+    return _STATE["thresholds"]
+
+
+
+
+
+def _targets(payload: dict) -> dict:
+
+    return {**_STATE["targets"], **{k: float(v) for k, v in payload.get("targets", {}).items()}}
+
+
+
+
+
+# ---------- CPU work (runs in the pool) ----------
+
+def attainment_job(payload: dict) -> dict:
+
+    co = _frame(payload, "co_attainment")
+
+    co = prepare_co_attainment(co) if co is not None else _STATE.get("co_attainment")
+
+    mapping = _frame(payload, "mapping")
+
+    mapping = prepare_mapping(mapping) if mapping is not None else _STATE.get("mapping")
+
+    if co is None or mapping is None:
+
+        raise ValueError("co_attainment and mapping must be posted or preloaded")
+
+
+
+    course = payload.get("course")
+
+    if course is not None:
+
+        co = co[co["course"] == course]
+
+        mapping = mapping[mapping["course"] == course]
+
+    if payload.get("year") is not None:
+
+        co = co[co["year"] == int(payload["year"])]
+
+
+
+    thresholds = _thresholds(payload)
+
+    assoc = None
+
+    students = _frame(payload, "student_co_scores")
+
+    if students is not None:
+
+        assoc = compute_burt_adjustments_from_students(prepare_student_co_scores(students), thresholds)
+
+
+
+    results = compute_po_attainment_nba(
+
+        co_attainment=co,
+
+        mapping=mapping,
+
+        thresholds=thresholds,
+
+        targets=_targets(payload),
+
+        attainment_type=payload.get("attainment_type", "FINAL"),
+
+        assoc=assoc,
+
+    )
+
+    return {"po_long": results["po_long"], "co_report": results["co_report"]}
+
+
+
+
+
+def confidence_job(payload: dict) -> dict:
+
+    students = _frame(payload, "student_co_scores")
+
+    if students is None:
+
+        raise ValueError("student_co_scores is required")
+
+    return {"assoc": compute_burt_adjustments_from_students(prepare_student_co_scores(students), _thresholds(payload))}
+
+
+
+
+
+def mapping_job(payload: dict) -> dict:
+
+    from src.nlp_mapping import generate_co_po_mapping
+
+
+
+    co = _frame(payload, "co_statements")
+
+    po = _frame(payload, "po_statements")
+
+    po = po if po is not None else _STATE.get("po_statements")
+
+    if co is None or po is None:
+
+        raise ValueError("co_statements (and po_statements unless preloaded) are required")
+
+    return {"mapping": generate_co_po_mapping(co, po, method=payload.get("method", "bert"))}
+
+
+
+
+
+_ROUTES = {
+
+    "/attainment": (attainment_job, "co_attainment"),
+
+    "/confidence": (confidence_job, "student_co_scores"),
+
+    "/mapping": (mapping_job, "co_statements"),
+
+}
+
+
+
+
+
+# ---------- metrics ----------
+
+class LatencyMetrics:
+
+    """
+
+    Per-endpoint request counts, errors and a rolling window of latencies (ms).
+
+    """
+
+
+
+    def __init__(self, window: int = 10000):
+
+        self.window = window
+
+        self.samples = {}
+
+        self.counts = {}
+
+        self.errors = {}
+
+
+
+    def record(self, endpoint: str, ms: float, ok: bool) -> None:
+
+        self.samples.setdefault(endpoint, deque(maxlen=self.window)).append(ms)
+
+        self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+
+        if not ok:
+
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+
+
+    def snapshot(self) -> dict:
+
+        out = {}
+
+        for endpoint, samples in self.samples.items():
+
+            arr = np.fromiter(samples, dtype=np.float64)
+
+            p50, p95, p99 = np.percentile(arr, [50, 95, 99])
+
+            out[endpoint] = {
+
+                "count": self.counts[endpoint],
+
+                "errors": self.errors.get(endpoint, 0),
+
+                "mean_ms": float(arr.mean()),
+
+                "p50_ms": float(p50),
+
+                "p95_ms": float(p95),
+
+                "p99_ms": float(p99),
+
+                "max_ms": float(arr.max()),
+
+            }
+
+        return out
+
+
+
+
+
+# ---------- HTTP front end ----------
+
+def _json_default(o):
+
+    if hasattr(o, "item"):
+
+        return o.item()
+
+    return str(o)
+
+
+
+
+
+def _encode(result: dict, accept: str):
+
+    if ARROW_STREAM in accept:
+
+        import pyarrow as pa
+
+
+
+        # Arrow responses carry the endpoint's primary table
+
+        table = pa.Table.from_pandas(next(iter(result.values())), preserve_index=False)
+
+        sink = pa.BufferOutputStream()
+
+        with pa.ipc.new_stream(sink, table.schema) as w:
+
+            w.write_table(table)
+
+        return ARROW_STREAM, sink.getvalue().to_pybytes()
+
+    body = {k: v.to_dict(orient="records") if isinstance(v, pd.DataFrame) else v for k, v in result.items()}
+
+    return "application/json", json.dumps(body, default=_json_default).encode("utf-8")
+
+
+
+
+
+def _decode(body: bytes, content_type: str, query: dict, table_key: str) -> dict:
+
+    """
+
+    JSON body, or an Arrow IPC stream holding the endpoint's main table with the
+
+    remaining scalar parameters in the query string.
+
+    """
+
+    if content_type.startswith(ARROW_STREAM):
+
+        import pyarrow as pa
+
+
+
+        payload = {k: v[-1] for k, v in query.items()}
+
+        payload[table_key] = pa.ipc.open_stream(io.BytesIO(body)).read_pandas()
+
+        return payload
+
+    payload = json.loads(body or b"{}")
+
+    if not isinstance(payload, dict):
+
+        raise ValueError("JSON body must be an object")
+
+    return payload
+
+
+
+
+
+class AttainmentServer:
+
+    def __init__(self, config: dict, workers: int = 4, pool: str = "thread"):
+
+        self.config = config
+
+        self.metrics = LatencyMetrics()
+
+        if pool == "process":
+
+            self.executor = ProcessPoolExecutor(max_workers=workers, initializer=init_state, initargs=(config,))
+
+        else:
+
+            init_state(config)
+
+            self.executor = ThreadPoolExecutor(max_workers=workers)
+
+
+
+    async def dispatch(self, method: str, target: str, headers: dict, body: bytes):
+
+        url = urlsplit(target)
+
+        if method == "GET" and url.path == "/health":
+
+            return 200, "application/json", b'{"status": "ok"}'
+
+        if method == "GET" and url.path == "/metrics":
+
+            # ?format=prometheus: telemetry counters/histograms of this process (thread pool work included)
+
+            if parse_qs(url.query).get("format", [""])[-1] == "prometheus":
+
+                return 200, PROMETHEUS_TEXT, telemetry.prometheus_text().encode("utf-8")
+
+            return 200, "application/json", json.dumps(self.metrics.snapshot()).encode("utf-8")
+
+        if method != "POST" or url.path not in _ROUTES:
+
+            return 404, "application/json", b'{"error": "not found"}'
+
+
+
+        job, table_key = _ROUTES[url.path]
+
+        start = time.perf_counter()
+
+        ok = False
+
+        try:
+
+            payload = _decode(body, headers.get("content-type", ""), parse_qs(url.query), table_key)
+
+            result = await asyncio.get_running_loop().run_in_executor(self.executor, job, payload)
+
+            ctype, out = _encode(result, headers.get("accept", ""))
+
+            ok = True
+
+            return 200, ctype, out
+
+        except (ValueError, KeyError) as e:
+
+            return 400, "application/json", json.dumps({"error": str(e)}).encode("utf-8")
+
+        except Exception as e:  # keep serving; report the failure to the caller
+
+            return 500, "application/json", json.dumps({"error": repr(e)}).encode("utf-8")
+
+        finally:
+
+            elapsed = time.perf_counter() - start
+
+            self.metrics.record(url.path, elapsed * 1000.0, ok)
+
+            telemetry.observe("copo_http_request_seconds", elapsed, endpoint=url.path, ok=ok)
+
+
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+
+        # minimal HTTP/1.1 with keep-alive
+
+        try:
+
+            while True:
+
+                line = await reader.readline()
+
+                if not line:
+
+                    break
+
+                method, target, _ = line.decode("latin1").split(" ", 2)
+
+                headers = {}
+
+                while True:
+
+                    h = await reader.readline()
+
+                    if h in (b"\r\n", b"\n", b""):
+
+                        break
+
+                    k, v = h.decode("latin1").split(":", 1)
+
+                    headers[k.strip().lower()] = v.strip()
+
+                body = await reader.readexactly(int(headers.get("content-length") or 0))
+
+
+
+                status, ctype, out = await self.dispatch(method.upper(), target, headers, body)
+
+                reason = {200: "OK", 400: "Bad Request", 404: "Not Found"}.get(status, "Internal Server Error")
+
+                writer.write(
+
+                    f"HTTP/1.1 {status} {reason}\r\nContent-Type: {ctype}\r\n"
+
+                    f"Content-Length: {len(out)}\r\n\r\n".encode("latin1") + out
+
+                )
+
+                await writer.drain()
+
+                if headers.get("connection", "").lower() == "close":
+
+                    break
+
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+
+            pass
+
+        finally:
+
+            writer.close()
+
+
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8000) -> None:
+
+        server = await asyncio.start_server(self.handle, host, port)
+
+        async with server:
+
+            await server.serve_forever()
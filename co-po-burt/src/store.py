@@ -0,0 +1,439 @@
+import sqlite3
+
+import time
+
+import uuid
+
+from pathlib import Path
+
+from typing import Optional
+
+
+
+import pandas as pd
+
+
+
+
+
+_SCHEMA = [
+
+    """CREATE TABLE IF NOT EXISTS runs (
+
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+
+        run_id TEXT NOT NULL UNIQUE,
+
+        created_at REAL NOT NULL,
+
+        attainment_type TEXT NOT NULL,
+
+        note TEXT
+
+    )""",
+
+    """CREATE TABLE IF NOT EXISTS po_attainment (
+
+        run_id TEXT NOT NULL,
+
+        year INTEGER NOT NULL,
+
+        course TEXT NOT NULL,
+
+        outcome TEXT NOT NULL,
+
+        attainment_type TEXT NOT NULL,
+
+        numerator REAL,
+
+        denom REAL,
+
+        po_confidence REAL,
+
+        attainment_value REAL,
+
+        attainment_pct REAL,
+
+        attainment_scale REAL,
+
+        target_met TEXT
+
+    )""",
+
+    """CREATE TABLE IF NOT EXISTS co_attainment (
+
+        run_id TEXT NOT NULL,
+
+        year INTEGER NOT NULL,
+
+        course TEXT NOT NULL,
+
+        co TEXT NOT NULL,
+
+        attainment_type TEXT NOT NULL,
+
+        value REAL,
+
+        level INTEGER
+
+    )""",
+
+    """CREATE TABLE IF NOT EXISTS po_bootstrap (
+
+        run_id TEXT NOT NULL,
+
+        year INTEGER NOT NULL,
+
+        course TEXT NOT NULL,
+
+        outcome TEXT NOT NULL,
+
+        attainment_type TEXT NOT NULL,
+
+        attainment_value REAL,
+
+        ci_low REAL,
+
+        ci_high REAL,
+
+        p_target_met REAL,
+
+        n_boot INTEGER
+
+    )""",
+
+    "CREATE INDEX IF NOT EXISTS ix_po_key ON po_attainment (attainment_type, outcome, course, year)",
+
+    "CREATE INDEX IF NOT EXISTS ix_po_run ON po_attainment (run_id)",
+
+    "CREATE INDEX IF NOT EXISTS ix_co_key ON co_attainment (attainment_type, course, co, year)",
+
+    "CREATE INDEX IF NOT EXISTS ix_co_run ON co_attainment (run_id)",
+
+    "CREATE INDEX IF NOT EXISTS ix_boot_key ON po_bootstrap (attainment_type, outcome, course, year)",
+
+    # latest run wins for each (year, course, attainment_type)
+
+    """CREATE VIEW IF NOT EXISTS po_current AS
+
+        SELECT p.* FROM po_attainment p
+
+        JOIN runs r ON r.run_id = p.run_id
+
+        JOIN (
+
+            SELECT p2.year, p2.course, p2.attainment_type, MAX(r2.seq) AS seq
+
+            FROM po_attainment p2 JOIN runs r2 ON r2.run_id = p2.run_id
+
+            GROUP BY p2.year, p2.course, p2.attainment_type
+
+        ) cur ON cur.year = p.year AND cur.course = p.course
+
+             AND cur.attainment_type = p.attainment_type AND cur.seq = r.seq""",
+
+    # precomputed rollups, rebuilt after each ingest
+
+    """CREATE TABLE IF NOT EXISTS rollup_po_yoy (
+
+        attainment_type TEXT, course TEXT, outcome TEXT, year INTEGER,
+
+        attainment_scale REAL, prev_year INTEGER, delta REAL
+
+    )""",
+
+    # mean over all stored courses (the store has no program hierarchy; see src.rollup for that)
+
+    """CREATE TABLE IF NOT EXISTS rollup_po_institution (
+
+        attainment_type TEXT, year INTEGER, outcome TEXT,
+
+        n_courses INTEGER, mean_value REAL, mean_scale REAL, n_target_met INTEGER
+
+    )""",
+
+    """CREATE TABLE IF NOT EXISTS rollup_po_below_target (
+
+        attainment_type TEXT, course TEXT, outcome TEXT,
+
+        n_years INTEGER, n_years_below INTEGER, first_year INTEGER, last_year INTEGER, always_below INTEGER
+
+    )""",
+
+    "CREATE INDEX IF NOT EXISTS ix_yoy ON rollup_po_yoy (attainment_type, outcome, course, year)",
+
+    "CREATE INDEX IF NOT EXISTS ix_institution ON rollup_po_institution (attainment_type, outcome, year)",
+
+    "CREATE INDEX IF NOT EXISTS ix_below ON rollup_po_below_target (attainment_type, always_below, outcome)",
+
+]
+
+
+
+_ROLLUPS = [
+
+    "DELETE FROM rollup_po_yoy",
+
+    """INSERT INTO rollup_po_yoy
+
+        SELECT attainment_type, course, outcome, year, attainment_scale,
+
+               LAG(year) OVER w AS prev_year,
+
+               attainment_scale - LAG(attainment_scale) OVER w AS delta
+
+        FROM po_current
+
+        WINDOW w AS (PARTITION BY attainment_type, course, outcome ORDER BY year)""",
+
+    "DELETE FROM rollup_po_institution",
+
+    """INSERT INTO rollup_po_institution
+
+        SELECT attainment_type, year, outcome, COUNT(*), AVG(attainment_value), AVG(attainment_scale),
+
+               SUM(target_met = 'Y')
+
+        FROM po_current
+
+        GROUP BY attainment_type, year, outcome""",
+
+    "DELETE FROM rollup_po_below_target",
+
+    """INSERT INTO rollup_po_below_target
+
+        SELECT attainment_type, course, outcome, COUNT(*), SUM(target_met = 'N'), MIN(year), MAX(year),
+
+               SUM(target_met = 'N') = COUNT(*)
+
+        FROM po_current
+
+        GROUP BY attainment_type, course, outcome""",
+
+]
+
+
+
+
+
+def open_store(path, create: bool = True) -> sqlite3.Connection:
+
+    """
+
+    Opens the single-file attainment history store.
+
+    create=False is for readers: the file is opened read-only, a missing file raises
+
+    FileNotFoundError (instead of silently creating an empty store) and a file without the
+
+    store tables raises ValueError.
+
+    """
+
+    path = Path(path)
+
+    if not create:
+
+        try:
+
+            conn = sqlite3.connect(path.resolve().as_uri() + "?mode=ro", uri=True)
+
+        except sqlite3.OperationalError:
+
+            raise FileNotFoundError(f"No attainment history store at {path}") from None
+
+        tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+        if "runs" not in tables:
+
+            conn.close()
+
+            raise ValueError(f"{path} is not an attainment history store (written by run.py --store)")
+
+        return conn
+
+    conn = sqlite3.connect(str(path))
+
+    conn.execute("PRAGMA journal_mode=WAL")
+
+    for stmt in _SCHEMA:
+
+        conn.execute(stmt)
+
+    conn.commit()
+
+    return conn
+
+
+
+
+
+def _insert(conn: sqlite3.Connection, table: str, df: pd.DataFrame, columns: list) -> None:
+
+    cols = [df[c].astype(str).tolist() if isinstance(df[c].dtype, pd.CategoricalDtype) else df[c].tolist()
+
+            for c in columns]
+
+    conn.executemany(
+
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+
+        zip(*cols),
+
+    )
+
+
+
+
+
+def refresh_rollups(conn: sqlite3.Connection) -> None:
+
+    for stmt in _ROLLUPS:
+
+        conn.execute(stmt)
+
+    conn.commit()
+
+
+
+
+
+def ingest_run(
+
+    conn: sqlite3.Connection,
+
+    results: dict,
+
+    attainment_type: str,
+
+    run_id: Optional[str] = None,
+
+    bootstrap: Optional[pd.DataFrame] = None,
+
+    note: Optional[str] = None,
+
+) -> str:
+
+    """
+
+    Appends one compute_po_attainment_nba result (po_long, co_report and optional
+
+    bootstrap CIs) under a new run id, then rebuilds the rollup tables.
+
+    """
+
+    run_id = run_id or uuid.uuid4().hex
+
+    atype = attainment_type.upper().strip()
+
+
+
+    po = results["po_long"].assign(run_id=run_id, attainment_type=atype)
+
+    co = results["co_report"].assign(run_id=run_id)
+
+
+
+    with conn:
+
+        conn.execute(
+
+            "INSERT INTO runs (run_id, created_at, attainment_type, note) VALUES (?, ?, ?, ?)",
+
+            (run_id, time.time(), atype, note),
+
+        )
+
+        _insert(conn, "po_attainment", po, [
+
+            "run_id", "year", "course", "outcome", "attainment_type", "numerator", "denom", "po_confidence",
+
+            "attainment_value", "attainment_pct", "attainment_scale", "target_met",
+
+        ])
+
+        _insert(conn, "co_attainment", co, ["run_id", "year", "course", "co", "attainment_type", "value", "level"])
+
+        if bootstrap is not None and not bootstrap.empty:
+
+            _insert(conn, "po_bootstrap", bootstrap.assign(run_id=run_id, attainment_type=atype), [
+
+                "run_id", "year", "course", "outcome", "attainment_type", "attainment_value",
+
+                "ci_low", "ci_high", "p_target_met", "n_boot",
+
+            ])
+
+    refresh_rollups(conn)
+
+    return run_id
+
+
+
+
+
+def po_trend(conn: sqlite3.Connection, outcome: str, course: Optional[str] = None,
+
+             attainment_type: str = "FINAL") -> pd.DataFrame:
+
+    """
+
+    Year-over-year attainment for one outcome (one course, or all courses).
+
+    """
+
+    sql = "SELECT * FROM rollup_po_yoy WHERE attainment_type = ? AND outcome = ?"
+
+    params = [attainment_type.upper().strip(), outcome]
+
+    if course is not None:
+
+        sql += " AND course = ?"
+
+        params.append(course)
+
+    return pd.read_sql_query(sql + " ORDER BY course, year", conn, params=params)
+
+
+
+
+
+def institution_averages(conn: sqlite3.Connection, attainment_type: str = "FINAL") -> pd.DataFrame:
+
+    """
+
+    Per (year, outcome): number of courses, mean attainment and courses meeting the target,
+
+    over every course in the store.
+
+    """
+
+    return pd.read_sql_query(
+
+        "SELECT * FROM rollup_po_institution WHERE attainment_type = ? ORDER BY outcome, year",
+
+        conn,
+
+        params=[attainment_type.upper().strip()],
+
+    )
+
+
+
+
+
+def persistently_below_target(conn: sqlite3.Connection, attainment_type: str = "FINAL",
+
+                              min_years: int = 1) -> pd.DataFrame:
+
+    return pd.read_sql_query(
+
+        "SELECT * FROM rollup_po_below_target WHERE attainment_type = ? AND always_below = 1 AND n_years >= ? "
+
+        "ORDER BY outcome, course",
+
+        conn,
+
+        params=[attainment_type.upper().strip(), min_years],
+
+    )
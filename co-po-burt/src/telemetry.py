@@ -0,0 +1,813 @@
+import contextlib
+
+import contextvars
+
+import functools
+
+import json
+
+import os
+
+import secrets
+
+import tempfile
+
+import threading
+
+import time
+
+import urllib.request
+
+import warnings
+
+from collections import deque
+
+from pathlib import Path
+
+
+
+import pandas as pd
+
+
+
+
+
+# Off unless COPO_METRICS=1 or enable(); every hook returns after one flag check when off
+
+_ENABLED = os.environ.get("COPO_METRICS", "").lower() in ("1", "true", "yes")
+
+_LOCK = threading.Lock()
+
+_COUNTERS = {}  # (name, labels) -> value
+
+_HISTOGRAMS = {}  # (name, labels) -> [buckets, counts, sum, count]
+
+_SPANS = deque(maxlen=10000)  # finished spans waiting for export_spans
+
+_CURRENT = contextvars.ContextVar("copo_span", default=None)
+
+_EXPORTERS = {}  # endpoint -> threading.Event waking its background export thread
+
+
+
+SERVICE_NAME = "co-po-burt"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+ROW_BUCKETS = (10, 100, 1e3, 1e4, 1e5, 1e6, 1e7)
+
+RATE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+
+_HELP = {
+
+    "copo_rows_loaded_total": "Rows returned by each loader",
+
+    "copo_loader_rows": "Rows per loader call (input size)",
+
+    "copo_stage_seconds": "Wall time per pipeline stage",
+
+    "copo_texts_encoded_total": "Statements run through the encoder",
+
+    "copo_texts_encoded_per_second": "Encoder throughput per bert_encode_texts call",
+
+    "copo_cache_requests_total": "Cache lookups by cache and result (hit/miss)",
+
+    "copo_cache_hit_ratio": "Hits / lookups per cache since start",
+
+    "copo_http_request_seconds": "HTTP API latency per endpoint",
+
+    "copo_dashboard_events_total": "Dashboard reruns and cache recomputes",
+
+    "copo_peak_rss_bytes": "Peak resident set size of this process",
+
+}
+
+
+
+
+
+def enable(flag: bool = True) -> None:
+
+    global _ENABLED
+
+    _ENABLED = bool(flag)
+
+
+
+
+
+def enabled() -> bool:
+
+    return _ENABLED
+
+
+
+
+
+def reset() -> None:
+
+    with _LOCK:
+
+        _COUNTERS.clear()
+
+        _HISTOGRAMS.clear()
+
+        _SPANS.clear()
+
+
+
+
+
+def _key(name, labels):
+
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+
+
+
+# ---------- recording ----------
+
+def inc(name: str, value=1, **labels) -> None:
+
+    if not _ENABLED:
+
+        return
+
+    key = _key(name, labels)
+
+    with _LOCK:
+
+        _COUNTERS[key] = _COUNTERS.get(key, 0) + value
+
+
+
+
+
+def observe(name: str, value, buckets=LATENCY_BUCKETS, **labels) -> None:
+
+    if not _ENABLED:
+
+        return
+
+    key = _key(name, labels)
+
+    with _LOCK:
+
+        h = _HISTOGRAMS.get(key)
+
+        if h is None:
+
+            h = _HISTOGRAMS[key] = [tuple(buckets), [0] * len(buckets), 0.0, 0]
+
+        for i, le in enumerate(h[0]):
+
+            if value <= le:
+
+                h[1][i] += 1
+
+                break
+
+        h[2] += value
+
+        h[3] += 1
+
+
+
+
+
+def cache_lookup(cache: str, hits: int = 0, misses: int = 0) -> None:
+
+    if not _ENABLED:
+
+        return
+
+    if hits:
+
+        inc("copo_cache_requests_total", hits, cache=cache, result="hit")
+
+    if misses:
+
+        inc("copo_cache_requests_total", misses, cache=cache, result="miss")
+
+
+
+
+
+def throughput(name: str, n: int, seconds: float, **labels) -> None:
+
+    """
+
+    Counts n items (name_total) and observes n / seconds (name_per_second),
+
+    also set on the enclosing span.
+
+    """
+
+    if not _ENABLED or n <= 0:
+
+        return
+
+    inc(f"{name}_total", n, **labels)
+
+    if seconds > 0:
+
+        observe(f"{name}_per_second", n / seconds, buckets=RATE_BUCKETS, **labels)
+
+        set_attribute(f"{name}_per_second", n / seconds)
+
+
+
+
+
+def set_attribute(key: str, value) -> None:
+
+    # attach an attribute to the innermost open span
+
+    span_rec = _CURRENT.get()
+
+    if span_rec is not None:
+
+        span_rec["attributes"][key] = value
+
+
+
+
+
+@contextlib.contextmanager
+
+def span(name: str, **attributes):
+
+    """
+
+    Times a block as copo_stage_seconds{stage=name} and records it as a span
+
+    (nested spans share the trace of the enclosing one).
+
+    """
+
+    if not _ENABLED:
+
+        yield None
+
+        return
+
+    parent = _CURRENT.get()
+
+    rec = {
+
+        "name": name,
+
+        "trace_id": parent["trace_id"] if parent else secrets.token_hex(16),
+
+        "span_id": secrets.token_hex(8),
+
+        "parent_span_id": parent["span_id"] if parent else "",
+
+        "start_ns": time.time_ns(),
+
+        "attributes": dict(attributes),
+
+        "ok": False,
+
+    }
+
+    token = _CURRENT.set(rec)
+
+    start = time.perf_counter()
+
+    try:
+
+        yield rec
+
+        rec["ok"] = True
+
+    finally:
+
+        seconds = time.perf_counter() - start
+
+        _CURRENT.reset(token)
+
+        rec["end_ns"] = rec["start_ns"] + int(seconds * 1e9)
+
+        observe("copo_stage_seconds", seconds, stage=name)
+
+        with _LOCK:
+
+            _SPANS.append(rec)
+
+
+
+
+
+def stage(name: str):
+
+    """
+
+    Decorator form of span().
+
+    """
+
+    def wrap(fn):
+
+        @functools.wraps(fn)
+
+        def inner(*args, **kwargs):
+
+            if not _ENABLED:
+
+                return fn(*args, **kwargs)
+
+            with span(name):
+
+                return fn(*args, **kwargs)
+
+
+
+        return inner
+
+
+
+    return wrap
+
+
+
+
+
+def _rows(loader, n):
+
+    inc("copo_rows_loaded_total", n, loader=loader)
+
+    observe("copo_loader_rows", n, buckets=ROW_BUCKETS, loader=loader)
+
+
+
+
+
+def _count_chunks(loader, chunks):
+
+    n = 0
+
+    for chunk in chunks:
+
+        n += len(chunk)
+
+        inc("copo_rows_loaded_total", len(chunk), loader=loader)
+
+        yield chunk
+
+    observe("copo_loader_rows", n, buckets=ROW_BUCKETS, loader=loader)
+
+
+
+
+
+def rows_loaded(loader: str):
+
+    """
+
+    Decorator for loaders: counts the rows of the returned frame, dict of frames
+
+    (workbook sheets) or dict of settings; chunk iterators are counted as they are consumed.
+
+    """
+
+    def wrap(fn):
+
+        @functools.wraps(fn)
+
+        def inner(*args, **kwargs):
+
+            out = fn(*args, **kwargs)
+
+            if not _ENABLED:
+
+                return out
+
+            if isinstance(out, pd.DataFrame):
+
+                _rows(loader, len(out))
+
+            elif isinstance(out, dict):
+
+                frames = [v for v in out.values() if isinstance(v, pd.DataFrame)]
+
+                _rows(loader, sum(len(f) for f in frames) if frames else len(out))
+
+            elif hasattr(out, "__next__"):
+
+                return _count_chunks(loader, out)
+
+            return out
+
+
+
+        return inner
+
+
+
+    return wrap
+
+
+
+
+
+def peak_rss_bytes() -> int:
+
+    try:
+
+        import resource
+
+    except ImportError:  # not available on Windows
+
+        return 0
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # kilobytes on Linux, bytes on macOS
+
+    return int(peak if os.uname().sysname == "Darwin" else peak * 1024)
+
+
+
+
+
+# ---------- export ----------
+
+def _fmt_labels(labels, extra=()):
+
+    items = list(labels) + list(extra)
+
+    if not items:
+
+        return ""
+
+    esc = [(k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in items]
+
+    return "{" + ",".join(f'{k}="{v}"' for k, v in esc) + "}"
+
+
+
+
+
+def _fmt_value(v):
+
+    if v == float("inf"):
+
+        return "+Inf"
+
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+
+
+
+def prometheus_text() -> str:
+
+    """
+
+    All metrics in the Prometheus text exposition format (version 0.0.4).
+
+    """
+
+    with _LOCK:
+
+        counters = dict(_COUNTERS)
+
+        histograms = {k: [h[0], list(h[1]), h[2], h[3]] for k, h in _HISTOGRAMS.items()}
+
+
+
+    # hit ratio per cache, derived from the lookup counters
+
+    lookups = {}
+
+    for (name, labels), v in counters.items():
+
+        if name == "copo_cache_requests_total":
+
+            d = dict(labels)
+
+            hit_total = lookups.setdefault(d["cache"], [0, 0])
+
+            hit_total[0] += v if d["result"] == "hit" else 0
+
+            hit_total[1] += v
+
+    gauges = {("copo_cache_hit_ratio", (("cache", c),)): h / t for c, (h, t) in lookups.items() if t}
+
+    gauges[("copo_peak_rss_bytes", ())] = peak_rss_bytes()
+
+
+
+    lines = []
+
+    for kind, series in (("counter", counters), ("gauge", gauges), ("histogram", histograms)):
+
+        for name in sorted({n for n, _ in series}):
+
+            lines.append(f"# HELP {name} {_HELP.get(name, name)}")
+
+            lines.append(f"# TYPE {name} {kind}")
+
+            for (n, labels), v in sorted(series.items()):
+
+                if n != name:
+
+                    continue
+
+                if kind != "histogram":
+
+                    lines.append(f"{name}{_fmt_labels(labels)} {_fmt_value(v)}")
+
+                    continue
+
+                buckets, counts, total, count = v
+
+                cumulative = 0
+
+                for le, c in zip(buckets, counts):
+
+                    cumulative += c
+
+                    lines.append(f"{name}_bucket{_fmt_labels(labels, [('le', _fmt_value(float(le)))])} {cumulative}")
+
+                lines.append(f"{name}_bucket{_fmt_labels(labels, [('le', '+Inf')])} {count}")
+
+                lines.append(f"{name}_sum{_fmt_labels(labels)} {_fmt_value(float(total))}")
+
+                lines.append(f"{name}_count{_fmt_labels(labels)} {count}")
+
+    return "\n".join(lines) + "\n"
+
+
+
+
+
+def write_prometheus(path) -> None:
+
+    """
+
+    Writes prometheus_text() atomically, for the node_exporter textfile collector.
+
+    """
+
+    path = Path(path)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # unique temp name: Streamlit sessions flush from threads of one process
+
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+
+    try:
+
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+
+            fh.write(prometheus_text())
+
+        os.replace(tmp, path)
+
+    except BaseException:
+
+        Path(tmp).unlink(missing_ok=True)
+
+        raise
+
+
+
+
+
+def _otlp_value(v):
+
+    if isinstance(v, bool):
+
+        return {"boolValue": v}
+
+    if isinstance(v, int):
+
+        return {"intValue": str(v)}
+
+    if isinstance(v, float):
+
+        return {"doubleValue": v}
+
+    return {"stringValue": str(v)}
+
+
+
+
+
+def otlp_payload(spans) -> dict:
+
+    """
+
+    OTLP/HTTP JSON (ExportTraceServiceRequest) body for finished spans.
+
+    """
+
+    return {
+
+        "resourceSpans": [
+
+            {
+
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+
+                "scopeSpans": [
+
+                    {
+
+                        "scope": {"name": SERVICE_NAME},
+
+                        "spans": [
+
+                            {
+
+                                "traceId": s["trace_id"],
+
+                                "spanId": s["span_id"],
+
+                                "parentSpanId": s["parent_span_id"],
+
+                                "name": s["name"],
+
+                                "kind": 1,
+
+                                "startTimeUnixNano": str(s["start_ns"]),
+
+                                "endTimeUnixNano": str(s["end_ns"]),
+
+                                "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s["attributes"].items()],
+
+                                "status": {"code": 1 if s["ok"] else 2},
+
+                            }
+
+                            for s in spans
+
+                        ],
+
+                    }
+
+                ],
+
+            }
+
+        ]
+
+    }
+
+
+
+
+
+def export_spans(endpoint: str = "http://localhost:4318/v1/traces", timeout: float = 5.0) -> int:
+
+    """
+
+    Sends the finished spans to an OTLP/HTTP collector as JSON. The queue is drained up front,
+
+    so spans finishing during the POST wait for the next export; on failure the batch is
+
+    requeued ahead of them (the oldest are dropped if that overflows the queue). A batch that
+
+    cannot be serialized is dropped, so one bad span doesn't block every later export.
+
+    Returns the number of spans sent.
+
+    """
+
+    with _LOCK:
+
+        spans = list(_SPANS)
+
+        _SPANS.clear()
+
+    if not spans:
+
+        return 0
+
+    req = urllib.request.Request(
+
+        endpoint,
+
+        data=json.dumps(otlp_payload(spans)).encode("utf-8"),
+
+        headers={"Content-Type": "application/json"},
+
+        method="POST",
+
+    )
+
+    try:
+
+        with urllib.request.urlopen(req, timeout=timeout):
+
+            pass
+
+    except BaseException:
+
+        with _LOCK:
+
+            newer = list(_SPANS)
+
+            _SPANS.clear()
+
+            _SPANS.extend(spans + newer)
+
+        raise
+
+    return len(spans)
+
+
+
+
+
+def _export_loop(endpoint, wake):
+
+    # anything raised here would end the thread and silently stop exporting for the process
+
+    while True:
+
+        wake.wait()
+
+        wake.clear()
+
+        try:
+
+            export_spans(endpoint)
+
+        except Exception as e:
+
+            warnings.warn(f"Could not export spans to {endpoint}: {e!r}", RuntimeWarning)
+
+
+
+
+
+def _export_in_background(endpoint) -> None:
+
+    with _LOCK:
+
+        wake = _EXPORTERS.get(endpoint)
+
+        if wake is None:
+
+            wake = _EXPORTERS[endpoint] = threading.Event()
+
+            threading.Thread(target=_export_loop, args=(endpoint, wake), daemon=True, name="copo-otlp").start()
+
+    wake.set()
+
+
+
+
+
+def flush(metrics_file=None, otlp_endpoint=None, wait=True) -> None:
+
+    """
+
+    Exports whatever is configured; unset targets fall back to COPO_METRICS_FILE / COPO_OTLP_ENDPOINT.
+
+    wait=False hands the span export to a background thread (one per endpoint), for callers
+
+    such as the dashboard that must not block on the collector.
+
+    Export failures only warn: telemetry must not fail the run; unsent spans stay queued.
+
+    """
+
+    if not _ENABLED:
+
+        return
+
+    metrics_file = metrics_file or os.environ.get("COPO_METRICS_FILE")
+
+    otlp_endpoint = otlp_endpoint or os.environ.get("COPO_OTLP_ENDPOINT")
+
+    if metrics_file:
+
+        try:
+
+            write_prometheus(metrics_file)
+
+        except OSError as e:
+
+            warnings.warn(f"Could not write metrics to {metrics_file}: {e}", RuntimeWarning)
+
+    if otlp_endpoint and not wait:
+
+        _export_in_background(otlp_endpoint)
+
+    elif otlp_endpoint:
+
+        try:
+
+            export_spans(otlp_endpoint)
+
+        except Exception as e:
+
+            warnings.warn(f"Could not export spans to {otlp_endpoint}: {e}", RuntimeWarning)
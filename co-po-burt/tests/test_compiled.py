@@ -0,0 +1,91 @@
+import pandas as pd
+
+import pytest
+
+
+
+from src.compiled import compile_frames, is_compiled
+
+from src.io_utils import load_co_attainment, load_mapping, prepare_co_attainment, prepare_mapping
+
+
+
+
+
+def _frames(courses):
+
+    co = prepare_co_attainment(pd.DataFrame({
+
+        "year": [2024] * len(courses),
+
+        "course": courses,
+
+        "co": ["CO1"] * len(courses),
+
+        "attainment_type": ["FINAL"] * len(courses),
+
+        "value": [0.5] * len(courses),
+
+    }))
+
+    mapping = prepare_mapping(pd.DataFrame({
+
+        "course": courses,
+
+        "co": ["CO1"] * len(courses),
+
+        "outcome": ["PO1"] * len(courses),
+
+        "weight": [3] * len(courses),
+
+    }))
+
+    return {"co_attainment": co, "mapping": mapping}
+
+
+
+
+
+def test_recompile_with_changed_categories(tmp_path):
+
+    out = tmp_path / "compiled"
+
+    first = _frames(["CS601", "CS602"])
+
+    first["extra"] = first["mapping"].copy()
+
+    compile_frames(first, out)
+
+
+
+    compile_frames(_frames(["CS603", "CS601", "CS604"]), out)
+
+
+
+    co = load_co_attainment(str(out / "co_attainment"))
+
+    mapping = load_mapping(str(out / "mapping"))
+
+    assert sorted(co["course"].astype(str)) == ["CS601", "CS603", "CS604"]
+
+    assert sorted(mapping["course"].astype(str)) == ["CS601", "CS603", "CS604"]
+
+    # datasets from the earlier compile don't survive the recompile
+
+    assert not is_compiled(out / "extra")
+
+    assert [p.name for p in tmp_path.iterdir()] == ["compiled"]
+
+
+
+
+
+def test_refuses_to_replace_unrelated_directory(tmp_path):
+
+    (tmp_path / "notes.txt").write_text("keep me")
+
+    with pytest.raises(ValueError, match="already exists"):
+
+        compile_frames(_frames(["CS601"]), tmp_path)
+
+    assert (tmp_path / "notes.txt").read_text() == "keep me"
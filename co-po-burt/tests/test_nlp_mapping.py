@@ -0,0 +1,51 @@
+import numpy as np
+
+
+
+from src import nlp_mapping
+
+from src.nlp_mapping import dedupe_statements
+
+
+
+
+
+def test_near_duplicates_found_when_bucket_is_shared_with_unrelated_statement(monkeypatch):
+
+    # identical signatures put all three statements in one bucket of every band,
+
+    # so the 2nd and 3rd are only ever candidates alongside the unrelated 1st
+
+    monkeypatch.setattr(
+
+        nlp_mapping, "_minhash", lambda sets, num_perm=64: np.zeros((len(sets), num_perm), dtype=np.uint64)
+
+    )
+
+    texts = [
+
+        "Evaluate sorting algorithms for time complexity",
+
+        "Design relational database schemas using normal forms and keys",
+
+        "Design relational database schemas using normal forms and constraints",
+
+    ]
+
+    unique, inverse = dedupe_statements(texts, near_dup_threshold=0.6)
+
+    assert len(unique) == 2
+
+    assert inverse[1] == inverse[2] != inverse[0]
+
+
+
+
+
+def test_exact_duplicates_always_collapse():
+
+    unique, inverse = dedupe_statements(["Apply graph search", "Apply graph search", "Explain caching"])
+
+    assert unique == ["Apply graph search", "Explain caching"]
+
+    assert list(inverse) == [0, 0, 1]